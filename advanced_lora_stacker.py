@@ -3,11 +3,2148 @@ Advanced LoRA Stacker Node
 Combines dynamic UI, LoRA preset functionality, and sophisticated random strength distribution.
 """
 
+import ast
+import asyncio
+import hashlib
+import importlib
 import json
+import logging
+import math
+import os
 import random
-import folder_paths
-import comfy.sd
-import comfy.utils
+import re
+import struct
+import threading
+import time
+import tracemalloc
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext, suppress
+
+import numpy as np
+import torch
+
+import safetensors
+import safetensors.torch
+
+
+class _LazyModule:
+    """
+    Stand-in for a module that is imported on first attribute access.
+    Submodules resolve the same way, so comfy.sd.load_lora_for_models imports comfy.sd
+    only when first used; a submodule that cannot be imported is a missing attribute.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if attr.startswith("__"):
+            raise AttributeError(attr)
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        try:
+            return getattr(self._module, attr)
+        except AttributeError:
+            pass
+        try:
+            return importlib.import_module(f"{self._name}.{attr}")
+        except ImportError:
+            raise AttributeError(f"module {self._name!r} has no attribute {attr!r}") from None
+
+
+# ComfyUI modules are imported on first execution, so registering the nodes stays cheap
+folder_paths = _LazyModule("folder_paths")
+comfy = _LazyModule("comfy")
+
+try:
+    import psutil
+except ImportError:
+    # ComfyUI ships psutil; without it free memory is read from /proc/meminfo
+    psutil = None
+
+try:
+    from aiohttp import web
+    from server import PromptServer
+except ImportError:
+    # Standalone tests and scripts run without the ComfyUI server
+    PromptServer = None
+
+
+logger = logging.getLogger(__name__)
+
+
+def _env_int(name, default):
+    """Integer setting from the environment; a malformed value is logged and replaced by the default."""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        logger.warning(f"Ignoring {name}={value!r}: expected an integer, using {default}")
+        return default
+
+
+def _set_log_level(name, default):
+    level = os.environ.get(name, default).upper()
+    try:
+        logger.setLevel(level)
+    except (TypeError, ValueError):
+        logger.setLevel(default)
+        logger.warning(f"Ignoring {name}={level!r}: unknown log level, using {default}")
+
+
+# Set to WARNING to silence the per-execution console report
+_set_log_level("ADVANCED_LORA_STACKER_LOG_LEVEL", "INFO")
+
+# Default memory budget for loaded LoRA tensors, overridable via environment variable
+DEFAULT_LORA_CACHE_MB = _env_int("ADVANCED_LORA_STACKER_CACHE_MB", 1024)
+
+# Number of patched model/CLIP results remembered for reuse
+RESULT_CACHE_SIZE = _env_int("ADVANCED_LORA_STACKER_RESULT_CACHE", 8)
+
+# Number of threads reading LoRA files ahead of patching
+PREFETCH_WORKERS = _env_int("ADVANCED_LORA_STACKER_PREFETCH_WORKERS", 4)
+
+# Process-wide memory limits shared by all stacker nodes; 0 disables the respective check
+MEMORY_BUDGET_MB = _env_int("ADVANCED_LORA_STACKER_MEMORY_MB", 0)
+MIN_FREE_MEMORY_MB = _env_int("ADVANCED_LORA_STACKER_MIN_FREE_MB", 512)
+
+# Disk budget for fused stack patches persisted across restarts; 0 disables the disk cache
+DEFAULT_FUSED_CACHE_MB = _env_int("ADVANCED_LORA_STACKER_FUSED_CACHE_MB", 2048)
+
+# Number of recently used LoRAs preloaded into the cache after startup; 0 disables the warm-up
+WARMUP_LORAS = _env_int("ADVANCED_LORA_STACKER_WARMUP_LORAS", 0)
+WARMUP_DELAY_SECONDS = 5.0
+
+# Precision loaded LoRA tensors are kept in; "original" keeps the dtype stored in the file
+LORA_PRECISIONS = {"original": None, "fp16": torch.float16, "bf16": torch.bfloat16}
+DEFAULT_LORA_PRECISION = os.environ.get("ADVANCED_LORA_STACKER_LORA_PRECISION", "original").lower()
+
+
+def _state_dict_nbytes(state_dict):
+    """Return the number of bytes held by the tensors in a state dict."""
+    total = 0
+    for value in state_dict.values():
+        try:
+            total += value.numel() * value.element_size()
+        except AttributeError:
+            continue
+    return total
+
+
+class StageTimer:
+    """
+    Collects timing spans for the stages of one execution.
+    Spans may be recorded from prefetch worker threads.
+    With a MemoryProfiler attached, every span also records memory before and after it.
+    """
+
+    def __init__(self, profiler=None):
+        self.spans = []
+        self.profiler = profiler
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds, lora=None, memory=None):
+        span = {"stage": stage, "seconds": seconds}
+        if lora is not None:
+            span["lora"] = lora
+        if memory is not None:
+            span["memory"] = memory
+        with self._lock:
+            self.spans.append(span)
+
+    @contextmanager
+    def span(self, stage, lora=None):
+        profiler = self.profiler
+        before = profiler.sample() if profiler is not None else None
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            memory = None
+            if profiler is not None:
+                memory = profiler.describe_change(before, profiler.sample())
+            self.add(stage, seconds, lora, memory)
+
+    def to_dict(self):
+        with self._lock:
+            spans = list(self.spans)
+        stages = {}
+        for span in spans:
+            stages[span["stage"]] = stages.get(span["stage"], 0.0) + span["seconds"]
+        return {
+            "total_seconds": time.perf_counter() - self._start,
+            "stages": stages,
+            "spans": spans,
+        }
+
+
+_TIMING_LISTENERS = []
+
+
+def add_timing_listener(callback):
+    """Subscribe callback(timings_dict) to the timings of every stacker execution."""
+    _TIMING_LISTENERS.append(callback)
+
+
+def remove_timing_listener(callback):
+    if callback in _TIMING_LISTENERS:
+        _TIMING_LISTENERS.remove(callback)
+
+
+def _publish_timings(timer):
+    timings = timer.to_dict()
+    for callback in list(_TIMING_LISTENERS):
+        try:
+            callback(timings)
+        except Exception:
+            logger.exception("Timing listener failed")
+    return timings
+
+
+@contextmanager
+def _span(timer, stage, lora=None):
+    """timer.span() that tolerates a missing timer."""
+    if timer is None:
+        yield
+    else:
+        with timer.span(stage, lora):
+            yield
+
+
+class LoraCache:
+    """
+    Process-wide LRU cache of loaded LoRA state dicts, bounded by tensor bytes.
+    Entries are keyed by resolved path plus file mtime and size, so a replaced file is reloaded,
+    or by content hash once LORA_INDEX has hashed the file.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def file_key(path):
+        """Build a cache key from a file path, or None if the file cannot be stat'ed."""
+        try:
+            stat = os.stat(path)
+        except (OSError, TypeError):
+            return None
+        return (path, stat.st_mtime_ns, stat.st_size)
+
+    def peek(self, key):
+        """Look up an entry without touching the hit/miss counters."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, state_dict):
+        nbytes = _state_dict_nbytes(state_dict)
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+            if nbytes > self.max_bytes:
+                return
+            self._entries[key] = (state_dict, nbytes)
+            self.current_bytes += nbytes
+            self._evict_locked()
+
+    def reserve(self, nbytes):
+        """
+        Evict least recently used entries so an entry of nbytes fits without exceeding max_bytes.
+        Returns False, evicting nothing, if it could never fit.
+        """
+        with self._lock:
+            if nbytes > self.max_bytes:
+                return False
+            while self.current_bytes + nbytes > self.max_bytes and self._entries:
+                _, (_, size) = self._entries.popitem(last=False)
+                self.current_bytes -= size
+                self.evictions += 1
+            return True
+
+    def rekey(self, old_prefix, new_prefix):
+        """
+        Move the entries of one file key (the key minus blocks and precision) to another,
+        e.g. once the file's content hash is known. Entries the new key already has are
+        kept and the moved duplicates dropped.
+        """
+        with self._lock:
+            for key in [key for key in self._entries if key[:-2] == old_prefix]:
+                state_dict, nbytes = self._entries.pop(key)
+                new_key = new_prefix + key[-2:]
+                if new_key in self._entries:
+                    self.current_bytes -= nbytes
+                else:
+                    self._entries[new_key] = (state_dict, nbytes)
+
+    def set_max_bytes(self, max_bytes):
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict_locked()
+
+    def evict_bytes(self, nbytes):
+        """Evict least recently used entries until at least nbytes are freed; returns the bytes freed."""
+        freed = 0
+        with self._lock:
+            while freed < nbytes and self._entries:
+                _, (_, size) = self._entries.popitem(last=False)
+                self.current_bytes -= size
+                self.evictions += 1
+                freed += size
+        return freed
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def _evict_locked(self):
+        while self.current_bytes > self.max_bytes and self._entries:
+            _, (_, nbytes) = self._entries.popitem(last=False)
+            self.current_bytes -= nbytes
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def summary(self):
+        stats = self.stats()
+        return (
+            f"LoRA cache: {stats['hits']} hit(s), {stats['misses']} miss(es), "
+            f"{stats['evictions']} eviction(s), {stats['entries']} entr(ies), "
+            f"{stats['bytes'] / 2**20:.1f}/{stats['max_bytes'] / 2**20:.1f} MB"
+        )
+
+
+LORA_CACHE = LoraCache(DEFAULT_LORA_CACHE_MB * 2**20)
+
+
+def available_memory_bytes():
+    """Free system RAM in bytes (MemAvailable), or None where it cannot be determined."""
+    if psutil is not None:
+        return psutil.virtual_memory().available
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+class MemoryBudget:
+    """
+    Process-wide memory accounting for everything the stacker nodes hold.
+    Registered pools report their bytes and may free them; when the total exceeds
+    max_bytes, or free system RAM drops below min_free_bytes, enforce() evicts from the
+    reclaimable pools in registration order. Bytes the stacker hands out (fused patches
+    inside patched models) are tracked until their owner is garbage collected.
+    """
+
+    def __init__(self, max_bytes=0, min_free_bytes=0):
+        self.max_bytes = max_bytes
+        self.min_free_bytes = min_free_bytes
+        self.evictions = 0
+        self.evicted_bytes = 0
+        self._pools = OrderedDict()
+        self._tracked = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, usage, evict=None):
+        """Add a pool: usage() returns its bytes, evict(nbytes) frees about nbytes and returns the bytes freed."""
+        with self._lock:
+            self._pools[name] = (usage, evict)
+
+    def track(self, name, owner, nbytes):
+        """Count nbytes under name for as long as owner is alive."""
+        if owner is None or nbytes <= 0:
+            return
+        try:
+            weakref.finalize(owner, self._release, name, nbytes)
+        except TypeError:
+            return
+        with self._lock:
+            self._tracked[name] = self._tracked.get(name, 0) + nbytes
+
+    def _release(self, name, nbytes):
+        with self._lock:
+            self._tracked[name] -= nbytes
+
+    def usage(self):
+        """Bytes per pool and tracked category."""
+        with self._lock:
+            pools = list(self._pools.items())
+            usage = dict(self._tracked)
+        for name, (pool_usage, _) in pools:
+            usage[name] = pool_usage()
+        return usage
+
+    def enforce(self):
+        """Evict from reclaimable pools until back within the limits; returns the bytes freed."""
+        excess = 0
+        if self.max_bytes > 0:
+            excess = sum(self.usage().values()) - self.max_bytes
+        if self.min_free_bytes > 0:
+            available = available_memory_bytes()
+            if available is not None:
+                excess = max(excess, self.min_free_bytes - available)
+        if excess <= 0:
+            return 0
+
+        with self._lock:
+            evictors = [(name, evict) for name, (_, evict) in self._pools.items() if evict is not None]
+        freed = 0
+        for name, evict in evictors:
+            freed += evict(excess - freed)
+            if freed >= excess:
+                break
+        if freed:
+            with self._lock:
+                self.evictions += 1
+                self.evicted_bytes += freed
+            logger.debug(f"Memory budget evicted {freed / 2**20:.1f} MB")
+        return freed
+
+    def stats(self):
+        usage = self.usage()
+        return {
+            "usage": usage,
+            "total_bytes": sum(usage.values()),
+            "max_bytes": self.max_bytes,
+            "min_free_bytes": self.min_free_bytes,
+            "available_bytes": available_memory_bytes(),
+            "evictions": self.evictions,
+            "evicted_bytes": self.evicted_bytes,
+        }
+
+
+MEMORY_BUDGET = MemoryBudget(MEMORY_BUDGET_MB * 2**20, MIN_FREE_MEMORY_MB * 2**20)
+# Looked up at call time, so replacing LORA_CACHE keeps the accounting correct
+MEMORY_BUDGET.register("lora_cache", lambda: LORA_CACHE.current_bytes, lambda nbytes: LORA_CACHE.evict_bytes(nbytes))
+
+
+def process_rss_bytes():
+    """Resident set size of this process in bytes, or None where it cannot be determined."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class MemoryProfiler:
+    """
+    Samples the Python heap (tracemalloc), process RSS and the tensor bytes held by the
+    stacker (MEMORY_BUDGET usage) for the spans of a StageTimer, and keeps the peak of
+    each over the profiled execution.
+    tracemalloc is started by the first running profiler and stopped by the last, unless
+    it was already tracing; concurrent profilers therefore share one heap peak.
+    """
+
+    _running = 0
+    _owns_tracing = False
+    _tracing_lock = threading.Lock()
+
+    def __init__(self):
+        self.peak_rss_bytes = None
+        self.peak_tensor_bytes = 0
+        self.peak_heap_bytes = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        cls = MemoryProfiler
+        with cls._tracing_lock:
+            if cls._running == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                cls._owns_tracing = True
+            if cls._running == 0:
+                tracemalloc.reset_peak()
+            cls._running += 1
+        self.sample()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.sample()
+        cls = MemoryProfiler
+        with cls._tracing_lock:
+            self.peak_heap_bytes = max(self.peak_heap_bytes, tracemalloc.get_traced_memory()[1])
+            cls._running -= 1
+            if cls._running == 0 and cls._owns_tracing:
+                tracemalloc.stop()
+                cls._owns_tracing = False
+        return False
+
+    def sample(self):
+        """Current memory as {"python_heap_bytes", "rss_bytes", "tensor_bytes"}; updates the peaks."""
+        heap = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+        rss = process_rss_bytes()
+        tensors = sum(MEMORY_BUDGET.usage().values())
+        with self._lock:
+            if rss is not None and (self.peak_rss_bytes is None or rss > self.peak_rss_bytes):
+                self.peak_rss_bytes = rss
+            self.peak_tensor_bytes = max(self.peak_tensor_bytes, tensors)
+        return {"python_heap_bytes": heap, "rss_bytes": rss, "tensor_bytes": tensors}
+
+    @staticmethod
+    def describe_change(before, after):
+        delta = {}
+        for name, value in after.items():
+            delta[name] = None if value is None or before[name] is None else value - before[name]
+        return {"before": before, "after": after, "delta": delta}
+
+    def peak(self):
+        """Peaks over the profiled execution; the heap peak is final once the profiler has exited."""
+        heap = self.peak_heap_bytes
+        if tracemalloc.is_tracing():
+            heap = max(heap, tracemalloc.get_traced_memory()[1])
+        return {"python_heap_bytes": heap, "rss_bytes": self.peak_rss_bytes, "tensor_bytes": self.peak_tensor_bytes}
+
+
+# by_lora row of the spans that handle fused patches of several LoRAs at once
+FUSED_LORAS = "fused (not per-LoRA)"
+
+
+def memory_report(timings, profiler, **context):
+    """
+    Build the memory profile of one execution from its timings.
+    Per-LoRA totals add up the changes of that LoRA's load, convert and patch spans.
+    With low-rank fusion, fusing and patching are recorded under FUSED_LORAS instead.
+    """
+    spans = [span for span in timings["spans"] if "memory" in span]
+    by_lora = {}
+    for span in spans:
+        if "lora" not in span:
+            continue
+        totals = by_lora.setdefault(span["lora"], {})
+        for name, value in span["memory"]["delta"].items():
+            if value is not None:
+                totals[name] = totals.get(name, 0) + value
+    report = {"timestamp": time.time()}
+    report.update(context)
+    report.update({
+        "total_seconds": timings["total_seconds"],
+        "peak": profiler.peak(),
+        "by_lora": by_lora,
+        "spans": spans,
+    })
+    return report
+
+
+def write_memory_report(report, path=None):
+    """
+    Append a memory report as one JSON line to path (default: ADVANCED_LORA_STACKER_PROFILE_PATH,
+    else memory_profile.jsonl in the user directory). Returns the path written, or None.
+    """
+    if path is None:
+        path = _user_data_path("ADVANCED_LORA_STACKER_PROFILE_PATH", "memory_profile.jsonl")
+    if not path:
+        return None
+    try:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(report, sort_keys=True) + "\n")
+    except OSError as e:
+        logger.warning(f"Could not write memory profile to {path}: {e}")
+        return None
+    return path
+
+
+# Block ranges targeted by each preset, on a 0-11 scale running from the first
+# input block (0) through the middle block (5) to the last output block (11)
+PRESET_BLOCKS = {
+    "Full": None,
+    "Character": (4, 11),
+    "Style": (0, 5),
+    "Concept": (6, 11),
+    "Fix Hands": (8, 11),
+}
+
+# Matches UNet block names in kohya ("lora_unet_input_blocks_4_..."), ComfyUI
+# ("diffusion_model.output_blocks.8....") and diffusers ("unet.up_blocks.1....") keys
+_BLOCK_KEY_RE = re.compile(
+    r"(?:^|[._])(input_blocks|output_blocks|down_blocks|up_blocks|middle_block|mid_block)(?:[._](\d+))?(?=[._])"
+)
+
+# Known block counts per side for each naming scheme (SDXL, SD1.x/2.x)
+_BLOCK_FAMILY_SIZES = {
+    ("input_blocks", "output_blocks"): (9, 12),
+    ("down_blocks", "up_blocks"): (3, 4),
+}
+
+
+def _block_family_sizes(keys):
+    """Infer how many blocks each side of the UNet has from the highest block index in the keys."""
+    max_index = {}
+    for key in keys:
+        match = _BLOCK_KEY_RE.search(key)
+        if match and match.group(2) is not None:
+            family = match.group(1)
+            max_index[family] = max(max_index.get(family, -1), int(match.group(2)))
+
+    sizes = {}
+    for families, candidates in _BLOCK_FAMILY_SIZES.items():
+        needed = max(max_index.get(family, -1) for family in families) + 1
+        size = next((c for c in candidates if c >= needed), needed)
+        for family in families:
+            sizes[family] = size
+    return sizes
+
+
+def lora_key_block(key, family_sizes):
+    """
+    Map a LoRA key to its position on the 0-11 preset block scale.
+    Returns None for keys outside the UNet blocks (text encoder, time embedding, etc.).
+    """
+    match = _BLOCK_KEY_RE.search(key)
+    if not match:
+        return None
+
+    family, index = match.group(1), match.group(2)
+    if family in ("middle_block", "mid_block"):
+        return 5
+    if index is None:
+        return None
+
+    position = int(index) * 6 // family_sizes[family]
+    if family in ("input_blocks", "down_blocks"):
+        return position
+    return 6 + position
+
+
+def select_block_keys(keys, blocks):
+    """
+    Return the LoRA keys that fall inside the (start, end) block range.
+    Keys that do not belong to a UNet block are always kept.
+    """
+    keys = list(keys)
+    if blocks is None:
+        return keys
+
+    start, end = blocks
+    family_sizes = _block_family_sizes(keys)
+    selected = []
+    for key in keys:
+        block = lora_key_block(key, family_sizes)
+        if block is None or start <= block <= end:
+            selected.append(key)
+    return selected
+
+
+def filter_lora_blocks(lora, blocks):
+    """Drop the tensors of a loaded LoRA that fall outside the block range."""
+    if blocks is None:
+        return lora
+    return {key: lora[key] for key in select_block_keys(lora.keys(), blocks)}
+
+
+# Keys of weight adapters ComfyUI can load (LoRA, LoHa, LoKr, full diffs)
+_ADAPTER_KEY_RE = re.compile(r"lora|hada_|lokr_|\.diff(?:_b)?$", re.IGNORECASE)
+
+# Low-rank "down" factors; their first dimension is the rank
+_DOWN_KEY_SUFFIXES = (".lora_down.weight", ".lora_A.weight", ".lora.down.weight", "_lora.down.weight")
+
+# Key fragments that identify the base model a LoRA was trained for, checked in order
+_ARCHITECTURE_MARKERS = (
+    ("flux", ("double_blocks", "single_blocks", "single_transformer_blocks")),
+    ("sd3", ("joint_blocks",)),
+    ("sdxl", ("lora_te2_", "text_encoder_2.", "label_emb", "_transformer_blocks_1_", "transformer_blocks.1.attn1")),
+)
+
+# The safetensors format caps the JSON header at 100 MB
+_MAX_SAFETENSORS_HEADER = 100 * 2**20
+
+
+def read_safetensors_header(path):
+    """Read the JSON header of a safetensors file without touching tensor data; None if it is not one."""
+    try:
+        with open(path, "rb") as f:
+            prefix = f.read(8)
+            if len(prefix) != 8:
+                return None
+            (length,) = struct.unpack("<Q", prefix)
+            if length > _MAX_SAFETENSORS_HEADER:
+                return None
+            header = json.loads(f.read(length))
+    except (OSError, ValueError):
+        return None
+    return header if isinstance(header, dict) else None
+
+
+def detect_architecture(keys):
+    """Guess the base model family ("sd1", "sdxl", "sd3", "flux" or "unknown") from LoRA key names."""
+    for architecture, markers in _ARCHITECTURE_MARKERS:
+        if any(marker in key for key in keys for marker in markers):
+            return architecture
+    if any(_BLOCK_KEY_RE.search(key) for key in keys):
+        return "sd1"
+    return "unknown"
+
+
+def describe_lora_header(header):
+    """
+    Summarize a safetensors header: rank, dtypes, architecture, preset block coverage
+    and tensor bytes. Returns None for malformed headers.
+    """
+    tensors = {key: info for key, info in header.items() if key != "__metadata__"}
+    keys = sorted(tensors)
+    try:
+        ranks = {tensors[key]["shape"][0] for key in keys if key.endswith(_DOWN_KEY_SUFFIXES)}
+        dtypes = sorted({info["dtype"] for info in tensors.values()})
+        tensor_bytes = sum(end - start for start, end in (info["data_offsets"] for info in tensors.values()))
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+
+    family_sizes = _block_family_sizes(keys)
+    blocks = {lora_key_block(key, family_sizes) for key in keys}
+    blocks.discard(None)
+    return {
+        "is_lora": any(_ADAPTER_KEY_RE.search(key) for key in keys),
+        "rank": max(ranks) if ranks else None,
+        "dtypes": dtypes,
+        "architecture": detect_architecture(keys),
+        "blocks": sorted(blocks),
+        "tensor_bytes": tensor_bytes,
+    }
+
+
+def _hash_file(path, chunk_size=2**20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _write_json_atomic(path, data):
+    """Write data as JSON through a temporary file, so readers never see a partial file. Raises OSError."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except Exception:
+        with suppress(OSError):
+            os.remove(tmp_path)
+        raise
+
+
+def _save_safetensors_atomic(path, tensors, metadata=None):
+    """Save tensors through a temporary file, like _write_json_atomic; safetensors errors propagate."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        safetensors.torch.save_file(tensors, tmp_path, metadata=metadata)
+        os.replace(tmp_path, path)
+    except Exception:
+        with suppress(OSError):
+            os.remove(tmp_path)
+        raise
+
+
+class _FileStore:
+    """
+    Base of the stores kept under the ComfyUI user directory. The location (a file or a
+    directory) may be a callable, resolved on first use so importing the module needs no
+    ComfyUI; None keeps the store in memory or disables it. Work passed to _submit runs on
+    one background thread, and flush() waits for it.
+    """
+
+    def __init__(self, location, thread_name_prefix):
+        self._location = location
+        self._lock = threading.Lock()
+        self._worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix=thread_name_prefix)
+        self._pending = []
+
+    @property
+    def location(self):
+        if callable(self._location):
+            self._location = self._location()
+        return self._location
+
+    def _submit(self, fn, *args):
+        future = self._worker.submit(fn, *args)
+        with self._lock:
+            self._pending = [f for f in self._pending if not f.done()] + [future]
+        return future
+
+    def flush(self):
+        """Wait for pending background work."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for future in pending:
+            future.result()
+
+    def _read_json(self, description):
+        """Data of the JSON file at location if it has the class VERSION, else None."""
+        path = self.location
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable {description} {path}: {e}")
+            return None
+        if isinstance(data, dict) and data.get("version") == self.VERSION:
+            return data
+        return None
+
+    def _write_json(self, data, description):
+        try:
+            _write_json_atomic(self.location, data)
+        except OSError as e:
+            logger.warning(f"Could not save {description} {self.location}: {e}")
+
+
+class LoraIndex(_FileStore):
+    """
+    Persistent index of LoRA file metadata, built from safetensors headers.
+    Entries are keyed by resolved path and re-read only when a file's mtime or size
+    changes. Looking up an entry reads only the header; the content hash, which lets
+    identical files stored under different names share cache entries, is computed by
+    scan() or on a background thread (hash_later) and passed to on_hashed.
+    With no path the index lives in memory only.
+    """
+
+    VERSION = 2
+
+    def __init__(self, path=None, on_hashed=None):
+        super().__init__(path, "lora_hasher")
+        self.on_hashed = on_hashed
+        self._entries = None
+        self._dirty = False
+        self._queued = set()
+
+    path = _FileStore.location
+
+    def _load_locked(self):
+        if self._entries is not None:
+            return
+        data = self._read_json("LoRA index")
+        self._entries = data.get("entries", {}) if data is not None else {}
+
+    def entry(self, lora_path):
+        """
+        Return the index entry of a safetensors file, (re)indexing its header if it changed;
+        None for other files. New and changed entries have no "sha256" until hashed.
+        """
+        if not isinstance(lora_path, str) or not lora_path.lower().endswith(".safetensors"):
+            return None
+        try:
+            stat = os.stat(lora_path)
+        except OSError:
+            return None
+
+        with self._lock:
+            self._load_locked()
+            entry = self._entries.get(lora_path)
+        if entry is not None and entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+            return entry
+
+        entry = self._index_file(lora_path, stat)
+        with self._lock:
+            if entry is not None:
+                self._entries[lora_path] = entry
+                self._dirty = True
+            elif self._entries.pop(lora_path, None) is not None:
+                self._dirty = True
+        return entry
+
+    @staticmethod
+    def _index_file(lora_path, stat):
+        header = read_safetensors_header(lora_path)
+        entry = describe_lora_header(header) if header is not None else None
+        if entry is None:
+            return None
+        entry.update(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+        return entry
+
+    def _hash(self, lora_path):
+        """Hash an indexed file and store the digest unless the file changed meanwhile; returns the entry."""
+        try:
+            stat = os.stat(lora_path)
+            digest = _hash_file(lora_path)
+        except OSError:
+            return None
+        with self._lock:
+            self._load_locked()
+            entry = self._entries.get(lora_path)
+            if entry is None or entry["mtime_ns"] != stat.st_mtime_ns or entry["size"] != stat.st_size:
+                return None
+            # Readers may hold the old entry, so it is replaced rather than updated
+            entry = dict(entry, sha256=digest)
+            self._entries[lora_path] = entry
+            self._dirty = True
+        if self.on_hashed is not None:
+            self.on_hashed((lora_path, stat.st_mtime_ns, stat.st_size), digest)
+        return entry
+
+    def hash_later(self, lora_path):
+        """Hash an indexed file on a background thread, unless it is hashed or queued already."""
+        with self._lock:
+            self._load_locked()
+            entry = self._entries.get(lora_path)
+            if entry is None or "sha256" in entry or lora_path in self._queued:
+                return
+            self._queued.add(lora_path)
+        self._submit(self._hash_queued, lora_path)
+
+    def _hash_queued(self, lora_path):
+        try:
+            self._hash(lora_path)
+        finally:
+            with self._lock:
+                self._queued.discard(lora_path)
+
+    def scan(self, lora_names=None):
+        """
+        Index the safetensors files of the loras folder, reading and hashing only new or
+        changed ones, and save the index. Returns the entries keyed by LoRA name.
+        """
+        if lora_names is None:
+            lora_names = folder_paths.get_filename_list("loras")
+
+        found = {}
+        for lora_name in lora_names:
+            lora_path = folder_paths.get_full_path("loras", lora_name)
+            entry = self.entry(lora_path)
+            if entry is not None and "sha256" not in entry:
+                entry = self._hash(lora_path) or entry
+            if entry is not None:
+                found[lora_name] = entry
+
+        with self._lock:
+            self._load_locked()
+            for path in [path for path in self._entries if not os.path.exists(path)]:
+                del self._entries[path]
+                self._dirty = True
+        self.save()
+        return found
+
+    def duplicates(self):
+        """Group the hashed paths holding identical content: {sha256: [paths]} for hashes seen more than once."""
+        by_hash = {}
+        with self._lock:
+            self._load_locked()
+            for path, entry in self._entries.items():
+                if "sha256" in entry:
+                    by_hash.setdefault(entry["sha256"], []).append(path)
+        return {digest: sorted(paths) for digest, paths in by_hash.items() if len(paths) > 1}
+
+    def save(self):
+        """Write the index to disk if it changed since the last save."""
+        with self._lock:
+            if not self._dirty or not self.path:
+                return
+            data = {"version": self.VERSION, "entries": dict(self._entries)}
+            self._dirty = False
+        self._write_json(data, "LoRA index")
+
+    def clear(self):
+        """Forget the in-memory entries; the file on disk is reloaded on next use."""
+        with self._lock:
+            self._entries = None
+            self._dirty = False
+
+
+def _user_data_path(env_var, name):
+    """
+    Location of a stacker data file: the env_var override if set (an empty value
+    disables the file), else name under the ComfyUI user directory.
+    """
+    path = os.environ.get(env_var)
+    if path is not None:
+        return path or None
+    get_user_directory = getattr(folder_paths, "get_user_directory", None)
+    if get_user_directory is None:
+        return None
+    return os.path.join(get_user_directory(), "advanced_lora_stacker", name)
+
+
+# Set ADVANCED_LORA_STACKER_INDEX to an empty string to keep the index in memory only
+# Once a file is hashed, its cached variants move to the content key
+LORA_INDEX = LoraIndex(
+    lambda: _user_data_path("ADVANCED_LORA_STACKER_INDEX", "lora_index.json"),
+    on_hashed=lambda file_key, digest: LORA_CACHE.rekey(file_key, ("sha256", digest)),
+)
+
+
+def lora_content_key(lora_path):
+    """
+    Identify a LoRA file for caching: its content hash once the index has computed it,
+    otherwise path, mtime and size. Never hashes; None if the file cannot be stat'ed.
+    """
+    file_key = LoraCache.file_key(lora_path)
+    if file_key is None:
+        return None
+    entry = LORA_INDEX.entry(lora_path)
+    if entry is not None and "sha256" in entry:
+        return ("sha256", entry["sha256"])
+    return file_key
+
+
+def _validate_indexed_lora(lora_path, entry, blocks):
+    """Warn about files the index shows will not patch anything useful."""
+    name = os.path.basename(lora_path)
+    if not entry["is_lora"]:
+        logger.warning(f"{name} contains no LoRA weights")
+    elif blocks is not None and entry["blocks"] and not any(blocks[0] <= b <= blocks[1] for b in entry["blocks"]):
+        logger.warning(f"{name} has no UNet weights in preset blocks {blocks[0]}-{blocks[1]}")
+
+
+def resolve_lora_precision(precision):
+    """Map a lora_precision input ("default" follows the environment policy) to a LORA_PRECISIONS name."""
+    if precision in (None, "default"):
+        precision = DEFAULT_LORA_PRECISION
+    if precision not in LORA_PRECISIONS:
+        logger.warning(f"Unknown LoRA precision {precision!r}, keeping original dtypes")
+        return "original"
+    return precision
+
+
+def downcast_lora(lora, precision):
+    """
+    Cast the floating point weights of a loaded LoRA that are wider than the storage precision.
+    Scalars such as alpha and non-float tensors are kept as they are.
+    """
+    dtype = LORA_PRECISIONS[precision]
+    if dtype is None:
+        return lora
+
+    bits = torch.finfo(dtype).bits
+    downcast = {}
+    for key, value in lora.items():
+        if (
+            isinstance(value, torch.Tensor) and value.is_floating_point() and value.dim() > 0
+            and torch.finfo(value.dtype).bits > bits
+        ):
+            value = value.to(dtype)
+        downcast[key] = value
+    return downcast
+
+
+def _read_lora_file(lora_path, blocks):
+    """
+    Read a LoRA from disk, only deserializing the tensors inside the block range when possible.
+    Pickle files are read from their safetensors copy in CONVERTED_LORAS, converted on first read.
+    """
+    source_path = lora_path
+    converted = CONVERTED_LORAS.get(lora_path)
+    if converted is not None:
+        lora_path = converted
+
+    if blocks is not None and lora_path.lower().endswith(".safetensors"):
+        with safetensors.safe_open(lora_path, framework="pt", device="cpu") as f:
+            return {key: f.get_tensor(key) for key in select_block_keys(f.keys(), blocks)}
+
+    lora = comfy.utils.load_torch_file(lora_path, safe_load=True)
+    if converted is None:
+        CONVERTED_LORAS.put(source_path, lora)
+    return filter_lora_blocks(lora, blocks)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller runs the function,
+    later callers arriving while it runs wait for it and share its result or exception.
+    """
+
+    def __init__(self):
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            return call.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+# In-flight LoRA loads, keyed like the cache entries they fill
+LORA_LOADS = SingleFlight()
+
+
+def load_lora_file(lora_path, blocks=None, precision="original"):
+    """
+    Load a LoRA state dict through the shared cache, optionally restricted to a block range
+    and stored in reduced precision (see LORA_PRECISIONS).
+    Only the requested variant is cached, so a reduced-precision policy keeps the cache
+    free of the full-precision copies. Safetensors files are cached by content hash via
+    LORA_INDEX. Files that cannot be stat'ed are loaded directly and not cached.
+    Concurrent requests for the same variant of a file, e.g. from several stacker nodes,
+    wait for one load and share its tensors, even when they are too large to cache.
+    """
+    file_key = LoraCache.file_key(lora_path)
+    if file_key is None:
+        lora = filter_lora_blocks(comfy.utils.load_torch_file(lora_path, safe_load=True), blocks)
+        return downcast_lora(lora, precision)
+    return LORA_LOADS.do(
+        file_key + (blocks, precision), lambda: _load_cached_lora(lora_path, file_key, blocks, precision)
+    )
+
+
+def _load_cached_lora(lora_path, file_key, blocks, precision):
+    """load_lora_file for a stat'ed file: cache lookup, derivation from a cached superset or a disk read."""
+    # Hashed files are keyed by content, so copies under other names share one entry
+    entry = LORA_INDEX.entry(lora_path)
+    if entry is not None and "sha256" in entry:
+        file_key = ("sha256", entry["sha256"])
+
+    key = file_key + (blocks, precision)
+    lora = LORA_CACHE.get(key)
+    if lora is not None:
+        return lora
+
+    if entry is not None:
+        _validate_indexed_lora(lora_path, entry, blocks)
+
+    # Derive the variant from a cached superset (full file and/or original precision)
+    source = None
+    for candidate in dict.fromkeys([(blocks, "original"), (None, precision), (None, "original")]):
+        if candidate != (blocks, precision):
+            source = LORA_CACHE.peek(file_key + candidate)
+            if source is not None:
+                break
+    cache = True
+    if source is not None:
+        lora = downcast_lora(filter_lora_blocks(source, blocks), precision)
+    else:
+        # The header gives the size of a full read (an upper bound after downcasting), so
+        # the cache makes room before the read, or is skipped for files it could not hold
+        if entry is not None and blocks is None:
+            cache = LORA_CACHE.reserve(entry["tensor_bytes"])
+        lora = downcast_lora(_read_lora_file(lora_path, blocks), precision)
+        if entry is not None:
+            LORA_INDEX.hash_later(lora_path)
+    if cache:
+        LORA_CACHE.put(key, lora)
+    MEMORY_BUDGET.enforce()
+    return lora
+
+
+class RecentLoras(_FileStore):
+    """
+    Persistent record of the LoRAs the stacker loaded most recently, as
+    (name, preset, precision) newest last, so a restarted server can preload them.
+    Like LoraIndex, the path may be a callable and without one the record lives in memory.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path=None, max_entries=64):
+        super().__init__(path, "recent_loras")
+        self.max_entries = max_entries
+        self._entries = None
+        self._dirty = False
+
+    path = _FileStore.location
+
+    def _load_locked(self):
+        if self._entries is not None:
+            return
+        self._entries = OrderedDict()
+        data = self._read_json("recent LoRA list")
+        if data is not None:
+            for name, preset, precision in data.get("entries", [])[-self.max_entries:]:
+                self._entries[(name, preset, precision)] = None
+
+    def record(self, entries, precision="original"):
+        """Mark the LoRAs of a stack (objects with .name and .preset) as just used."""
+        with self._lock:
+            self._load_locked()
+            before = list(self._entries)
+            for r in entries:
+                key = (r.name, r.preset, precision)
+                self._entries.pop(key, None)
+                self._entries[key] = None
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            if list(self._entries) != before:
+                self._dirty = True
+
+    def entries(self):
+        """Recorded (name, preset, precision) tuples, oldest first."""
+        with self._lock:
+            self._load_locked()
+            return list(self._entries)
+
+    def save(self):
+        """Write the record to disk if it changed since the last save."""
+        with self._lock:
+            if not self._dirty or not self.path:
+                return
+            data = {"version": self.VERSION, "entries": [list(key) for key in self._entries]}
+            self._dirty = False
+        self._write_json(data, "recent LoRA list")
+
+    def warm_up(self, limit):
+        """
+        Load the limit most recently used LoRAs into LORA_CACHE, oldest first so the
+        newest end up most recently used. As when applying a stack, a file recorded with
+        several presets is loaded in full. Returns the number of files loaded.
+        """
+        recent = self.entries()[-limit:] if limit > 0 else []
+        variants = OrderedDict()
+        for name, preset, precision in recent:
+            variants.setdefault((name, precision), set()).add(PRESET_BLOCKS.get(preset, None))
+
+        loaded = 0
+        for (name, precision), blocks in variants.items():
+            lora_path = folder_paths.get_full_path("loras", name)
+            if lora_path is None:
+                continue
+            try:
+                load_lora_file(lora_path, next(iter(blocks)) if len(blocks) == 1 else None, precision)
+            except Exception as e:
+                logger.warning(f"Warm-up could not load {name}: {e}")
+                continue
+            loaded += 1
+        return loaded
+
+
+RECENT_LORAS = RecentLoras(lambda: _user_data_path("ADVANCED_LORA_STACKER_RECENT_LORAS", "recent_loras.json"))
+
+
+def start_warmup(limit=None, delay=WARMUP_DELAY_SECONDS):
+    """
+    Preload the most recently used LoRAs (default: ADVANCED_LORA_STACKER_WARMUP_LORAS of them)
+    on a background thread once delay seconds have passed. Returns the thread, or None when disabled.
+    """
+    if limit is None:
+        limit = WARMUP_LORAS
+    if limit <= 0:
+        return None
+
+    def run():
+        time.sleep(delay)
+        start = time.perf_counter()
+        loaded = RECENT_LORAS.warm_up(limit)
+        LORA_INDEX.save()
+        MEMORY_BUDGET.enforce()
+        logger.info(f"Advanced LoRA Stacker - Warmed up {loaded} LoRA(s) in {time.perf_counter() - start:.2f}s")
+
+    thread = threading.Thread(target=run, name="lora_warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def _round4_array(values):
+    """
+    Round an array to 4 decimals exactly like Python's round(x, 4).
+    np.round works on x * 10000 in floating point, which can disagree with Python's
+    correctly-rounded result only when that product sits on a .5 tie; those few
+    elements are rounded with Python instead.
+    """
+    rounded = np.round(values, 4)
+    scaled = values * 10000.0
+    ties = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    if ties.any():
+        rounded[ties] = [round(v, 4) for v in values[ties].tolist()]
+    return rounded
+
+
+def quantize_partition(segments, remaining, step):
+    """
+    Snap partition segments to multiples of step while keeping their sum equal to remaining.
+    Whole steps are distributed by largest remainder (ties go to the earlier segment); a part of
+    remaining that is not a whole number of steps is added to the largest segment.
+    """
+    raw = [segment / step for segment in segments]
+    units = [math.floor(r) for r in raw]
+    short = max(0, math.floor(remaining / step + 1e-9) - sum(units))
+    order = sorted(range(len(raw)), key=lambda i: raw[i] - units[i], reverse=True)
+    for i in order[:short]:
+        units[i] += 1
+
+    values = [round(u * step, 4) for u in units]
+    residual = round(remaining - sum(values), 4)
+    if residual != 0:
+        max_idx = values.index(max(values))
+        values[max_idx] = round(values[max_idx] + residual, 4)
+    return values
+
+
+def _quantize_partition_array(segments, remaining, step):
+    """Row-wise quantize_partition over a (seeds x segments) array, with identical results."""
+    raw = segments / step
+    units = np.floor(raw)
+    short = np.maximum(0, math.floor(remaining / step + 1e-9) - units.sum(axis=1))
+    # Stable descending order of the remainders, like sorted(..., reverse=True)
+    order = np.argsort(-(raw - units), axis=1, kind="stable")
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, np.arange(segments.shape[1])[None, :].repeat(len(segments), axis=0), axis=1)
+    units += ranks < short[:, None]
+
+    values = _round4_array(units * step)
+    residual = _round4_array(remaining - np.cumsum(values, axis=1)[:, -1])
+    rows = np.arange(len(values))
+    max_idx = np.argmax(values, axis=1)
+    values[rows, max_idx] = _round4_array(values[rows, max_idx] + residual)
+    return values
+
+
+def quantize_strength(value, low, high, step):
+    """Snap a strength drawn from [low, high] to the nearest multiple of step inside the range."""
+    snapped = round(value / step) * step
+    if snapped < low - 1e-9:
+        snapped += step
+    elif snapped > high + 1e-9:
+        snapped -= step
+    if not low - 1e-9 <= snapped <= high + 1e-9:
+        # The range holds no grid point
+        return value
+    return round(snapped, 4)
+
+
+class KeyMapCache:
+    """
+    Cache of LoRA key -> model weight key mappings.
+    Mappings are looked up first by the model object itself (held weakly), then by an
+    architecture signature (class name plus a hash of the state dict key names), so every
+    LoRA in a stack and every later execution on the same architecture reuses one table.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._by_module = weakref.WeakKeyDictionary()
+        self._by_signature = {}
+        self._combined = {}
+        self._targets = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def architecture_signature(module):
+        state_dict = getattr(module, "state_dict", None)
+        if state_dict is None:
+            return None
+        digest = hashlib.sha1("\n".join(state_dict().keys()).encode("utf-8")).hexdigest()
+        return (type(module).__qualname__, digest)
+
+    def signatures(self, lora_module, model, clip):
+        """Architecture signatures of the model and CLIP, or None if either cannot be identified."""
+        signatures = []
+        for component, module, build in (
+            (model, "model", "model_lora_keys_unet"), (clip, "cond_stage_model", "model_lora_keys_clip")
+        ):
+            if component is None:
+                signatures.append(None)
+                continue
+            signature, _ = self._lookup(getattr(component, module), getattr(lora_module, build))
+            if signature[0] == "module":
+                return None
+            signatures.append(signature)
+        return tuple(signatures)
+
+    def _lookup(self, module, build):
+        """Return (signature, mapping) for one model component, building it on a miss."""
+        with self._lock:
+            try:
+                cached = self._by_module.get(module)
+            except TypeError:
+                cached = None
+            if cached is not None:
+                self.hits += 1
+                return cached
+
+        signature = self.architecture_signature(module)
+        with self._lock:
+            mapping = self._by_signature.get(signature) if signature is not None else None
+        if mapping is None:
+            mapping = build(module, {})
+            with self._lock:
+                self.misses += 1
+                if signature is not None:
+                    self._by_signature[signature] = mapping
+        else:
+            with self._lock:
+                self.hits += 1
+
+        entry = (signature if signature is not None else ("module", id(module)), mapping)
+        with self._lock:
+            try:
+                self._by_module[module] = entry
+            except TypeError:
+                pass
+        return entry
+
+    def key_map(self, lora_module, model, clip):
+        """
+        Build the combined UNet + CLIP key map used by comfy.lora.load_lora.
+        The returned dict is shared and must not be modified.
+        """
+        parts = []
+        if model is not None:
+            parts.append(self._lookup(model.model, lora_module.model_lora_keys_unet))
+        if clip is not None:
+            parts.append(self._lookup(clip.cond_stage_model, lora_module.model_lora_keys_clip))
+
+        combined_key = tuple(signature for signature, _ in parts)
+        with self._lock:
+            combined = self._combined.get(combined_key)
+        if combined is None:
+            combined = {}
+            for _, mapping in parts:
+                combined.update(mapping)
+            if all(signature[0] != "module" for signature in combined_key):
+                with self._lock:
+                    self._combined[combined_key] = combined
+        return combined
+
+    def unet_targets(self, lora_module, model):
+        """Set of model weight keys that the UNet part of the key map points to."""
+        if model is None:
+            return frozenset()
+        signature, mapping = self._lookup(model.model, lora_module.model_lora_keys_unet)
+        with self._lock:
+            targets = self._targets.get(signature)
+        if targets is None:
+            targets = frozenset(mapping.values())
+            with self._lock:
+                self._targets[signature] = targets
+        return targets
+
+    def clear(self):
+        with self._lock:
+            self._by_module.clear()
+            self._by_signature.clear()
+            self._combined.clear()
+            self._targets.clear()
+
+
+KEY_MAP_CACHE = KeyMapCache()
+
+
+def _comfy_lora_module():
+    """Return comfy.lora if it provides the key mapping API, else None."""
+    lora_module = getattr(comfy, "lora", None)
+    if lora_module is None or not hasattr(lora_module, "model_lora_keys_unet"):
+        return None
+    return lora_module
+
+
+def _plain_lora_weights(patch):
+    """
+    Return (up, down, alpha, rebuild) for a plain low-rank LoRA patch, or None.
+    Handles both the ("lora", (up, down, alpha, mid, dora_scale)) tuples of older ComfyUI
+    and the weight adapter objects of newer versions; rebuild(up, down, alpha) creates a
+    patch of the same kind. LoCon mid weights, DoRA and reshape patches are not plain.
+    """
+    if isinstance(patch, tuple) and len(patch) == 2 and patch[0] == "lora":
+        weights = patch[1]
+        if len(weights) >= 3 and all(w is None for w in weights[3:]):
+            return weights[0], weights[1], weights[2], lambda up, down, alpha: (
+                "lora", (up, down, alpha) + (None,) * (len(weights) - 3)
+            )
+        return None
+
+    weights = getattr(patch, "weights", None)
+    if getattr(patch, "name", None) == "lora" and isinstance(weights, tuple) and len(weights) >= 3:
+        if all(w is None for w in weights[3:]):
+            return weights[0], weights[1], weights[2], lambda up, down, alpha: type(patch)(
+                set(), (up, down, alpha) + (None,) * (len(weights) - 3)
+            )
+    return None
+
+
+def _fused_patches_nbytes(patches):
+    """Bytes held by the up/down factors of fused patches."""
+    total = 0
+    for patch in patches.values():
+        plain = _plain_lora_weights(patch)
+        if plain is not None:
+            total += plain[0].numel() * plain[0].element_size() + plain[1].numel() * plain[1].element_size()
+    return total
+
+
+def fuse_lora_patches(weighted_patches, keys):
+    """
+    Fuse the plain LoRA patches of several LoRAs that target the same weight.
+    
+    Each LoRA's up factor is scaled by its strength and alpha/rank, then the up factors are
+    concatenated along the rank dimension and the down factors stacked to match, giving one
+    higher-rank patch per key (applied at strength 1.0). Weight application then does a single
+    matmul per key instead of one per LoRA.
+    
+    Args:
+        weighted_patches: List of (patches, strength) in stack order
+        keys: Weight keys to consider (others are ignored)
+        
+    Returns:
+        (fused, leftovers): fused maps key -> patch; leftovers is a list of
+        (patches, strength) holding everything that could not be fused
+    """
+    grouped = {}
+    leftovers = []
+    for patches, strength in weighted_patches:
+        rest = {}
+        for key, patch in patches.items():
+            if key not in keys:
+                continue
+            plain = _plain_lora_weights(patch)
+            if plain is None:
+                rest[key] = patch
+            elif strength != 0:
+                grouped.setdefault(key, []).append((plain, strength))
+        if rest:
+            leftovers.append((rest, strength))
+
+    fused = {}
+    for key, parts in grouped.items():
+        (first_up, first_down, _, rebuild), _ = parts[0]
+        if any(
+            up.shape[:1] + up.shape[2:] != first_up.shape[:1] + first_up.shape[2:]
+            or down.shape[1:] != first_down.shape[1:]
+            for (up, down, _, _), _ in parts
+        ):
+            # Factors that cannot be concatenated stay separate patches
+            for (up, down, alpha, rebuild_part), strength in parts:
+                leftovers.append(({key: rebuild_part(up, down, alpha)}, strength))
+            continue
+
+        dtype = first_up.dtype
+        for (up, down, _, _), _ in parts:
+            dtype = torch.promote_types(dtype, torch.promote_types(up.dtype, down.dtype))
+
+        ups = []
+        downs = []
+        for (up, down, alpha, _), strength in parts:
+            rank = down.shape[0]
+            scale = strength * (float(alpha) / rank if alpha is not None else 1.0)
+            ups.append(up.to(dtype) * scale)
+            downs.append(down.to(dtype))
+        # alpha=None means a scale of 1.0: strengths are already folded into the up factors
+        fused[key] = rebuild(torch.cat(ups, dim=1), torch.cat(downs, dim=0), None)
+
+    return fused, leftovers
+
+
+def _patch_kind(patch):
+    """Describe how to rebuild a plain LoRA patch: ("tuple" or "module:qualname", weights length)."""
+    if isinstance(patch, tuple):
+        return "tuple", len(patch[1])
+    return f"{type(patch).__module__}:{type(patch).__qualname__}", len(patch.weights)
+
+
+# The patch kinds FusedPatchCache stores. Kinds are read back from the cache files, so
+# anything else is refused rather than imported, which could run arbitrary code
+_PATCH_KINDS = ("tuple", "comfy.weight_adapter.lora:LoRAAdapter")
+
+
+def _patch_builder(kind, length):
+    """Return a function creating scale-1.0 LoRA patches (up, down) of the given kind."""
+    if kind not in _PATCH_KINDS:
+        raise ValueError(f"unsupported patch kind {kind!r}")
+    padding = (None,) * (length - 3)
+    if kind == "tuple":
+        return lambda up, down: ("lora", (up, down, None) + padding)
+
+    module_name, _, qualname = kind.partition(":")
+    cls = importlib.import_module(module_name)
+    for name in qualname.split("."):
+        cls = getattr(cls, name)
+    return lambda up, down: cls(set(), (up, down, None) + padding)
+
+
+_SAFETENSORS_ERRORS = (OSError, ValueError, getattr(safetensors, "SafetensorError", OSError))
+
+
+class FusedPatchCache(_FileStore):
+    """
+    Disk cache of fused stack patches, one safetensors file per stack.
+    Files are named by a hash of the stack signature and the model architecture, read back
+    through safetensors' memory-mapped reader and removed least recently used first once
+    the directory grows past max_bytes. Writes happen on a background thread.
+    Without a directory (or with max_bytes 0) the cache is disabled.
+    """
+
+    FORMAT = "1"
+
+    def __init__(self, directory, max_bytes):
+        super().__init__(directory, "fused_patch_writer")
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    directory = _FileStore.location
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0 and bool(self.directory)
+
+    @classmethod
+    def make_key(cls, signature, architectures):
+        return hashlib.sha1(repr((cls.FORMAT, signature, architectures)).encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.safetensors")
+
+    def get(self, key):
+        """Return {"model": patches, "clip": patches} for a stored stack, or None."""
+        path = self._path(key)
+        try:
+            with safetensors.safe_open(path, framework="pt", device="cpu") as f:
+                metadata = f.metadata() or {}
+                if metadata.get("format") != self.FORMAT:
+                    raise ValueError("unknown format")
+                parts = {}
+                for part in ("model", "clip"):
+                    keys = ast.literal_eval(metadata[f"{part}_keys"])
+                    if not keys:
+                        parts[part] = {}
+                        continue
+                    build = _patch_builder(metadata[f"{part}_kind"], int(metadata[f"{part}_weights"]))
+                    parts[part] = {
+                        weight_key: build(f.get_tensor(f"{part}.{i}.up"), f.get_tensor(f"{part}.{i}.down"))
+                        for i, weight_key in enumerate(keys)
+                    }
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        except _SAFETENSORS_ERRORS + (KeyError, SyntaxError, ImportError, AttributeError) as e:
+            logger.warning(f"Discarding unreadable fused patch file {path}: {e}")
+            with self._lock:
+                self.misses += 1
+            with suppress(OSError):
+                os.remove(path)
+            return None
+
+        # Least recently used files are removed first, so mark this one as used
+        with suppress(OSError):
+            os.utime(path)
+        with self._lock:
+            self.hits += 1
+        return parts
+
+    def put(self, key, parts):
+        """
+        Store {"model": patches, "clip": patches} of plain LoRA patches in the background.
+        Returns False if the patches cannot be stored (mixed kinds, or kinds not in _PATCH_KINDS).
+        """
+        tensors = {}
+        metadata = {"format": self.FORMAT}
+        for part, patches in parts.items():
+            kinds = {_patch_kind(patch) for patch in patches.values()}
+            if len(kinds) > 1:
+                return False
+            kind, length = kinds.pop() if kinds else ("", 0)
+            if kind and kind not in _PATCH_KINDS:
+                return False
+            keys = list(patches)
+            for i, weight_key in enumerate(keys):
+                up, down, _, _ = _plain_lora_weights(patches[weight_key])
+                tensors[f"{part}.{i}.up"] = up.contiguous()
+                tensors[f"{part}.{i}.down"] = down.contiguous()
+            metadata.update({f"{part}_keys": repr(keys), f"{part}_kind": kind, f"{part}_weights": str(length)})
+
+        self._submit(self._write, key, tensors, metadata)
+        return True
+
+    def _write(self, key, tensors, metadata):
+        path = self._path(key)
+        try:
+            _save_safetensors_atomic(path, tensors, metadata)
+        except _SAFETENSORS_ERRORS as e:
+            logger.warning(f"Could not write fused patch file {path}: {e}")
+            return
+        self._enforce_budget()
+
+    def _enforce_budget(self):
+        files = []
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if entry.name.endswith(".safetensors"):
+                        stat = entry.stat()
+                        files.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        except OSError:
+            return
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            with suppress(OSError):
+                os.remove(path)
+                total -= size
+
+
+FUSED_PATCH_CACHE = FusedPatchCache(
+    lambda: _user_data_path("ADVANCED_LORA_STACKER_FUSED_CACHE_DIR", "fused_patches"), DEFAULT_FUSED_CACHE_MB * 2**20
+)
+
+
+class ConvertedLoraCache(_FileStore):
+    """
+    Sidecar cache of safetensors copies of pickle LoRAs (.ckpt/.pt/.pth).
+    The first load of such a file reads the pickle as usual and writes a safetensors copy
+    on a background thread; later loads read the copy, which is memory-mapped and allows
+    reading only a preset's blocks. Copies are named by a hash of the source path plus its
+    mtime and size, so a changed source is converted again and its stale copy removed.
+    Without a directory the cache is disabled.
+    """
+
+    EXTENSIONS = (".ckpt", ".pt", ".pth")
+
+    def __init__(self, directory):
+        super().__init__(directory, "lora_converter")
+        self.conversions = 0
+        self._queued = set()
+
+    directory = _FileStore.location
+
+    def handles(self, lora_path):
+        return bool(self.directory) and lora_path.lower().endswith(self.EXTENSIONS)
+
+    def _path(self, lora_path):
+        """Path of the converted copy of the current version of lora_path, or None if it cannot be stat'ed."""
+        try:
+            stat = os.stat(lora_path)
+        except OSError:
+            return None
+        source = hashlib.sha1(os.path.abspath(lora_path).encode("utf-8")).hexdigest()[:16]
+        version = hashlib.sha1(f"{stat.st_mtime_ns}:{stat.st_size}".encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.directory, f"{source}-{version}.safetensors")
+
+    def get(self, lora_path):
+        """Path of an existing converted copy of lora_path, or None."""
+        if not self.handles(lora_path):
+            return None
+        path = self._path(lora_path)
+        return path if path is not None and os.path.isfile(path) else None
+
+    def put(self, lora_path, state_dict):
+        """
+        Write a converted copy of a loaded pickle LoRA in the background.
+        Returns False for state dicts that safetensors cannot represent (non-tensor values).
+        """
+        if not self.handles(lora_path):
+            return False
+        path = self._path(lora_path)
+        if path is None or not all(isinstance(value, torch.Tensor) for value in state_dict.values()):
+            return False
+        with self._lock:
+            if path in self._queued:
+                return True
+            self._queued.add(path)
+        self._submit(self._write, lora_path, path, state_dict)
+        return True
+
+    def _write(self, lora_path, path, state_dict):
+        # Pickles may hold views of one storage, which safetensors refuses to save
+        tensors = {key: value.detach().clone().contiguous() for key, value in state_dict.items()}
+        metadata = {"source": os.path.basename(lora_path)}
+        try:
+            _save_safetensors_atomic(path, tensors, metadata)
+        except _SAFETENSORS_ERRORS as e:
+            logger.warning(f"Could not convert {os.path.basename(lora_path)} to safetensors: {e}")
+            return
+        finally:
+            with self._lock:
+                self._queued.discard(path)
+
+        # Copies of earlier versions of the same source are stale now
+        prefix = os.path.basename(path).split("-", 1)[0] + "-"
+        with suppress(OSError), os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.startswith(prefix) and entry.name.endswith(".safetensors") and entry.path != path:
+                    with suppress(OSError):
+                        os.remove(entry.path)
+        with self._lock:
+            self.conversions += 1
+        logger.info(f"Converted {os.path.basename(lora_path)} to safetensors")
+
+
+# Set ADVANCED_LORA_STACKER_CONVERTED_DIR to an empty string to always read pickle LoRAs directly
+CONVERTED_LORAS = ConvertedLoraCache(lambda: _user_data_path("ADVANCED_LORA_STACKER_CONVERTED_DIR", "converted"))
+
+
+class _Record:
+    """Base for immutable __slots__ records: attributes are set once in __init__."""
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def _set(self, **fields):
+        for name, value in fields.items():
+            object.__setattr__(self, name, value)
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class LoraEntry(_Record):
+    """One LoRA row of stack_data, with the node's defaults applied."""
+    __slots__ = (
+        "id", "group_id", "name", "preset",
+        "lock_model", "locked_model_value", "lock_clip", "locked_clip_value",
+        "model_strength", "clip_strength",
+        "random_model", "min_model", "max_model",
+        "random_clip", "min_clip", "max_clip",
+    )
+
+    def __init__(self, data):
+        self._set(
+            id=data.get("id"),
+            group_id=data.get("group_id"),
+            name=data.get("name", "None"),
+            preset=data.get("preset", "Full"),
+            lock_model=data.get("lock_model", False),
+            locked_model_value=data.get("locked_model_value", 0.0),
+            lock_clip=data.get("lock_clip", False),
+            locked_clip_value=data.get("locked_clip_value", 0.0),
+            model_strength=data.get("model_strength", 1.0),
+            clip_strength=data.get("clip_strength", 1.0),
+            random_model=data.get("random_model", False),
+            min_model=data.get("min_model", 0.0),
+            max_model=data.get("max_model", 1.0),
+            random_clip=data.get("random_clip", False),
+            min_clip=data.get("min_clip", 0.0),
+            max_clip=data.get("max_clip", 1.0),
+        )
+
+    @property
+    def enabled(self):
+        return bool(self.name) and self.name != "None"
+
+
+class GroupPlan(_Record):
+    """A group with its members and locked values, indexed by position within the group."""
+    __slots__ = ("id", "index", "max_model", "max_clip", "members", "locked_model", "locked_clip")
+
+    def __init__(self, data, members):
+        self._set(
+            id=data.get("id"),
+            index=data.get("index", "N/A"),
+            max_model=data.get("max_model", 1.0),
+            max_clip=data.get("max_clip", 1.0),
+            members=tuple(members),
+            locked_model=tuple(
+                (i, lora.locked_model_value) for i, lora in enumerate(members) if lora.lock_model
+            ),
+            locked_clip=tuple(
+                (i, lora.locked_clip_value) for i, lora in enumerate(members) if lora.lock_clip
+            ),
+        )
+
+
+class StackPlan(_Record):
+    """Compiled form of stack_data: non-empty groups in order, then ungrouped LoRAs."""
+    __slots__ = ("groups", "ungrouped")
+
+    def __init__(self, data):
+        if not isinstance(data, dict):
+            raise ValueError("stack_data must be a JSON object")
+
+        loras = [LoraEntry(lora) for lora in data.get("loras", [])]
+
+        # Build the group -> members index in one pass over the LoRAs
+        members_by_group = {}
+        for lora in loras:
+            members_by_group.setdefault(lora.group_id, []).append(lora)
+
+        groups = []
+        for group in data.get("groups", []):
+            members = members_by_group.get(group.get("id"))
+            if members:
+                groups.append(GroupPlan(group, members))
+
+        self._set(groups=tuple(groups), ungrouped=tuple(members_by_group.get(None, ())))
+
+
+# Compiled plans keyed by a hash of stack_data, which only changes when the node is edited
+_PLAN_CACHE = OrderedDict()
+_PLAN_CACHE_SIZE = 128
+_PLAN_CACHE_LOCK = threading.Lock()
+
+
+def compile_stack_plan(stack_data):
+    """
+    Parse stack_data into an immutable StackPlan, memoized on a hash of the string.
+    Raises ValueError for invalid configurations.
+    """
+    digest = hashlib.sha1(stack_data.encode("utf-8")).hexdigest()
+    with _PLAN_CACHE_LOCK:
+        plan = _PLAN_CACHE.get(digest)
+        if plan is not None:
+            _PLAN_CACHE.move_to_end(digest)
+            return plan
+
+    try:
+        plan = StackPlan(json.loads(stack_data))
+    except (TypeError, AttributeError) as e:
+        raise ValueError(f"Invalid stack data: {e}") from e
+
+    with _PLAN_CACHE_LOCK:
+        _PLAN_CACHE[digest] = plan
+        while len(_PLAN_CACHE) > _PLAN_CACHE_SIZE:
+            _PLAN_CACHE.popitem(last=False)
+    return plan
+
+
+class ResolvedLora(_Record):
+    """A LoRA of the plan with its strengths resolved for one seed."""
+    __slots__ = ("entry", "group", "model_strength", "clip_strength")
+
+    def __init__(self, entry, group, model_strength, clip_strength):
+        self._set(entry=entry, group=group, model_strength=model_strength, clip_strength=clip_strength)
+
+    @property
+    def name(self):
+        return self.entry.name
+
+    @property
+    def preset(self):
+        return self.entry.preset
+
+
+def merge_duplicate_loras(resolved):
+    """
+    Merge enabled entries that apply the same LoRA with the same preset, so its file is
+    loaded once. A plain LoRA's weight delta is linear in its strength, so one patch at the
+    summed strengths equals the separate patches; other patches, DoRA in particular, are
+    split back per entry once loaded (see split_merged_patches).
+    
+    Returns:
+        (merged, merges): merged holds one ResolvedLora per (name, preset) in order of first
+        appearance; merges lists the tuples of entries that were combined
+    """
+    by_lora = {}
+    for r in resolved:
+        if r.entry.enabled:
+            by_lora.setdefault((r.name, r.preset), []).append(r)
+
+    merged = []
+    merges = []
+    for entries in by_lora.values():
+        first = entries[0]
+        if len(entries) == 1:
+            merged.append(first)
+            continue
+        merged.append(ResolvedLora(
+            first.entry, first.group,
+            sum(r.model_strength for r in entries), sum(r.clip_strength for r in entries),
+        ))
+        merges.append(tuple(entries))
+    return tuple(merged), merges
+
+
+def split_merged_patches(stack_patches, merges):
+    """
+    Undo merge_duplicate_loras for loaded patches that are not plain LoRA.
+    A merged entry keeps its plain patches at the summed strengths; every other patch is
+    yielded once per original entry at that entry's strengths, since a DoRA delta depends
+    on the weight as already patched and is not linear in strength.
+    
+    Args:
+        stack_patches: Iterable of (ResolvedLora, patches) for the merged entries
+        merges: The merges returned by merge_duplicate_loras
+        
+    Yields:
+        (ResolvedLora, patches) in stack order
+    """
+    sources = {(entries[0].name, entries[0].preset): entries for entries in merges}
+    for r, patches in stack_patches:
+        entries = sources.get((r.name, r.preset))
+        if entries is None:
+            yield r, patches
+            continue
+        plain = {key: patch for key, patch in patches.items() if _plain_lora_weights(patch) is not None}
+        if len(plain) == len(patches):
+            yield r, patches
+            continue
+        if plain:
+            yield r, plain
+        rest = {key: patch for key, patch in patches.items() if key not in plain}
+        for source in entries:
+            yield source, rest
+
+
+def _merge_line(entries):
+    """One line of the info output for LoRA entries merged into a single patch."""
+    first = entries[0]
+    sources = ", ".join(f"Group {r.group.index}" if r.group is not None else "Ungrouped" for r in entries)
+    model_strength = sum(r.model_strength for r in entries)
+    clip_strength = sum(r.clip_strength for r in entries)
+    return (
+        f"Merged {len(entries)}x {first.name} ({first.preset}) [{sources}] - "
+        f"M:{model_strength:.4f} C:{clip_strength:.4f}"
+    )
+
+
+def lora_file_identity(lora_name):
+    """Identify a LoRA file by content (see lora_content_key), or just its path if it cannot be stat'ed."""
+    lora_path = folder_paths.get_full_path("loras", lora_name)
+    return lora_content_key(lora_path) or (lora_path,)
+
+
+def stack_signature(resolved, identities=None, precision="original"):
+    """
+    Signature of a resolved stack: file identities, presets and rounded strengths,
+    plus the LoRA storage precision when it is not the original one.
+    identities optionally maps LoRA names to precomputed lora_file_identity values.
+    """
+    if identities is None:
+        identities = {}
+    signature = tuple(
+        (
+            identities[r.name] if r.name in identities else lora_file_identity(r.name),
+            r.preset, round(r.model_strength, 4), round(r.clip_strength, 4),
+        )
+        for r in resolved
+    )
+    if precision != "original":
+        signature += (("precision", precision),)
+    return signature
+
+
+def _info_line(r):
+    """One line of the info output for a resolved LoRA."""
+    line = f"{r.name} ({r.preset}) - M:{r.model_strength:.4f} C:{r.clip_strength:.4f}"
+    if r.group is not None:
+        return f"[Group {r.group.index}] {line}"
+    return line
+
+
+def _plan_info(plan):
+    """Info output of a dry run: the resolved strengths, missing files and the plan as a JSON line."""
+    if not plan["valid"]:
+        lines = ["Dry run: invalid configuration"]
+    else:
+        lines = [f"Dry run: {len(plan['loras'])} LoRA(s), {len(plan['missing'])} missing"]
+    for lora in plan["loras"]:
+        line = f"{lora['name']} ({lora['preset']}) - M:{lora['model_strength']:.4f} C:{lora['clip_strength']:.4f}"
+        if lora["group"] is not None:
+            line = f"[Group {lora['group']}] {line}"
+        lines.append(line if lora["found"] else f"{line} [missing]")
+    lines.extend(plan["merges"])
+    if len(plan.get("architectures", ())) > 1:
+        lines.append(f"Warning: LoRAs for different architectures ({', '.join(plan['architectures'])})")
+    lines.append("Plan: " + json.dumps(plan, sort_keys=True))
+    return "\n".join(lines)
+
+
+def _weak_or_none(obj):
+    return None if obj is None else weakref.ref(obj)
+
+
+def _deref(ref):
+    return None if ref is None else ref()
+
+
+class ResultCache:
+    """
+    Bounded cache of patched (model, clip) results keyed on input identity and stack signature.
+    Results and inputs are held weakly: an entry lives only as long as something else
+    (typically ComfyUI's output cache) keeps the objects alive.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, model, clip, signature):
+        key = (id(model), id(clip), signature)
+        with self._lock:
+            refs = self._entries.get(key)
+            if refs is not None:
+                in_model, in_clip, out_model, out_clip = (_deref(ref) for ref in refs)
+                alive = (
+                    in_model is model and in_clip is clip
+                    and (out_model is not None or refs[2] is None)
+                    and (out_clip is not None or refs[3] is None)
+                )
+                if alive:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return out_model, out_clip
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, model, clip, signature, out_model, out_clip):
+        if self.max_entries <= 0:
+            return
+        try:
+            refs = tuple(_weak_or_none(obj) for obj in (model, clip, out_model, out_clip))
+        except TypeError:
+            # Objects that cannot be weakly referenced are never cached
+            return
+        with self._lock:
+            self._entries[(id(model), id(clip), signature)] = refs
+            self._entries.move_to_end((id(model), id(clip), signature))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+RESULT_CACHE = ResultCache(RESULT_CACHE_SIZE)
 
 
 class AdvancedLoraStacker:
@@ -29,6 +2166,14 @@ class AdvancedLoraStacker:
                     "control_after_generate": "randomize"
                 }),
             },
+            "optional": {
+                "report_timings": ("BOOLEAN", {"default": False}),
+                "fuse_low_rank": ("BOOLEAN", {"default": False}),
+                "lora_precision": (["default"] + list(LORA_PRECISIONS), {"default": "default"}),
+                "strength_step": ("FLOAT", {"default": 0.0, "min": 0.0, "max": 1.0, "step": 0.01}),
+                "profile_memory": (["off", "log", "log + info"], {"default": "off"}),
+                "dry_run": ("BOOLEAN", {"default": False}),
+            },
             "hidden": {
                 "stack_data": ("STRING", {"default": ""}),
             }
@@ -39,7 +2184,7 @@ class AdvancedLoraStacker:
     FUNCTION = "apply_loras"
     CATEGORY = "loaders"
 
-    def partition_strengths(self, total, num_segments, locked_values=None, seed=None):
+    def partition_strengths(self, total, num_segments, locked_values=None, seed=None, step=0.0):
         """
         Partition a total value into num_segments using stick-breaking method.
         Respects locked values by subtracting them first.
@@ -49,12 +2194,14 @@ class AdvancedLoraStacker:
             num_segments: Number of segments to create
             locked_values: Dict of {index: value} for locked segments
             seed: Random seed for reproducibility
+            step: Optional grid the unlocked segments are snapped to (see quantize_partition)
             
         Returns:
             List of partitioned values
         """
-        if seed is not None:
-            random.seed(seed)
+        # Private generator per call: never touches the interpreter-wide random state,
+        # so concurrent executions cannot disturb each other's draws
+        rng = random.Random(seed)
         
         if locked_values is None:
             locked_values = {}
@@ -82,7 +2229,7 @@ class AdvancedLoraStacker:
             result[unlocked_indices[0]] = remaining
         else:
             # Generate n-1 random cut points between 0 and 1
-            cuts = [random.random() for _ in range(num_unlocked - 1)]
+            cuts = [rng.random() for _ in range(num_unlocked - 1)]
             cuts.sort()
             
             # Add boundaries
@@ -101,13 +2248,88 @@ class AdvancedLoraStacker:
                 max_idx = segments.index(max(segments))
                 segments[max_idx] += diff
             
+            if step > 0:
+                segments = quantize_partition(segments, remaining, step)
+            
             # Assign to unlocked indices
             for i, idx in enumerate(unlocked_indices):
                 result[idx] = segments[i]
         
         return result
 
-    def apply_lora_with_preset(self, model, clip, lora_name, preset, model_strength, clip_strength):
+    def partition_strengths_batch(self, total, num_segments, locked_values=None, seeds=(), step=0.0):
+        """
+        Vectorized partition_strengths over many seeds.
+        
+        The cut points are drawn per seed from the same Mersenne Twister stream the scalar
+        path uses; sorting, differencing, rounding and the rounding fix-up run on the whole
+        (seeds x segments) array at once.
+        
+        Args:
+            total: Total value to partition
+            num_segments: Number of segments to create
+            locked_values: Dict of {index: value} for locked segments
+            seeds: Iterable of integer seeds
+            step: Optional grid the unlocked segments are snapped to
+            
+        Returns:
+            float64 array of shape (len(seeds), num_segments); row i equals
+            partition_strengths(total, num_segments, locked_values, seeds[i], step)
+        """
+        seeds = list(seeds)
+        
+        if locked_values is None:
+            locked_values = {}
+        
+        result = np.zeros((len(seeds), num_segments))
+        
+        # Locked values are identical for every seed
+        locked_total = 0.0
+        for idx, val in locked_values.items():
+            if 0 <= idx < num_segments:
+                result[:, idx] = val
+                locked_total += val
+        
+        remaining = total - locked_total
+        unlocked_indices = [i for i in range(num_segments) if i not in locked_values]
+        
+        if not seeds or not unlocked_indices or remaining <= 0:
+            return result
+        
+        num_unlocked = len(unlocked_indices)
+        if num_unlocked == 1:
+            result[:, unlocked_indices[0]] = remaining
+            return result
+        
+        num_cuts = num_unlocked - 1
+        draws = np.empty((len(seeds), num_cuts))
+        for row, seed in enumerate(seeds):
+            rng_random = random.Random(seed).random
+            draws[row] = [rng_random() for _ in range(num_cuts)]
+        
+        draws.sort(axis=1)
+        cuts = np.empty((len(seeds), num_unlocked + 1))
+        cuts[:, 0] = 0.0
+        cuts[:, 1:-1] = draws
+        cuts[:, -1] = 1.0
+        
+        segments = _round4_array(np.diff(cuts, axis=1) * remaining)
+        
+        # Sequential (cumulative) sum matches Python's left-to-right sum()
+        total_segments = np.cumsum(segments, axis=1)[:, -1]
+        diff = _round4_array(remaining - total_segments)
+        max_idx = np.argmax(segments, axis=1)
+        rows = np.arange(len(seeds))
+        segments[rows, max_idx] += np.where(diff != 0, diff, 0.0)
+        
+        if step > 0:
+            segments = _quantize_partition_array(segments, remaining, step)
+        
+        result[:, unlocked_indices] = segments
+        return result
+
+    def apply_lora_with_preset(self, model, clip, lora_name, preset, model_strength, clip_strength, timer=None,
+                               precision="original"):
         """
         Apply LoRA with block targeting based on preset type.
         
@@ -117,189 +2339,697 @@ class AdvancedLoraStacker:
         - Style: Target blocks 0-5 (input to middle)
         - Concept: Target blocks 6-11 (output blocks)
         - Fix Hands: Target blocks 8-11 (late output)
+        
+        When no timer is passed, the stage timings of this call are published to the
+        timing listeners on their own. precision selects the in-memory storage
+        precision of the loaded LoRA (see LORA_PRECISIONS).
         """
         if lora_name == "None":
             return model, clip
         
-        lora_path = folder_paths.get_full_path("loras", lora_name)
-        lora = comfy.utils.load_torch_file(lora_path, safe_load=True)
+        own_timer = timer is None
+        if own_timer:
+            timer = StageTimer()
         
-        # Define block targeting for each preset
-        preset_blocks = {
-            "Full": None,  # All blocks
-            "Character": (4, 11),
-            "Style": (0, 5),
-            "Concept": (6, 11),
-            "Fix Hands": (8, 11),
-        }
+        with timer.span("resolve_paths", lora_name):
+            lora_path = folder_paths.get_full_path("loras", lora_name)
         
-        blocks = preset_blocks.get(preset, None)
+        # Block-targeted presets drop the LoRA keys outside their block range
+        # before patching, so only the targeted part of the UNet is patched
+        blocks = PRESET_BLOCKS.get(preset, None)
+        with timer.span("load", lora_name):
+            lora = load_lora_file(lora_path, blocks, precision)
         
-        if blocks is None:
-            # Standard LoRA application (all blocks)
-            model_lora, clip_lora = comfy.sd.load_lora_for_models(
-                model, clip, lora, model_strength, clip_strength
-            )
+        lora_module = _comfy_lora_module()
+        if lora_module is None:
+            with timer.span("patch", lora_name):
+                model_lora, clip_lora = comfy.sd.load_lora_for_models(
+                    model, clip, lora, model_strength, clip_strength
+                )
         else:
-            # Apply with block targeting
-            # Create strength multipliers for each block
-            start_block, end_block = blocks
+            # Same as load_lora_for_models, but with the cached key mapping
+            with timer.span("key_map", lora_name):
+                key_map = KEY_MAP_CACHE.key_map(lora_module, model, clip)
+            with timer.span("patch", lora_name):
+                model_lora = model.clone() if model is not None else None
+                clip_lora = clip.clone() if clip is not None else None
+                self._add_lora_patches(
+                    lora_module, model_lora, clip_lora, lora, key_map, model_strength, clip_strength, lora_name
+                )
+        
+        if own_timer:
+            _publish_timings(timer)
+        return model_lora, clip_lora
+
+    def _add_lora_patches(self, lora_module, model, clip, lora, key_map, model_strength, clip_strength, lora_name):
+        """Convert a loaded LoRA to patches and add them to already-cloned model/CLIP patchers."""
+        patches = self._lora_patches(lora_module, lora, key_map)
+        self._add_patches(model, clip, patches, model_strength, clip_strength, lora_name)
+
+    def _lora_patches(self, lora_module, lora, key_map):
+        """Convert a loaded LoRA state dict to a {model_key: patch} dict."""
+        lora_convert = getattr(comfy, "lora_convert", None)
+        if lora_convert is not None:
+            lora = lora_convert.convert_lora(lora)
+        return lora_module.load_lora(lora, key_map)
+
+    def _add_patches(self, model, clip, patches, model_strength, clip_strength, lora_name):
+        loaded = set()
+        if model is not None:
+            loaded.update(model.add_patches(patches, model_strength))
+        if clip is not None:
+            loaded.update(clip.add_patches(patches, clip_strength))
+        for key in patches:
+            if key not in loaded:
+                logger.warning(f"NOT LOADED {key} ({lora_name})")
+
+    def _iter_stack_patches(self, lora_module, key_map, entries, timer=None, precision="original"):
+        """
+        Yield (entry, patches) in stack order.
+        Every file is read up front on a bounded pool, so later LoRAs load while
+        earlier ones are being converted and patched. A file used with several presets
+        is read once in full and filtered for each of them.
+        While memory is being profiled, files are read in stack order instead, so the
+        memory change of each load belongs to a single LoRA.
+        """
+        RECENT_LORAS.record(entries, precision)
+        with _span(timer, "resolve_paths"):
+            paths = [folder_paths.get_full_path("loras", r.name) for r in entries]
+            blocks = [PRESET_BLOCKS.get(r.preset, None) for r in entries]
+            variants = {}
+            for path, entry_blocks in zip(paths, blocks):
+                variants.setdefault(path, set()).add(entry_blocks)
+            load_blocks = [
+                entry_blocks if len(variants[path]) == 1 else None for path, entry_blocks in zip(paths, blocks)
+            ]
+        
+        def load(lora_name, path, blocks):
+            with _span(timer, "load", lora_name):
+                return load_lora_file(path, blocks, precision)
+        
+        executor = None
+        futures = {}
+        if timer is None or timer.profiler is None:
+            workers = max(1, min(PREFETCH_WORKERS, len(variants)))
+            executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="lora_prefetch")
+            for r, path, request_blocks in zip(entries, paths, load_blocks):
+                if (path, request_blocks) not in futures:
+                    futures[(path, request_blocks)] = executor.submit(load, r.name, path, request_blocks)
+        loaded = {}
+        try:
+            for r, path, entry_blocks, request_blocks in zip(entries, paths, blocks, load_blocks):
+                request = (path, request_blocks)
+                if request not in loaded:
+                    loaded[request] = futures[request].result() if executor else load(r.name, path, request_blocks)
+                lora = loaded[request]
+                if request_blocks != entry_blocks:
+                    lora = filter_lora_blocks(lora, entry_blocks)
+                with _span(timer, "convert", r.name):
+                    patches = self._lora_patches(lora_module, lora, key_map)
+                yield r, patches
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    def apply_lora_stack(self, model, clip, resolved, timer=None, patches_by_lora=None, fuse_low_rank=False,
+                         precision="original", signature=None):
+        """
+        Apply a resolved stack of ResolvedLora entries.
+        
+        The LoRA key mapping is built once and every LoRA's patches are added to a
+        single clone of the model and CLIP, instead of cloning both for each LoRA.
+        LoRA files are read in parallel while earlier LoRAs are being patched.
+        patches_by_lora optionally supplies already converted patches keyed by
+        (name, preset), so several variants of one stack can share them.
+        With fuse_low_rank, LoRAs that patch the same weight are merged into one
+        higher-rank patch per weight (see fuse_lora_patches).
+        precision selects the in-memory storage precision of loaded LoRAs.
+        When fusing, passing the stack_signature lets the fused patches be stored in and
+        reloaded from FUSED_PATCH_CACHE instead of loading every LoRA again.
+        Repeated uses of one LoRA with the same preset are merged first (see merge_duplicate_loras),
+        except for patches that are not plain LoRA (see split_merged_patches).
+        Falls back to chained apply_lora_with_preset calls when comfy.lora is unavailable.
+        """
+        entries, merges = merge_duplicate_loras(resolved)
+        if not entries:
+            return model, clip
+        
+        lora_module = _comfy_lora_module()
+        if lora_module is None:
+            # Patches cannot be inspected here, so entries are applied unmerged
+            for r in (r for r in resolved if r.entry.enabled):
+                model, clip = self.apply_lora_with_preset(
+                    model, clip, r.name, r.preset, r.model_strength, r.clip_strength, timer=timer,
+                    precision=precision,
+                )
+            return model, clip
+        
+        new_model = model.clone() if model is not None else None
+        new_clip = clip.clone() if clip is not None else None
+        
+        disk_key = None
+        if fuse_low_rank and signature is not None and FUSED_PATCH_CACHE.enabled:
+            architectures = KEY_MAP_CACHE.signatures(lora_module, model, clip)
+            if architectures is not None:
+                disk_key = FUSED_PATCH_CACHE.make_key(signature, architectures)
+                with _span(timer, "load", FUSED_LORAS):
+                    stored = FUSED_PATCH_CACHE.get(disk_key)
+                if stored is not None:
+                    with _span(timer, "patch", FUSED_LORAS):
+                        if new_model is not None:
+                            new_model.add_patches(stored["model"], 1.0)
+                            MEMORY_BUDGET.track("fused_patches", new_model, _fused_patches_nbytes(stored["model"]))
+                        if new_clip is not None:
+                            new_clip.add_patches(stored["clip"], 1.0)
+                            MEMORY_BUDGET.track("fused_patches", new_clip, _fused_patches_nbytes(stored["clip"]))
+                    return new_model, new_clip
+        
+        if patches_by_lora is not None:
+            stack_patches = ((r, patches_by_lora[(r.name, r.preset)]) for r in entries)
+        else:
+            with _span(timer, "key_map"):
+                key_map = KEY_MAP_CACHE.key_map(lora_module, model, clip)
+            stack_patches = self._iter_stack_patches(lora_module, key_map, entries, timer, precision)
+        stack_patches = split_merged_patches(stack_patches, merges)
+        
+        if not fuse_low_rank:
+            for r, patches in stack_patches:
+                with _span(timer, "patch", r.name):
+                    self._add_patches(new_model, new_clip, patches, r.model_strength, r.clip_strength, r.name)
+            return new_model, new_clip
+        
+        collected = list(stack_patches)
+        with _span(timer, "fuse", FUSED_LORAS):
+            unet_keys = KEY_MAP_CACHE.unet_targets(lora_module, model)
+            all_keys = set()
+            for _, patches in collected:
+                all_keys.update(patches.keys())
+            clip_keys = all_keys - unet_keys
             
-            # For now, we'll use the standard loading but note the preset
-            # Full block-level control would require deeper integration with ComfyUI's model patcher
-            model_lora, clip_lora = comfy.sd.load_lora_for_models(
-                model, clip, lora, model_strength, clip_strength
+            fused_model, rest_model = fuse_lora_patches(
+                [(patches, r.model_strength) for r, patches in collected], unet_keys
+            )
+            fused_clip, rest_clip = fuse_lora_patches(
+                [(patches, r.clip_strength) for r, patches in collected], clip_keys
             )
         
-        return model_lora, clip_lora
+        with _span(timer, "patch", FUSED_LORAS):
+            loaded = set()
+            if new_model is not None:
+                loaded.update(new_model.add_patches(fused_model, 1.0))
+                for patches, strength in rest_model:
+                    loaded.update(new_model.add_patches(patches, strength))
+                MEMORY_BUDGET.track("fused_patches", new_model, _fused_patches_nbytes(fused_model))
+            if new_clip is not None:
+                loaded.update(new_clip.add_patches(fused_clip, 1.0))
+                for patches, strength in rest_clip:
+                    loaded.update(new_clip.add_patches(patches, strength))
+                MEMORY_BUDGET.track("fused_patches", new_clip, _fused_patches_nbytes(fused_clip))
+        # Same report as _add_patches gives on the unfused path. Plain patches at strength 0
+        # are dropped by fuse_lora_patches rather than rejected, so they are not reported
+        for r, patches in collected:
+            for key in patches:
+                strength = r.model_strength if key in unet_keys else r.clip_strength
+                if key not in loaded and strength != 0:
+                    logger.warning(f"NOT LOADED {key} ({r.name})")
+        
+        # Only stacks that fused completely are persisted; leftovers keep their own strengths
+        if disk_key is not None and not rest_model and not rest_clip:
+            FUSED_PATCH_CACHE.put(disk_key, {"model": fused_model, "clip": fused_clip})
+        
+        return new_model, new_clip
+
+    def resolve_strengths(self, plan, seed, step=0.0):
+        """
+        Resolve the MODEL/CLIP strength of every enabled LoRA in the plan for a seed.
+        Groups are partitioned with the stick-breaking method; ungrouped LoRAs use their
+        fixed strengths or a seeded draw from their range. With a step > 0, partitions and
+        random draws are snapped to that grid, so nearby seeds share strength vectors.
+        
+        Returns:
+            Tuple of ResolvedLora in stack order (groups first, then ungrouped)
+        """
+        resolved = []
+        
+        for group in plan.groups:
+            model_strengths = self.partition_strengths(
+                group.max_model, len(group.members), dict(group.locked_model), seed, step
+            )
+            clip_strengths = self.partition_strengths(
+                group.max_clip, len(group.members), dict(group.locked_clip), seed + 1, step
+            )
+            for i, lora in enumerate(group.members):
+                if lora.enabled:
+                    resolved.append(ResolvedLora(lora, group, model_strengths[i], clip_strengths[i]))
+        
+        for lora in plan.ungrouped:
+            if not lora.enabled:
+                continue
+            model_str, clip_str = self._ungrouped_strengths(lora, seed, step)
+            resolved.append(ResolvedLora(lora, None, model_str, clip_str))
+        
+        return tuple(resolved)
+
+    def _ungrouped_strengths(self, lora, seed, step=0.0):
+        """MODEL/CLIP strengths of an ungrouped LoRA: fixed, or a seeded draw from its range."""
+        if lora.random_model:
+            model_str = round(random.Random(seed).uniform(lora.min_model, lora.max_model), 4)
+            if step > 0:
+                model_str = quantize_strength(model_str, lora.min_model, lora.max_model, step)
+        else:
+            model_str = lora.model_strength
+        if lora.random_clip:
+            clip_str = round(random.Random(seed + 1).uniform(lora.min_clip, lora.max_clip), 4)
+            if step > 0:
+                clip_str = quantize_strength(clip_str, lora.min_clip, lora.max_clip, step)
+        else:
+            clip_str = lora.clip_strength
+        return model_str, clip_str
+
+    def resolve_strengths_batch(self, plan, seeds, step=0.0):
+        """
+        resolve_strengths for many seeds in one pass.
+        Group partitions for all seeds come from partition_strengths_batch, so entry k
+        equals resolve_strengths(plan, seeds[k], step).
+        
+        Returns:
+            List with one tuple of ResolvedLora per seed
+        """
+        seeds = list(seeds)
+        per_seed = [[] for _ in seeds]
+        
+        for group in plan.groups:
+            model_rows = self.partition_strengths_batch(
+                group.max_model, len(group.members), dict(group.locked_model), seeds, step
+            ).tolist()
+            clip_rows = self.partition_strengths_batch(
+                group.max_clip, len(group.members), dict(group.locked_clip), [s + 1 for s in seeds], step
+            ).tolist()
+            for resolved, model_strengths, clip_strengths in zip(per_seed, model_rows, clip_rows):
+                for i, lora in enumerate(group.members):
+                    if lora.enabled:
+                        resolved.append(ResolvedLora(lora, group, model_strengths[i], clip_strengths[i]))
+        
+        for lora in plan.ungrouped:
+            if not lora.enabled:
+                continue
+            for seed, resolved in zip(seeds, per_seed):
+                model_str, clip_str = self._ungrouped_strengths(lora, seed, step)
+                resolved.append(ResolvedLora(lora, None, model_str, clip_str))
+        
+        return [tuple(resolved) for resolved in per_seed]
+
+    @classmethod
+    def IS_CHANGED(cls, model=None, clip=None, seed=0, stack_data="", lora_precision="default", strength_step=0.0,
+                   **kwargs):
+        """
+        Report the stack signature, so ComfyUI re-executes the node when a LoRA file changes
+        on disk. This cannot skip executions: seed and the other widgets are regular inputs,
+        and ComfyUI re-runs the node whenever one of them changes, whatever is returned here.
+        A change that resolves to the same stack is served from RESULT_CACHE instead.
+        """
+        if not stack_data:
+            return ""
+        try:
+            plan = compile_stack_plan(stack_data)
+        except ValueError:
+            return "invalid"
+        resolved = cls().resolve_strengths(plan, seed, strength_step)
+        signature = stack_signature(resolved, precision=resolve_lora_precision(lora_precision))
+        return hashlib.sha1(repr(signature).encode("utf-8")).hexdigest()
+
+    def plan_stack(self, stack_data, seed, step=0.0):
+        """
+        Dry run: resolve strengths and LoRA file paths for a seed without loading any tensors.
+        Only the plan is parsed, the paths looked up and safetensors headers read (through
+        LORA_INDEX, without hashing), so scripts can validate queued
+        jobs in bulk before committing GPU time.
+        
+        Returns:
+            Dict with the seed, whether stack_data is valid, whether every LoRA file was found
+            ("ready"), the groups, the resolved LoRAs in stack order (with the indexed
+            architecture, rank, dtypes and tensor bytes of safetensors files), the duplicate
+            merges, the names of missing files and the architectures the LoRAs were trained for
+        """
+        result = {"seed": seed, "valid": True, "ready": True, "groups": [], "loras": [], "merges": [], "missing": []}
+        if not stack_data:
+            return result
+        try:
+            plan = compile_stack_plan(stack_data)
+        except ValueError as e:
+            result.update(valid=False, ready=False, error=str(e))
+            return result
+        
+        resolved = self.resolve_strengths(plan, seed, step)
+        paths = {}
+        for r in resolved:
+            if r.name not in paths:
+                paths[r.name] = folder_paths.get_full_path("loras", r.name)
+            path = paths[r.name]
+            # Header-only metadata of safetensors files; None for other formats
+            entry = LORA_INDEX.entry(path) or {}
+            result["loras"].append({
+                "name": r.name,
+                "preset": r.preset,
+                "group": r.group.index if r.group is not None else None,
+                "model_strength": r.model_strength,
+                "clip_strength": r.clip_strength,
+                "lock_model": r.entry.lock_model,
+                "lock_clip": r.entry.lock_clip,
+                "path": path,
+                "found": path is not None and os.path.isfile(path),
+                "architecture": entry.get("architecture"),
+                "rank": entry.get("rank"),
+                "dtypes": entry.get("dtypes"),
+                "tensor_bytes": entry.get("tensor_bytes"),
+            })
+        result["groups"] = [
+            {"index": group.index, "max_model": group.max_model, "max_clip": group.max_clip,
+             "members": len(group.members)}
+            for group in plan.groups
+        ]
+        result["merges"] = [_merge_line(entries) for entries in merge_duplicate_loras(resolved)[1]]
+        result["missing"] = sorted({lora["name"] for lora in result["loras"] if not lora["found"]})
+        result["ready"] = not result["missing"]
+        result["architectures"] = sorted(
+            {lora["architecture"] for lora in result["loras"] if lora["architecture"] not in (None, "unknown")}
+        )
+        return result
 
-    def apply_loras(self, model, clip, seed, stack_data=""):
+    def apply_loras(self, model, clip, seed, stack_data="", report_timings=False, fuse_low_rank=False,
+                    lora_precision="default", strength_step=0.0, profile_memory="off", dry_run=False):
         """
         Main execution function that processes all groups and solo LoRAs.
+        
+        Every stage is timed; timings go to the timing listeners and, with
+        report_timings, are appended to the info output as a JSON line.
+        With fuse_low_rank, LoRAs that patch the same weight become one higher-rank patch.
+        lora_precision keeps loaded LoRA weights in fp16/bf16 ("default" follows
+        ADVANCED_LORA_STACKER_LORA_PRECISION).
+        A strength_step > 0 snaps random strengths to that grid, so more seeds hit the caches.
+        profile_memory "log" records memory around every stage to the memory profile log;
+        "log + info" also appends the peak and per-LoRA totals to the info output.
+        With dry_run, the model and CLIP pass through unpatched and info holds the plan
+        from plan_stack; no LoRA file is read.
         """
-        print("\n" + "="*80)
-        print("Advanced LoRA Stacker - Execution")
-        print("="*80)
-        print(f"Seed: {seed}")
+        if dry_run:
+            return (model, clip, _plan_info(self.plan_stack(stack_data, seed, strength_step)))
+        
+        profiler = MemoryProfiler() if profile_memory != "off" else None
+        timer = StageTimer(profiler)
+        with profiler or nullcontext():
+            model, clip, info = self._apply_loras(
+                model, clip, seed, stack_data, timer, fuse_low_rank, resolve_lora_precision(lora_precision),
+                strength_step,
+            )
+            LORA_INDEX.save()
+            RECENT_LORAS.save()
+            MEMORY_BUDGET.enforce()
+        
+        timings = _publish_timings(timer)
+        if report_timings:
+            info += "\nTimings: " + json.dumps(timings, sort_keys=True)
+        if profiler is not None:
+            info += self._report_memory(timings, profiler, profile_memory, seed=seed)
+        return (model, clip, info)
+
+    def _report_memory(self, timings, profiler, profile_memory, **context):
+        """Log the memory profile of an execution; returns the info line for "log + info", else ""."""
+        report = memory_report(timings, profiler, node=type(self).__name__, **context)
+        write_memory_report(report)
+        if profile_memory != "log + info":
+            return ""
+        return "\nMemory: " + json.dumps({"peak": report["peak"], "by_lora": report["by_lora"]}, sort_keys=True)
+
+    def _apply_loras(self, model, clip, seed, stack_data, timer, fuse_low_rank=False, precision="original",
+                     step=0.0):
+        """Resolve, report and apply the stack; returns (model, clip, info)."""
+        # The console report is assembled only when it will actually be logged
+        verbose = logger.isEnabledFor(logging.INFO)
+        report = []
+        
+        def emit():
+            if verbose:
+                logger.info("\n".join(report))
+        
+        if verbose:
+            report.append("\n" + "="*80)
+            report.append("Advanced LoRA Stacker - Execution")
+            report.append("="*80)
+            report.append(f"Seed: {seed}")
         
         if not stack_data or stack_data == "":
-            print("No LoRAs configured")
-            print("="*80 + "\n")
+            report.append("No LoRAs configured")
+            report.append("="*80 + "\n")
+            emit()
             return (model, clip, "No LoRAs applied")
         
         try:
-            data = json.loads(stack_data)
-        except:
-            print("Invalid stack data")
-            print("="*80 + "\n")
+            with timer.span("parse"):
+                plan = compile_stack_plan(stack_data)
+        except ValueError:
+            report.append("Invalid stack data")
+            report.append("="*80 + "\n")
+            emit()
             return (model, clip, "Invalid configuration")
         
-        groups = data.get("groups", [])
-        loras = data.get("loras", [])
+        # Strengths are resolved for the whole stack first, then applied in one pass
+        with timer.span("partition"):
+            resolved = self.resolve_strengths(plan, seed, step)
         
         info_lines = []
         
-        # Process groups
-        for group in groups:
-            group_id = group.get("id")
-            max_model = group.get("max_model", 1.0)
-            max_clip = group.get("max_clip", 1.0)
-            
-            # Get all LoRAs in this group
-            group_loras = [l for l in loras if l.get("group_id") == group_id]
-            
-            if not group_loras:
-                continue
-            
-            print(f"\n{'─'*80}")
-            print(f"Group {group.get('index', 'N/A')} - Processing {len(group_loras)} LoRA(s)")
-            print(f"  Max MODEL strength: {max_model:.4f}")
-            print(f"  Max CLIP strength: {max_clip:.4f}")
-            
-            # Count locked values
-            num_locked_model = sum(1 for l in group_loras if l.get("lock_model", False))
-            num_locked_clip = sum(1 for l in group_loras if l.get("lock_clip", False))
-            if num_locked_model > 0 or num_locked_clip > 0:
-                print(f"  Locked: {num_locked_model} MODEL, {num_locked_clip} CLIP")
-            
-            print(f"{'─'*80}")
-            
-            # Separate locked and unlocked LoRAs
-            locked_model = {}
-            locked_clip = {}
-            
-            for i, lora in enumerate(group_loras):
-                if lora.get("lock_model", False):
-                    locked_model[i] = lora.get("locked_model_value", 0.0)
-                if lora.get("lock_clip", False):
-                    locked_clip[i] = lora.get("locked_clip_value", 0.0)
-            
-            # Partition strengths
-            model_strengths = self.partition_strengths(
-                max_model, len(group_loras), locked_model, seed
-            )
-            clip_strengths = self.partition_strengths(
-                max_clip, len(group_loras), locked_clip, seed + 1
-            )
+        # Report groups
+        for group in plan.groups:
+            if verbose:
+                report.append(f"\n{'─'*80}")
+                report.append(f"Group {group.index} - Processing {len(group.members)} LoRA(s)")
+                report.append(f"  Max MODEL strength: {group.max_model:.4f}")
+                report.append(f"  Max CLIP strength: {group.max_clip:.4f}")
+                
+                # Count locked values
+                num_locked_model = len(group.locked_model)
+                num_locked_clip = len(group.locked_clip)
+                if num_locked_model > 0 or num_locked_clip > 0:
+                    report.append(f"  Locked: {num_locked_model} MODEL, {num_locked_clip} CLIP")
+                
+                report.append(f"{'─'*80}")
             
-            # Apply LoRAs
-            for i, lora in enumerate(group_loras):
-                lora_name = lora.get("name", "None")
-                preset = lora.get("preset", "Full")
+            for r in resolved:
+                if r.group is not group:
+                    continue
                 
-                if lora_name and lora_name != "None":
-                    model_str = model_strengths[i]
-                    clip_str = clip_strengths[i]
-                    
-                    model, clip = self.apply_lora_with_preset(
-                        model, clip, lora_name, preset, model_str, clip_str
-                    )
-                    
+                if verbose:
                     lock_info = []
-                    if lora.get("lock_model", False):
+                    if r.entry.lock_model:
                         lock_info.append(f"MODEL locked")
-                    if lora.get("lock_clip", False):
+                    if r.entry.lock_clip:
                         lock_info.append(f"CLIP locked")
                     lock_str = f" [{', '.join(lock_info)}]" if lock_info else ""
                     
-                    print(f"  ✓ {lora_name}")
-                    print(f"    Type: {preset}")
-                    print(f"    MODEL: {model_str:.4f}  CLIP: {clip_str:.4f}{lock_str}")
-                    
-                    info_lines.append(f"[Group {group.get('index', 'N/A')}] {lora_name} ({preset}) - M:{model_str:.4f} C:{clip_str:.4f}")
+                    report.append(f"  ✓ {r.name}")
+                    report.append(f"    Type: {r.preset}")
+                    report.append(f"    MODEL: {r.model_strength:.4f}  CLIP: {r.clip_strength:.4f}{lock_str}")
+                
+                info_lines.append(_info_line(r))
         
-        # Process ungrouped LoRAs
-        ungrouped = [l for l in loras if l.get("group_id") is None]
+        # Report ungrouped LoRAs
+        if plan.ungrouped and verbose:
+            report.append(f"\n{'─'*80}")
+            report.append(f"Ungrouped LoRAs - Processing {len(plan.ungrouped)} LoRA(s)")
+            report.append(f"{'─'*80}")
         
-        if ungrouped:
-            print(f"\n{'─'*80}")
-            print(f"Ungrouped LoRAs - Processing {len(ungrouped)} LoRA(s)")
-            print(f"{'─'*80}")
+        for r in resolved:
+            if r.group is not None:
+                continue
             
-            for lora in ungrouped:
-                lora_name = lora.get("name", "None")
-                preset = lora.get("preset", "Full")
+            if verbose:
+                lora = r.entry
+                model_range_info = ""
+                if lora.random_model:
+                    model_range_info = f" (random from {lora.min_model:.4f}-{lora.max_model:.4f})"
+                clip_range_info = ""
+                if lora.random_clip:
+                    clip_range_info = f" (random from {lora.min_clip:.4f}-{lora.max_clip:.4f})"
                 
-                if lora_name and lora_name != "None":
-                    # Determine MODEL strength
-                    model_range_info = ""
-                    if lora.get("random_model", False):
-                        min_model = lora.get("min_model", 0.0)
-                        max_model = lora.get("max_model", 1.0)
-                        random.seed(seed)
-                        model_str = round(random.uniform(min_model, max_model), 4)
-                        model_range_info = f" (random from {min_model:.4f}-{max_model:.4f})"
-                    else:
-                        model_str = lora.get("model_strength", 1.0)
-                    
-                    # Determine CLIP strength
-                    clip_range_info = ""
-                    if lora.get("random_clip", False):
-                        min_clip = lora.get("min_clip", 0.0)
-                        max_clip = lora.get("max_clip", 1.0)
-                        random.seed(seed + 1)
-                        clip_str = round(random.uniform(min_clip, max_clip), 4)
-                        clip_range_info = f" (random from {min_clip:.4f}-{max_clip:.4f})"
-                    else:
-                        clip_str = lora.get("clip_strength", 1.0)
-                    
-                    model, clip = self.apply_lora_with_preset(
-                        model, clip, lora_name, preset, model_str, clip_str
-                    )
-                    
-                    print(f"  ✓ {lora_name}")
-                    print(f"    Type: {preset}")
-                    print(f"    MODEL: {model_str:.4f}{model_range_info}")
-                    print(f"    CLIP: {clip_str:.4f}{clip_range_info}")
-                    
-                    info_lines.append(f"{lora_name} ({preset}) - M:{model_str:.4f} C:{clip_str:.4f}")
+                report.append(f"  ✓ {r.name}")
+                report.append(f"    Type: {r.preset}")
+                report.append(f"    MODEL: {r.model_strength:.4f}{model_range_info}")
+                report.append(f"    CLIP: {r.clip_strength:.4f}{clip_range_info}")
+            
+            info_lines.append(_info_line(r))
+        
+        # Repeated LoRAs are applied once at their summed strengths
+        _, merges = merge_duplicate_loras(resolved)
+        if merges:
+            report.append("")
+            for entries in merges:
+                line = _merge_line(entries)
+                report.append(line)
+                info_lines.append(line)
         
-        print("="*80 + "\n")
+        # Reuse the patched model/CLIP when the same inputs resolve to the same stack
+        with timer.span("resolve_paths"):
+            signature = stack_signature(resolved, precision=precision)
+        cached = RESULT_CACHE.get(model, clip, signature) if resolved else None
+        if cached is not None:
+            model, clip = cached
+            report.append("Result cache: hit")
+            info_lines.append("Result cache: hit")
+        else:
+            patched_model, patched_clip = self.apply_lora_stack(
+                model, clip, resolved, timer, fuse_low_rank=fuse_low_rank, precision=precision,
+                signature=signature,
+            )
+            if resolved:
+                RESULT_CACHE.put(model, clip, signature, patched_model, patched_clip)
+            model, clip = patched_model, patched_clip
+        
+        if info_lines:
+            cache_summary = LORA_CACHE.summary()
+            report.append(cache_summary)
+            info_lines.append(cache_summary)
+        
+        report.append("="*80 + "\n")
+        emit()
         
         info = "\n".join(info_lines) if info_lines else "No LoRAs applied"
         return (model, clip, info)
 
 
+class AdvancedLoraStackerSweep(AdvancedLoraStacker):
+    """
+    Seed-sweep companion of the Advanced LoRA Stacker.
+    Emits one MODEL/CLIP/info per seed in [seed, seed + seed_count) as list outputs.
+    All partitions are computed in one pass and every LoRA file is loaded and converted
+    once, then shared by all variants.
+    """
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        types = super().INPUT_TYPES()
+        types["required"]["seed_count"] = ("INT", {"default": 4, "min": 1, "max": 1024})
+        return types
+
+    OUTPUT_IS_LIST = (True, True, True)
+    FUNCTION = "apply_sweep"
+
+    @classmethod
+    def IS_CHANGED(cls, model=None, clip=None, seed=0, seed_count=1, stack_data="", lora_precision="default",
+                   strength_step=0.0, **kwargs):
+        """Report the signatures of every seed's stack (see AdvancedLoraStacker.IS_CHANGED)."""
+        if not stack_data:
+            return ""
+        try:
+            plan = compile_stack_plan(stack_data)
+        except ValueError:
+            return "invalid"
+        seeds = range(seed, seed + seed_count)
+        precision = resolve_lora_precision(lora_precision)
+        per_seed = cls().resolve_strengths_batch(plan, seeds, strength_step)
+        signatures = [stack_signature(resolved, precision=precision) for resolved in per_seed]
+        return hashlib.sha1(repr(signatures).encode("utf-8")).hexdigest()
+
+    def apply_sweep(self, model, clip, seed, seed_count, stack_data="", report_timings=False, fuse_low_rank=False,
+                    lora_precision="default", strength_step=0.0, profile_memory="off", dry_run=False):
+        """
+        Apply the stack once per seed.
+        
+        Returns:
+            Tuple of (models, clips, infos) lists, one entry per seed
+        """
+        if dry_run:
+            seeds = range(seed, seed + max(1, seed_count))
+            infos = [_plan_info(self.plan_stack(stack_data, s, strength_step)) for s in seeds]
+            return ([model] * len(infos), [clip] * len(infos), infos)
+        
+        profiler = MemoryProfiler() if profile_memory != "off" else None
+        timer = StageTimer(profiler)
+        with profiler or nullcontext():
+            models, clips, infos = self._apply_sweep(
+                model, clip, seed, seed_count, stack_data, timer, fuse_low_rank,
+                resolve_lora_precision(lora_precision), strength_step,
+            )
+            LORA_INDEX.save()
+            RECENT_LORAS.save()
+            MEMORY_BUDGET.enforce()
+        
+        timings = _publish_timings(timer)
+        if report_timings:
+            timings_line = "\nTimings: " + json.dumps(timings, sort_keys=True)
+            infos = [info + timings_line for info in infos]
+        if profiler is not None:
+            memory_line = self._report_memory(timings, profiler, profile_memory, seed=seed, seed_count=seed_count)
+            infos = [info + memory_line for info in infos]
+        return (models, clips, infos)
+
+    def _apply_sweep(self, model, clip, seed, seed_count, stack_data, timer, fuse_low_rank=False,
+                     precision="original", step=0.0):
+        """Resolve every seed, load the distinct LoRAs once and patch one variant per seed."""
+        seeds = list(range(seed, seed + max(1, seed_count)))
+        
+        if not stack_data:
+            return [model] * len(seeds), [clip] * len(seeds), ["No LoRAs applied"] * len(seeds)
+        
+        try:
+            with timer.span("parse"):
+                plan = compile_stack_plan(stack_data)
+        except ValueError:
+            return [model] * len(seeds), [clip] * len(seeds), ["Invalid configuration"] * len(seeds)
+        
+        with timer.span("partition"):
+            per_seed = self.resolve_strengths_batch(plan, seeds, step)
+        
+        # Load and convert each distinct LoRA once for the whole sweep
+        distinct = {}
+        for resolved in per_seed:
+            for r in resolved:
+                distinct.setdefault((r.name, r.preset), r)
+        
+        with timer.span("resolve_paths"):
+            identities = {name: lora_file_identity(name) for name, _ in distinct}
+        
+        patches_by_lora = None
+        lora_module = _comfy_lora_module()
+        if lora_module is not None and distinct:
+            with timer.span("key_map"):
+                key_map = KEY_MAP_CACHE.key_map(lora_module, model, clip)
+            patches_by_lora = {
+                (r.name, r.preset): patches
+                for r, patches in self._iter_stack_patches(
+                    lora_module, key_map, list(distinct.values()), timer, precision
+                )
+            }
+        
+        logger.info(
+            f"Advanced LoRA Stacker - Seed sweep: {len(seeds)} seed(s) from {seed}, "
+            f"{len(distinct)} distinct LoRA(s)"
+        )
+        
+        models, clips, infos = [], [], []
+        for variant_seed, resolved in zip(seeds, per_seed):
+            info_lines = [f"Seed: {variant_seed}"] + [_info_line(r) for r in resolved]
+            info_lines += [_merge_line(entries) for entries in merge_duplicate_loras(resolved)[1]]
+            
+            signature = stack_signature(resolved, identities, precision)
+            cached = RESULT_CACHE.get(model, clip, signature) if resolved else None
+            if cached is not None:
+                variant_model, variant_clip = cached
+                info_lines.append("Result cache: hit")
+            else:
+                variant_model, variant_clip = self.apply_lora_stack(
+                    model, clip, resolved, timer, patches_by_lora, fuse_low_rank, precision, signature
+                )
+                if resolved:
+                    RESULT_CACHE.put(model, clip, signature, variant_model, variant_clip)
+            
+            models.append(variant_model)
+            clips.append(variant_clip)
+            infos.append("\n".join(info_lines) if resolved else "No LoRAs applied")
+        
+        return models, clips, infos
+
+
 class TextConcatenator:
     """
     A text concatenation node with infinite dynamic inputs.
@@ -369,12 +3099,96 @@ class TextConcatenator:
         return (concatenated, indexed)
 
 
+class LoraListCache:
+    """
+    In-memory copy of the loras folder listing served to the frontend.
+    The listing is rebuilt only when the mtime of a lora directory or one of its
+    subdirectories changes, and carries an ETag so an unchanged list is not re-sent.
+    """
+
+    def __init__(self, folder="loras"):
+        self.folder = folder
+        self._dir_mtimes = None
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _mtimes(directories):
+        mtimes = {}
+        for directory in directories:
+            try:
+                mtimes[directory] = os.stat(directory).st_mtime_ns
+            except OSError:
+                mtimes[directory] = None
+        return mtimes
+
+    def _walk_directories(self):
+        directories = []
+        for root in folder_paths.get_folder_paths(self.folder):
+            directories.append(root)
+            for dirpath, dirnames, _ in os.walk(root, followlinks=True):
+                directories.extend(os.path.join(dirpath, name) for name in dirnames)
+        return directories
+
+    def get(self):
+        """Return (names, body, etag); body is the JSON response, rebuilt only after a filesystem change."""
+        with self._lock:
+            if self._dir_mtimes is not None and self._mtimes(self._dir_mtimes) == self._dir_mtimes:
+                return self._snapshot
+
+            # Directory mtimes are taken before listing, so a concurrent change is seen next time
+            dir_mtimes = self._mtimes(self._walk_directories())
+            names = list(folder_paths.get_filename_list(self.folder))
+            body = json.dumps({"loras": names}).encode("utf-8")
+            etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+            self._dir_mtimes = dir_mtimes
+            self._snapshot = (names, body, etag)
+            return self._snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self._dir_mtimes = None
+
+
+LORA_LIST_CACHE = LoraListCache()
+
+
+def etag_matches(if_none_match, etag):
+    """Whether an If-None-Match header matches an ETag (weak comparison, as used for GET)."""
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or any(candidate.removeprefix("W/") == etag for candidate in candidates)
+
+
+if PromptServer is not None and getattr(PromptServer, "instance", None) is not None:
+    @PromptServer.instance.routes.get("/advanced_lora_stacker/loras")
+    async def get_lora_list(request):
+        """LoRA names for the node's combo boxes, without serializing the LoraLoader definition."""
+        # Checking directory mtimes touches the filesystem, so keep it off the event loop
+        _, body, etag = await asyncio.get_running_loop().run_in_executor(None, LORA_LIST_CACHE.get)
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag_matches(request.headers.get("If-None-Match"), etag):
+            return web.Response(status=304, headers=headers)
+        return web.Response(body=body, content_type="application/json", headers=headers)
+
+    @PromptServer.instance.routes.get("/advanced_lora_stacker/memory")
+    async def get_memory_stats(request):
+        """Current memory accounting of the stacker, for monitoring."""
+        return web.json_response(MEMORY_BUDGET.stats())
+
+    # Only a running server warms up; scripts and tests importing the module do not
+    start_warmup()
+
+
 NODE_CLASS_MAPPINGS = {
     "AdvancedLoraStacker": AdvancedLoraStacker,
+    "AdvancedLoraStackerSweep": AdvancedLoraStackerSweep,
     "TextConcatenator": TextConcatenator
 }
 
 NODE_DISPLAY_NAME_MAPPINGS = {
     "AdvancedLoraStacker": "Advanced LoRA Stacker",
+    "AdvancedLoraStackerSweep": "Advanced LoRA Stacker (Seed Sweep)",
     "TextConcatenator": "Text Concatenator"
 }
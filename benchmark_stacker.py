@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""
+Benchmark script for the Advanced LoRA Stacker
+Writes synthetic safetensors LoRAs to a temp dir and drives apply_loras against a
+CPU-only fake ModelPatcher, reporting latency, peak memory and throughput.
+Also compares batch (NumPy) partitioning throughput against the scalar path.
+
+Runs on a plain Linux box without a GPU; needs torch, safetensors and numpy.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import torch
+from safetensors.torch import load_file, save_file
+
+# Synthetic UNet layout: attention projections in SD1.5-style input/middle/output blocks
+INPUT_BLOCKS = (1, 2, 4, 5, 7, 8)
+OUTPUT_BLOCKS = tuple(range(3, 12))
+
+
+def synthetic_targets(key_count):
+    """LoRA key prefixes and matching model weight names, spread over the UNet blocks"""
+    blocks = [("input_blocks", i) for i in INPUT_BLOCKS] + [("middle_block", 1)] + [("output_blocks", i) for i in OUTPUT_BLOCKS]
+    targets = []
+    for n in range(key_count):
+        family, index = blocks[n % len(blocks)]
+        layer = n // len(blocks)
+        if family == "middle_block":
+            lora_key = f"lora_unet_middle_block_1_proj_{layer}"
+            model_key = f"diffusion_model.middle_block.1.proj_{layer}.weight"
+        else:
+            lora_key = f"lora_unet_{family}_{index}_1_proj_{layer}"
+            model_key = f"diffusion_model.{family}.{index}.1.proj_{layer}.weight"
+        targets.append((lora_key, model_key))
+    return targets
+
+
+def write_synthetic_lora(path, key_count, rank, dim, seed):
+    """Write a kohya-style LoRA with key_count (up, down, alpha) triplets of shape dim x rank"""
+    generator = torch.Generator().manual_seed(seed)
+    tensors = {}
+    for lora_key, _ in synthetic_targets(key_count):
+        tensors[f"{lora_key}.lora_up.weight"] = torch.randn(dim, rank, generator=generator)
+        tensors[f"{lora_key}.lora_down.weight"] = torch.randn(rank, dim, generator=generator)
+        tensors[f"{lora_key}.alpha"] = torch.tensor(float(rank))
+    save_file(tensors, path)
+    return os.path.getsize(path)
+
+
+# Fake ComfyUI: real file loading, a CPU-only ModelPatcher and the comfy.lora API
+class FakeUNet:
+    def __init__(self, key_count, dim):
+        self.key_count = key_count
+        self.dim = dim
+
+    def state_dict(self):
+        return {model_key: None for _, model_key in synthetic_targets(self.key_count)}
+
+
+class FakeModelPatcher:
+    """Stores patches like ModelPatcher; patch_weights() materializes them like sampling would"""
+
+    def __init__(self, unet, patches=None):
+        self.model = unet
+        self.cond_stage_model = unet
+        self.patches = patches if patches is not None else {}
+
+    def clone(self):
+        return FakeModelPatcher(self.model, {k: list(v) for k, v in self.patches.items()})
+
+    def add_patches(self, patches, strength_patch=1.0, strength_model=1.0):
+        for key, patch in patches.items():
+            self.patches.setdefault(key, []).append((strength_patch, patch, strength_model))
+        return list(patches.keys())
+
+    def patch_weights(self):
+        """Compute every patched weight delta, as ComfyUI does when the model is loaded"""
+        for key, patch_list in self.patches.items():
+            weight = torch.zeros(self.model.dim, self.model.dim)
+            for strength, (kind, (up, down, alpha, _, _)), _ in patch_list:
+                scale = alpha / down.shape[0] if alpha is not None else 1.0
+                weight += strength * scale * torch.mm(up.float(), down.float())
+
+
+class FakeFolderPaths:
+    lora_dir = None
+
+    @staticmethod
+    def get_full_path(folder, filename):
+        return os.path.join(FakeFolderPaths.lora_dir, filename)
+
+
+class FakeComfy:
+    class sd:
+        @staticmethod
+        def load_lora_for_models(model, clip, lora, model_strength, clip_strength):
+            raise RuntimeError("benchmark uses the comfy.lora path")
+
+    class utils:
+        @staticmethod
+        def load_torch_file(path, safe_load=True):
+            return load_file(path)
+
+    class lora:
+        @staticmethod
+        def model_lora_keys_unet(model, key_map):
+            for lora_key, model_key in synthetic_targets(model.key_count):
+                key_map[lora_key] = model_key
+            return key_map
+
+        @staticmethod
+        def model_lora_keys_clip(model, key_map):
+            return key_map
+
+        @staticmethod
+        def load_lora(lora, key_map):
+            patches = {}
+            for lora_key, model_key in key_map.items():
+                up = lora.get(f"{lora_key}.lora_up.weight")
+                if up is None:
+                    continue
+                down = lora[f"{lora_key}.lora_down.weight"]
+                alpha = lora.get(f"{lora_key}.alpha")
+                patches[model_key] = ("lora", (up, down, None if alpha is None else alpha.item(), None, None))
+            return patches
+
+sys.modules['folder_paths'] = FakeFolderPaths
+sys.modules['comfy'] = FakeComfy
+sys.modules['comfy.sd'] = FakeComfy.sd
+sys.modules['comfy.utils'] = FakeComfy.utils
+sys.modules['comfy.lora'] = FakeComfy.lora
+
+import advanced_lora_stacker
+from advanced_lora_stacker import AdvancedLoraStacker
+
+
+def reset_peak_rss():
+    """Reset the kernel's peak RSS counter (Linux); returns False where unsupported"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_bytes():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def clear_caches():
+    advanced_lora_stacker.LORA_CACHE.clear()
+    advanced_lora_stacker.RESULT_CACHE.clear()
+    advanced_lora_stacker.KEY_MAP_CACHE.clear()
+
+
+def make_stack_data(lora_names, group_size, num_locked, preset):
+    """Put the first group_size LoRAs in one group (num_locked of them locked), the rest ungrouped"""
+    loras = []
+    for i, name in enumerate(lora_names):
+        if i < group_size:
+            lora = {"id": i, "group_id": 1, "name": name, "preset": preset}
+            if i < num_locked:
+                lora.update(lock_model=True, locked_model_value=0.1, lock_clip=True, locked_clip_value=0.1)
+        else:
+            lora = {
+                "id": i, "group_id": None, "name": name, "preset": preset,
+                "random_model": True, "min_model": 0.2, "max_model": 0.8,
+                "model_strength": 0.5, "clip_strength": 0.5,
+            }
+        loras.append(lora)
+    return json.dumps({
+        "groups": [{"id": 1, "index": 1, "max_model": 1.0, "max_clip": 1.0}],
+        "loras": loras,
+    })
+
+
+def benchmark_stack(lora_names, scenario, repeats, materialize):
+    """Time apply_loras for one scenario; cold runs clear every cache before each repeat"""
+    node = AdvancedLoraStacker()
+    unet = FakeUNet(scenario["key_count"], scenario["dim"])
+    stack_data = make_stack_data(
+        lora_names[:scenario["stack_size"]], scenario["group_size"], scenario["locked"], scenario["preset"]
+    )
+
+    if scenario["cache"] == "warm":
+        clear_caches()
+        with contextlib.redirect_stdout(io.StringIO()):
+            node.apply_loras(
+                FakeModelPatcher(unet), FakeModelPatcher(unet), 0, stack_data,
+                lora_precision=scenario["precision"],
+            )
+
+    latencies = []
+    patch_latencies = []
+    python_peak = 0
+    reset_peak_rss()
+    rss_start = peak_rss_bytes()
+    for repeat in range(repeats):
+        if scenario["cache"] == "cold":
+            clear_caches()
+        # A new seed per repeat: the result cache must not short-circuit the measurement
+        seed = repeat + 1
+        tracemalloc.start()
+        start = time.perf_counter()
+        model, clip, info = node.apply_loras(
+            FakeModelPatcher(unet), FakeModelPatcher(unet), seed, stack_data,
+            fuse_low_rank=scenario["fuse"], lora_precision=scenario["precision"],
+        )
+        latencies.append(time.perf_counter() - start)
+        python_peak = max(python_peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        if materialize:
+            start = time.perf_counter()
+            model.patch_weights()
+            patch_latencies.append(time.perf_counter() - start)
+
+    latencies.sort()
+    result = dict(scenario)
+    result.update({
+        "repeats": repeats,
+        "latency_mean_s": sum(latencies) / len(latencies),
+        "latency_median_s": latencies[len(latencies) // 2],
+        "latency_min_s": latencies[0],
+        "loras_per_s": scenario["stack_size"] / (sum(latencies) / len(latencies)),
+        "python_heap_peak_bytes": python_peak,
+        "rss_peak_bytes": peak_rss_bytes(),
+        "rss_peak_growth_bytes": peak_rss_bytes() - rss_start,
+        "lora_cache_bytes": advanced_lora_stacker.LORA_CACHE.stats()["bytes"],
+    })
+    if patch_latencies:
+        result["patch_weights_mean_s"] = sum(patch_latencies) / len(patch_latencies)
+    return result
+
+
+def benchmark_partitioning(num_seeds, num_segments, num_locked):
+    """Time scalar vs batch partitioning over the same seeds and check they agree"""
+    node = AdvancedLoraStacker()
+    locked = {i: 0.1 for i in range(num_locked)}
+    seeds = list(range(num_seeds))
+
+    start = time.perf_counter()
+    scalar = [node.partition_strengths(1.0, num_segments, locked, seed) for seed in seeds]
+    scalar_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = node.partition_strengths_batch(1.0, num_segments, locked, seeds)
+    batch_time = time.perf_counter() - start
+
+    return {
+        "seeds": num_seeds,
+        "segments": num_segments,
+        "locked": num_locked,
+        "scalar_s": scalar_time,
+        "batch_s": batch_time,
+        "scalar_seeds_per_s": num_seeds / scalar_time,
+        "batch_seeds_per_s": num_seeds / batch_time,
+        "speedup": scalar_time / batch_time,
+        "match": batch.tolist() == scalar,
+    }
+
+
+def stack_scenarios(args):
+    for cache in ("cold", "warm"):
+        for stack_size in args.stack_sizes:
+            yield {
+                "stack_size": stack_size, "group_size": stack_size // 2, "locked": 0,
+                "preset": "Full", "cache": cache, "fuse": False,
+                "key_count": args.key_count, "rank": args.rank, "dim": args.dim, "precision": args.precision,
+            }
+    largest = max(args.stack_sizes)
+    for group_size in (0, largest):
+        for locked in sorted({0, min(2, group_size)}):
+            yield {
+                "stack_size": largest, "group_size": group_size, "locked": locked,
+                "preset": "Full", "cache": "cold", "fuse": False,
+                "key_count": args.key_count, "rank": args.rank, "dim": args.dim, "precision": args.precision,
+            }
+    yield {
+        "stack_size": largest, "group_size": largest // 2, "locked": 0,
+        "preset": "Fix Hands", "cache": "cold", "fuse": False,
+        "key_count": args.key_count, "rank": args.rank, "dim": args.dim, "precision": args.precision,
+    }
+    yield {
+        "stack_size": largest, "group_size": largest // 2, "locked": 0,
+        "preset": "Full", "cache": "warm", "fuse": True,
+        "key_count": args.key_count, "rank": args.rank, "dim": args.dim, "precision": args.precision,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Advanced LoRA Stacker benchmarks")
+    parser.add_argument("--stack-sizes", type=int, nargs="+", default=[1, 4, 8, 16], help="LoRAs per stack")
+    parser.add_argument("--key-count", type=int, default=64, help="LoRA modules per file")
+    parser.add_argument("--rank", type=int, default=16, help="LoRA rank")
+    parser.add_argument("--dim", type=int, default=320, help="Width of each patched weight")
+    parser.add_argument("--repeats", type=int, default=5, help="Timed runs per scenario")
+    parser.add_argument("--seeds", type=int, default=10000, help="Seeds per partition run")
+    parser.add_argument("--precision", default="original", choices=list(advanced_lora_stacker.LORA_PRECISIONS),
+                        help="In-memory storage precision of loaded LoRAs")
+    parser.add_argument("--materialize", action="store_true", help="Also time computing the patched weights")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON results file")
+    args = parser.parse_args()
+
+    results = {
+        "meta": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+        },
+        "stack": [],
+        "partitioning": [],
+    }
+
+    with tempfile.TemporaryDirectory() as lora_dir:
+        FakeFolderPaths.lora_dir = lora_dir
+        lora_names = []
+        file_bytes = 0
+        for i in range(max(args.stack_sizes)):
+            name = f"synthetic_{i:02d}.safetensors"
+            file_bytes += write_synthetic_lora(os.path.join(lora_dir, name), args.key_count, args.rank, args.dim, i)
+            lora_names.append(name)
+        results["meta"]["lora_file_bytes"] = file_bytes // len(lora_names)
+        # Index headers and content hashes up front, like a warm on-disk index
+        advanced_lora_stacker.LORA_INDEX.scan(lora_names)
+
+        print("=" * 100)
+        print(f"apply_loras: {args.key_count} keys/LoRA, rank {args.rank}, dim {args.dim}, "
+              f"{file_bytes / len(lora_names) / 2**20:.1f} MB/file")
+        print("=" * 100)
+        for scenario in stack_scenarios(args):
+            r = benchmark_stack(lora_names, scenario, args.repeats, args.materialize)
+            results["stack"].append(r)
+            print(
+                f"stack={r['stack_size']:>2} group={r['group_size']:>2} locked={r['locked']} "
+                f"preset={r['preset']:<9} cache={r['cache']:<4}{' fused' if r['fuse'] else '      '}  "
+                f"median {r['latency_median_s'] * 1000:>8.2f} ms  "
+                f"{r['loras_per_s']:>8.1f} LoRA/s  "
+                f"heap {r['python_heap_peak_bytes'] / 2**20:>6.1f} MB  "
+                f"rss {r['rss_peak_bytes'] / 2**20:>7.1f} MB  "
+                f"cache {r['lora_cache_bytes'] / 2**20:>6.1f} MB"
+                + (f"  patch {r['patch_weights_mean_s'] * 1000:.1f} ms" if "patch_weights_mean_s" in r else "")
+            )
+
+    print()
+    print("=" * 100)
+    print("Partitioning: scalar vs batch")
+    print("=" * 100)
+    for num_segments, num_locked in [(2, 0), (4, 0), (4, 1), (8, 0), (8, 2), (16, 4)]:
+        r = benchmark_partitioning(args.seeds, num_segments, num_locked)
+        results["partitioning"].append(r)
+        print(
+            f"segments={r['segments']:>2} locked={r['locked']}  "
+            f"scalar {r['scalar_seeds_per_s']:>10.0f} seeds/s  "
+            f"batch {r['batch_seeds_per_s']:>10.0f} seeds/s  "
+            f"x{r['speedup']:.1f}  match={r['match']}"
+        )
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -13,35 +13,63 @@ import { app } from "../../scripts/app.js";
 import { ComfyWidgets } from "../../scripts/widgets.js";
 
 // Store reference to available LoRAs
-let availableLoRAs = ["None"];
+// Combo widgets share this array, so it is updated in place when the list arrives
+const availableLoRAs = ["None"];
+let loraListRequest = null;
 
 /**
- * Fetch available LoRAs from ComfyUI
+ * Fetch available LoRAs from the stacker's cached list route.
+ * The server answers with an ETag, so the browser revalidates instead of re-downloading.
+ * Falls back to /object_info/LoraLoader on servers without the route.
  */
 async function fetchLoraList() {
     try {
-        const response = await fetch('/object_info/LoraLoader');
-        const data = await response.json();
-        
-        if (data && data.LoraLoader && data.LoraLoader.input && data.LoraLoader.input.required) {
-            const loraOptions = data.LoraLoader.input.required.lora_name;
-            if (loraOptions && loraOptions[0]) {
-                availableLoRAs = ["None", ...loraOptions[0]];
+        let names = null;
+        const response = await fetch('/advanced_lora_stacker/loras');
+        if (response.ok) {
+            const data = await response.json();
+            names = data && data.loras;
+        } else {
+            const data = await (await fetch('/object_info/LoraLoader')).json();
+            if (data && data.LoraLoader && data.LoraLoader.input && data.LoraLoader.input.required) {
+                const loraOptions = data.LoraLoader.input.required.lora_name;
+                names = loraOptions && loraOptions[0];
             }
         }
+        
+        if (names) {
+            availableLoRAs.splice(0, availableLoRAs.length, "None", ...names);
+        }
     } catch (error) {
         console.error("Failed to fetch LoRA list:", error);
     }
 }
 
+/**
+ * Start fetching the LoRA list once; node registration does not wait for it
+ */
+function requestLoraList() {
+    if (!loraListRequest) {
+        loraListRequest = fetchLoraList().finally(() => {
+            loraListRequest = null;
+        });
+    }
+    return loraListRequest;
+}
+
 app.registerExtension({
     name: "advanced_lora_stacker.AdvancedLoraStacker",
     
+    // Called by ComfyUI's "Refresh" button
+    async refreshComboInNodes() {
+        await requestLoraList();
+    },
+    
     async beforeRegisterNodeDef(nodeType, nodeData, app) {
-        if (nodeData.name !== "AdvancedLoraStacker") return;
+        if (nodeData.name !== "AdvancedLoraStacker" && nodeData.name !== "AdvancedLoraStackerSweep") return;
         
-        // Fetch LoRA list on load
-        await fetchLoraList();
+        // Fetch LoRA list in the background; combos pick it up when it arrives
+        requestLoraList();
         
         const onNodeCreated = nodeType.prototype.onNodeCreated;
         nodeType.prototype.onNodeCreated = function() {
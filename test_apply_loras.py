@@ -0,0 +1,561 @@
+#!/usr/bin/env python3
+"""
+Test script for AdvancedLoraStacker.apply_loras
+Tests the fused application path against a mock ModelPatcher/CLIP
+"""
+
+import contextlib
+import io
+import json
+import logging
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Mock the ComfyUI imports since we're testing standalone
+class MockPatcher:
+    """Records clones and patches the way ModelPatcher/CLIP would"""
+    clones = 0
+
+    def __init__(self, patches=None):
+        self.model = self
+        self.cond_stage_model = self
+        self.patches = dict(patches or {})
+
+    def clone(self):
+        MockPatcher.clones += 1
+        return MockPatcher({k: list(v) for k, v in self.patches.items()})
+
+    def add_patches(self, patches, strength_patch=1.0, strength_model=1.0):
+        for key, patch in patches.items():
+            self.patches.setdefault(key, []).append((strength_patch, patch))
+        return list(patches.keys())
+
+
+class MockSDXLPatcher(MockPatcher):
+    """Mock patcher whose inner model exposes state dict key names, like a real architecture"""
+    def clone(self):
+        MockPatcher.clones += 1
+        return MockSDXLPatcher({k: list(v) for k, v in self.patches.items()})
+
+    def state_dict(self):
+        return {"input_blocks.0.0.weight": None, "output_blocks.8.0.weight": None}
+
+
+class MockFolderPaths:
+    @staticmethod
+    def get_full_path(folder, filename):
+        return f"/mock/path/{folder}/{filename}"
+
+class MockComfy:
+    class sd:
+        @staticmethod
+        def load_lora_for_models(model, clip, lora, model_strength, clip_strength):
+            return model, clip
+
+    class utils:
+        delay = 0.0
+        loads = 0
+        active = 0
+        max_active = 0
+        lock = threading.Lock()
+
+        @staticmethod
+        def load_torch_file(path, safe_load=True):
+            utils = MockComfy.utils
+            with utils.lock:
+                utils.loads += 1
+                utils.active += 1
+                utils.max_active = max(utils.max_active, utils.active)
+            time.sleep(utils.delay)
+            with utils.lock:
+                utils.active -= 1
+            name = path.rsplit("/", 1)[-1]
+            return {f"{name}.weight": name}
+
+    class lora:
+        key_map_builds = 0
+
+        @staticmethod
+        def model_lora_keys_unet(model, key_map):
+            MockComfy.lora.key_map_builds += 1
+            return key_map
+
+        @staticmethod
+        def model_lora_keys_clip(model, key_map):
+            return key_map
+
+        @staticmethod
+        def load_lora(lora, key_map):
+            return {key: ("lora", value) for key, value in lora.items()}
+
+sys.modules['folder_paths'] = MockFolderPaths
+sys.modules['comfy'] = MockComfy
+sys.modules['comfy.sd'] = MockComfy.sd
+sys.modules['comfy.utils'] = MockComfy.utils
+sys.modules['comfy.lora'] = MockComfy.lora
+
+from advanced_lora_stacker import (
+    AdvancedLoraStacker,
+    AdvancedLoraStackerSweep,
+    add_timing_listener,
+    compile_stack_plan,
+    remove_timing_listener,
+)
+
+
+def make_stack(num_grouped, num_ungrouped):
+    """Build stack_data with one group and a number of ungrouped LoRAs"""
+    loras = []
+    for i in range(num_grouped):
+        loras.append({"id": i, "group_id": 1, "name": f"group_{i}.safetensors", "preset": "Full"})
+    for i in range(num_ungrouped):
+        loras.append({
+            "id": 100 + i, "group_id": None, "name": f"solo_{i}.safetensors", "preset": "Full",
+            "model_strength": 0.5, "clip_strength": 0.25,
+        })
+    return json.dumps({
+        "groups": [{"id": 1, "index": 1, "max_model": 1.0, "max_clip": 1.0}],
+        "loras": loras,
+    })
+
+
+def test_fused_single_clone():
+    """Test that a whole stack clones the model and CLIP once"""
+    print("Test 1: Fused Application")
+    print("-" * 60)
+
+    node = AdvancedLoraStacker()
+    MockPatcher.clones = 0
+    MockComfy.lora.key_map_builds = 0
+
+    model, clip, info = node.apply_loras(MockPatcher(), MockPatcher(), 42, make_stack(4, 4))
+
+    print(f"Clones: {MockPatcher.clones} (expected: 2)")
+    print(f"Key map builds: {MockComfy.lora.key_map_builds} (expected: 1)")
+    print(f"Patched keys: {len(model.patches)} (expected: 8)")
+    assert MockPatcher.clones == 2 and MockComfy.lora.key_map_builds == 1
+    assert len(model.patches) == 8 and len(clip.patches) == 8
+    print()
+
+
+def test_fused_strengths():
+    """Test that each LoRA's patches carry its own resolved strength"""
+    print("Test 2: Per-LoRA Strengths")
+    print("-" * 60)
+
+    node = AdvancedLoraStacker()
+    model, clip, info = node.apply_loras(MockPatcher(), MockPatcher(), 42, make_stack(3, 1))
+
+    group_total = sum(model.patches[f"group_{i}.safetensors.weight"][0][0] for i in range(3))
+    solo_model = model.patches["solo_0.safetensors.weight"][0][0]
+    solo_clip = clip.patches["solo_0.safetensors.weight"][0][0]
+
+    print(f"Group MODEL strengths sum: {group_total:.4f} (expected: 1.0000)")
+    print(f"Solo MODEL/CLIP: {solo_model}/{solo_clip} (expected: 0.5/0.25)")
+    assert abs(group_total - 1.0) < 1e-4
+    assert solo_model == 0.5 and solo_clip == 0.25
+    print()
+
+
+def test_parallel_prefetch():
+    """Test that LoRA files are read concurrently and patched in stack order"""
+    print("Test 3: Parallel Prefetch")
+    print("-" * 60)
+
+    node = AdvancedLoraStacker()
+    MockComfy.utils.delay = 0.05
+    MockComfy.utils.max_active = 0
+
+    start = time.perf_counter()
+    model, clip, info = node.apply_loras(MockPatcher(), MockPatcher(), 42, make_stack(0, 8))
+    elapsed = time.perf_counter() - start
+    MockComfy.utils.delay = 0.0
+
+    order = list(model.patches.keys())
+    expected = [f"solo_{i}.safetensors.weight" for i in range(8)]
+    print(f"Max concurrent loads: {MockComfy.utils.max_active} (expected: > 1)")
+    print(f"Elapsed: {elapsed:.3f}s for 8 x 0.05s loads")
+    print(f"Patched in stack order: {order == expected}")
+    assert MockComfy.utils.max_active > 1 and order == expected
+    print()
+
+
+def test_compiled_plan():
+    """Test that stack_data compiles once into an immutable, memoized plan"""
+    print("Test 4: Compiled Stack Plan")
+    print("-" * 60)
+
+    stack_data = make_stack(3, 2)
+    plan = compile_stack_plan(stack_data)
+    again = compile_stack_plan(stack_data)
+
+    print(f"Groups: {len(plan.groups)}, members: {len(plan.groups[0].members)} (expected: 1, 3)")
+    print(f"Ungrouped: {len(plan.ungrouped)} (expected: 2)")
+    print(f"Memoized: {plan is again}")
+    assert plan is again
+    assert len(plan.groups[0].members) == 3 and len(plan.ungrouped) == 2
+
+    try:
+        plan.groups[0].max_model = 2.0
+        immutable = False
+    except AttributeError:
+        immutable = True
+    print(f"Immutable: {immutable}")
+    assert immutable
+
+    try:
+        compile_stack_plan("[1, 2]")
+        rejected = False
+    except ValueError:
+        rejected = True
+    print(f"Non-object JSON rejected: {rejected}")
+    assert rejected
+    print()
+
+
+def make_random_stack(rng):
+    """Build a stack with several groups, locks and randomized ungrouped LoRAs"""
+    groups = [{"id": g, "index": g, "max_model": rng.choice([1.0, 1.5]), "max_clip": 1.0} for g in (1, 2)]
+    loras = []
+    for i in range(rng.randint(2, 10)):
+        group_id = rng.choice([None, 1, 2])
+        lora = {"id": i, "group_id": group_id, "name": f"lora_{i}.safetensors", "preset": "Full"}
+        if group_id is None:
+            lora.update(random_model=True, min_model=0.2, max_model=0.9, random_clip=rng.random() < 0.5)
+        elif rng.random() < 0.3:
+            lora.update(lock_model=True, locked_model_value=0.2)
+        loras.append(lora)
+    return json.dumps({"groups": groups, "loras": loras})
+
+
+def strength_lines(info):
+    """Strip the cache statistics, which legitimately differ between runs"""
+    return [line for line in info.splitlines() if not line.startswith(("LoRA cache", "Result cache"))]
+
+
+def test_concurrent_determinism():
+    """Test that stacks executed on many threads resolve the same strengths as sequential runs"""
+    print("Test 5: Concurrent Determinism")
+    print("-" * 60)
+
+    rng = random.Random(7)
+    jobs = [(make_random_stack(rng), rng.randint(0, 2**32)) for _ in range(50)] * 4
+    node = AdvancedLoraStacker()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        expected = [strength_lines(node.apply_loras(None, None, seed, stack)[2]) for stack, seed in jobs]
+
+        # Reseed the global random module concurrently, as other nodes might
+        stop = threading.Event()
+        def disturb():
+            while not stop.is_set():
+                random.seed(random.random())
+        disturber = threading.Thread(target=disturb)
+        disturber.start()
+
+        try:
+            with ThreadPoolExecutor(max_workers=16) as pool:
+                actual = list(pool.map(
+                    lambda job: strength_lines(AdvancedLoraStacker().apply_loras(None, None, job[1], job[0])[2]),
+                    jobs,
+                ))
+        finally:
+            stop.set()
+            disturber.join()
+
+    mismatches = sum(1 for a, e in zip(actual, expected) if a != e)
+    print(f"Jobs: {len(jobs)}, mismatches: {mismatches} (expected: 0)")
+    assert mismatches == 0
+
+    # The node must leave the interpreter-wide random state alone
+    random.seed(1234)
+    before = random.getstate()
+    with contextlib.redirect_stdout(io.StringIO()):
+        node.apply_loras(None, None, 99, jobs[0][0])
+    untouched = random.getstate() == before
+    print(f"Global random state untouched: {untouched}")
+    assert untouched
+    print()
+
+
+def test_result_cache():
+    """Test that an identical resolved stack on the same inputs reuses the patched result"""
+    print("Test 6: Result Cache and IS_CHANGED")
+    print("-" * 60)
+
+    node = AdvancedLoraStacker()
+    stack_data = make_stack(0, 3)  # fixed strengths: every seed resolves the same
+    model_in, clip_in = MockPatcher(), MockPatcher()
+
+    MockPatcher.clones = 0
+    first = node.apply_loras(model_in, clip_in, 1, stack_data)
+    second = node.apply_loras(model_in, clip_in, 2, stack_data)
+
+    print(f"Clones across two runs: {MockPatcher.clones} (expected: 2)")
+    print(f"Same patched model returned: {first[0] is second[0]}")
+    print(f"Hit reported in info: {'Result cache: hit' in second[2]}")
+    assert first[0] is second[0] and first[1] is second[1] and MockPatcher.clones == 2
+
+    other = node.apply_loras(MockPatcher(), MockPatcher(), 1, stack_data)
+    print(f"Different input model misses: {other[0] is not first[0]}")
+    assert other[0] is not first[0]
+
+    fixed_1 = AdvancedLoraStacker.IS_CHANGED(seed=1, stack_data=stack_data)
+    fixed_2 = AdvancedLoraStacker.IS_CHANGED(seed=2, stack_data=stack_data)
+    grouped_1 = AdvancedLoraStacker.IS_CHANGED(seed=1, stack_data=make_stack(3, 0))
+    grouped_2 = AdvancedLoraStacker.IS_CHANGED(seed=2, stack_data=make_stack(3, 0))
+    print(f"IS_CHANGED stable when strengths match: {fixed_1 == fixed_2}")
+    print(f"IS_CHANGED differs when strengths differ: {grouped_1 != grouped_2}")
+    assert fixed_1 == fixed_2 and grouped_1 != grouped_2
+    print()
+
+
+def test_key_map_cache():
+    """Test that the LoRA key mapping is built once per architecture"""
+    print("Test 7: Key Mapping Cache")
+    print("-" * 60)
+
+    node = AdvancedLoraStacker()
+    MockComfy.lora.key_map_builds = 0
+
+    for seed in range(5):
+        # Fresh model instances of the same architecture on every execution
+        node.apply_loras(MockSDXLPatcher(), MockSDXLPatcher(), seed, make_stack(3, 2))
+        node.apply_lora_with_preset(MockSDXLPatcher(), MockSDXLPatcher(), "extra.safetensors", "Full", 1.0, 1.0)
+
+    print(f"UNet key map builds over 10 applications: {MockComfy.lora.key_map_builds} (expected: 1)")
+    assert MockComfy.lora.key_map_builds == 1
+    print()
+
+
+def test_stage_timings():
+    """Test that stage timings reach listeners and the optional JSON info block"""
+    print("Test 8: Stage Timings")
+    print("-" * 60)
+
+    node = AdvancedLoraStacker()
+    received = []
+    add_timing_listener(received.append)
+    try:
+        _, _, info = node.apply_loras(MockPatcher(), MockPatcher(), 3, make_stack(2, 2), report_timings=True)
+        _, _, plain_info = node.apply_loras(MockPatcher(), MockPatcher(), 3, make_stack(2, 2))
+    finally:
+        remove_timing_listener(received.append)
+
+    timing_line = [line for line in info.splitlines() if line.startswith("Timings: ")]
+    timings = json.loads(timing_line[0][len("Timings: "):]) if timing_line else {}
+    stages = set(timings.get("stages", {}))
+    expected = {"parse", "partition", "resolve_paths", "key_map", "load", "patch"}
+    per_lora_loads = [s for s in timings.get("spans", []) if s["stage"] == "load" and "lora" in s]
+
+    print(f"Listener calls: {len(received)} (expected: 2)")
+    print(f"Stages: {sorted(stages)}")
+    print(f"Per-LoRA load spans: {len(per_lora_loads)} (expected: 4)")
+    print(f"No timings without report_timings: {'Timings:' not in plain_info}")
+    assert len(received) == 2 and expected <= stages and len(per_lora_loads) == 4
+    assert "Timings:" not in plain_info
+    print()
+
+
+def test_seed_sweep():
+    """Test that the sweep node matches per-seed runs while loading each file once"""
+    print("Test 9: Seed Sweep")
+    print("-" * 60)
+
+    stack_data = make_random_stack(random.Random(11))
+    sweep = AdvancedLoraStackerSweep()
+    single = AdvancedLoraStacker()
+
+    MockComfy.utils.loads = 0
+    MockPatcher.clones = 0
+    models, clips, infos = sweep.apply_sweep(MockPatcher(), MockPatcher(), 100, 6, stack_data)
+    sweep_loads = MockComfy.utils.loads
+    num_loras = len(compile_stack_plan(stack_data).ungrouped) + sum(
+        len(g.members) for g in compile_stack_plan(stack_data).groups
+    )
+
+    expected = [
+        strength_lines(single.apply_loras(MockPatcher(), MockPatcher(), seed, stack_data)[2])
+        for seed in range(100, 106)
+    ]
+    actual = [strength_lines(info)[1:] for info in infos]
+
+    print(f"Outputs: {len(models)} models, {len(clips)} clips, {len(infos)} infos (expected: 6 each)")
+    print(f"Files loaded by the sweep: {sweep_loads} (expected: {num_loras})")
+    print(f"Strengths match per-seed runs: {actual == expected}")
+    assert len(models) == len(clips) == len(infos) == 6
+    assert sweep_loads == num_loras and actual == expected
+    print()
+
+
+def apply_with_patch_kind(node, stack_data, dora):
+    """Apply a stack with load_lora returning plain LoRA patches, or DoRA ones (with a dora_scale)"""
+    load_lora = MockComfy.lora.load_lora
+    dora_scale = "dora_scale" if dora else None
+
+    def load_kind(lora, key_map):
+        return {key: ("lora", (value, value, None, None, dora_scale)) for key, value in lora.items()}
+
+    MockComfy.lora.load_lora = staticmethod(load_kind)
+    try:
+        return node.apply_loras(MockPatcher(), MockPatcher(), 5, stack_data)
+    finally:
+        MockComfy.lora.load_lora = staticmethod(load_lora)
+
+
+def test_duplicate_loras_merged():
+    """Test that a LoRA used twice is loaded once, and patched once at the summed strengths unless it is DoRA"""
+    print("Test 10: Duplicate LoRAs")
+    print("-" * 60)
+
+    stack_data = json.dumps({
+        "groups": [{"id": 1, "index": 1, "max_model": 1.0, "max_clip": 1.0}],
+        "loras": [
+            {"id": 1, "group_id": 1, "name": "style.safetensors", "preset": "Full",
+             "lock_model": True, "locked_model_value": 0.3, "lock_clip": True, "locked_clip_value": 0.2},
+            {"id": 2, "group_id": 1, "name": "other.safetensors", "preset": "Full"},
+            {"id": 3, "group_id": None, "name": "style.safetensors", "preset": "Full",
+             "model_strength": 0.5, "clip_strength": 0.25},
+            {"id": 4, "group_id": None, "name": "other.safetensors", "preset": "Style",
+             "model_strength": 0.5, "clip_strength": 0.5},
+        ],
+    })
+    node = AdvancedLoraStacker()
+
+    MockComfy.utils.loads = 0
+    model, clip, info = apply_with_patch_kind(node, stack_data, dora=False)
+    style_patches = model.patches["style.safetensors.weight"]
+    merge_lines = [line for line in info.split("\n") if line.startswith("Merged")]
+
+    print(f"Files loaded: {MockComfy.utils.loads} (expected: 2)")
+    print(f"Patches for style: {[round(s, 4) for s, _ in style_patches]} (expected: [0.8])")
+    print(f"Patches for other: {len(model.patches['other.safetensors.weight'])} (expected: 2, presets differ)")
+    for line in merge_lines:
+        print(f"  {line}")
+    assert MockComfy.utils.loads == 2
+    assert len(style_patches) == 1 and abs(style_patches[0][0] - 0.8) < 1e-9
+    assert abs(clip.patches["style.safetensors.weight"][0][0] - 0.45) < 1e-9
+    assert merge_lines == ["Merged 2x style.safetensors (Full) [Group 1, Ungrouped] - M:0.8000 C:0.4500"]
+
+    # DoRA deltas depend on the already patched weight, so each use keeps its own patch
+    MockComfy.utils.loads = 0
+    model, clip, _ = apply_with_patch_kind(node, stack_data, dora=True)
+    dora_strengths = [round(s, 4) for s, _ in model.patches["style.safetensors.weight"]]
+    print(f"DoRA patches for style: {dora_strengths} (expected: [0.3, 0.5]), files loaded: {MockComfy.utils.loads}")
+    assert MockComfy.utils.loads == 2 and dora_strengths == [0.3, 0.5]
+    assert [round(s, 4) for s, _ in clip.patches["style.safetensors.weight"]] == [0.2, 0.25]
+    print()
+
+
+def test_dry_run():
+    """Test that a dry run resolves the same strengths without loading or patching anything"""
+    print("Test 11: Dry Run")
+    print("-" * 60)
+
+    stack_data = make_stack(3, 2)
+    node = AdvancedLoraStacker()
+    original_get_full_path = MockFolderPaths.get_full_path
+    # Group LoRAs exist on disk, ungrouped ones are missing
+    MockFolderPaths.get_full_path = staticmethod(
+        lambda folder, filename: __file__ if filename.startswith("group_") else None
+    )
+    try:
+        MockComfy.utils.loads = 0
+        MockPatcher.clones = 0
+        model = MockPatcher()
+        start = time.perf_counter()
+        plans = [node.plan_stack(stack_data, seed) for seed in range(1000)]
+        elapsed = time.perf_counter() - start
+        out_model, _, info = node.apply_loras(model, MockPatcher(), 42, stack_data, dry_run=True)
+    finally:
+        MockFolderPaths.get_full_path = original_get_full_path
+
+    plan = plans[42]
+    resolved = node.resolve_strengths(compile_stack_plan(stack_data), 42)
+    print(f"Per plan: {elapsed / len(plans) * 1e6:.1f} us")
+    print(f"Files loaded: {MockComfy.utils.loads}, clones: {MockPatcher.clones} (expected: 0, 0)")
+    print(f"Ready: {plan['ready']}, missing: {plan['missing']}")
+    print(info.split("\n")[0])
+    assert MockComfy.utils.loads == 0 and MockPatcher.clones == 0 and out_model is model
+    assert [l["model_strength"] for l in plan["loras"]] == [r.model_strength for r in resolved]
+    assert plan["missing"] == ["solo_0.safetensors", "solo_1.safetensors"] and not plan["ready"]
+    assert json.loads(info.split("\nPlan: ")[1]) == plan
+    assert not node.plan_stack("not json", 0)["valid"]
+    print()
+
+
+def test_fused_unloaded_keys_reported():
+    """Test that keys no patcher accepts are reported with fuse_low_rank, as without it"""
+    print("Test 12: Unloaded Keys With Fusion")
+    print("-" * 60)
+
+    class RejectingPatcher(MockPatcher):
+        """Accepts every key except those of broken LoRAs, like a model missing those weights"""
+        def clone(self):
+            return RejectingPatcher(self.patches)
+
+        def add_patches(self, patches, strength_patch=1.0, strength_model=1.0):
+            accepted = {k: v for k, v in patches.items() if not k.startswith("broken")}
+            return super().add_patches(accepted, strength_patch, strength_model)
+
+    class Capture(logging.Handler):
+        def __init__(self):
+            super().__init__()
+            self.messages = []
+
+        def emit(self, record):
+            self.messages.append(record.getMessage())
+
+    stack_data = json.dumps({"groups": [], "loras": [
+        {"id": 1, "group_id": None, "name": "good.safetensors", "preset": "Full"},
+        {"id": 2, "group_id": None, "name": "broken.safetensors", "preset": "Full"},
+    ]})
+    capture = Capture()
+    logging.getLogger("advanced_lora_stacker").addHandler(capture)
+    try:
+        reported = {}
+        for fuse in (False, True):
+            capture.messages.clear()
+            AdvancedLoraStacker().apply_loras(
+                RejectingPatcher(), RejectingPatcher(), 3, stack_data, fuse_low_rank=fuse
+            )
+            reported[fuse] = [m for m in capture.messages if m.startswith("NOT LOADED")]
+    finally:
+        logging.getLogger("advanced_lora_stacker").removeHandler(capture)
+
+    print(f"Unfused: {reported[False]}")
+    print(f"Fused:   {reported[True]}")
+    assert reported[True] == reported[False] == ["NOT LOADED broken.safetensors.weight (broken.safetensors)"]
+    print()
+
+
+def run_all_tests():
+    """Run all tests"""
+    print("=" * 60)
+    print("Advanced LoRA Stacker - apply_loras Tests")
+    print("=" * 60)
+    print()
+
+    test_fused_single_clone()
+    test_fused_strengths()
+    test_parallel_prefetch()
+    test_compiled_plan()
+    test_concurrent_determinism()
+    test_result_cache()
+    test_key_map_cache()
+    test_stage_timings()
+    test_seed_sweep()
+    test_duplicate_loras_merged()
+    test_dry_run()
+    test_fused_unloaded_keys_reported()
+
+    print("=" * 60)
+    print("All tests completed!")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    run_all_tests()
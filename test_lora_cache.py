@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Test script for the shared LoRA load cache
+Tests hit/miss accounting, invalidation and byte-bounded LRU eviction
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Mock the ComfyUI imports since we're testing standalone
+LOAD_CALLS = []
+LOAD_DELAY = [0.0]
+
+
+class FakeTensor:
+    """Minimal stand-in for a torch tensor: only what the cache needs for byte accounting"""
+    def __init__(self, nbytes):
+        self.nbytes = nbytes
+
+    def numel(self):
+        return self.nbytes
+
+    def element_size(self):
+        return 1
+
+
+class MockFolderPaths:
+    @staticmethod
+    def get_full_path(folder, filename):
+        return filename
+
+class MockComfy:
+    class sd:
+        @staticmethod
+        def load_lora_for_models(model, clip, lora, model_strength, clip_strength):
+            return model, clip
+
+    class utils:
+        @staticmethod
+        def load_torch_file(path, safe_load=True):
+            LOAD_CALLS.append(path)
+            time.sleep(LOAD_DELAY[0])
+            with open(path, "rb") as f:
+                return {"weight": FakeTensor(len(f.read()))}
+
+sys.modules['folder_paths'] = MockFolderPaths
+sys.modules['comfy'] = MockComfy
+sys.modules['comfy.sd'] = MockComfy.sd
+sys.modules['comfy.utils'] = MockComfy.utils
+
+import advanced_lora_stacker
+from advanced_lora_stacker import LoraCache, load_lora_file
+
+
+def write_lora(directory, name, size):
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.write(b"\0" * size)
+    return path
+
+
+def test_hits_and_misses():
+    """Test that a repeated load is served from the cache"""
+    print("Test 1: Hits and Misses")
+    print("-" * 60)
+
+    advanced_lora_stacker.LORA_CACHE = LoraCache(10_000)
+    LOAD_CALLS.clear()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_lora(tmp, "a.safetensors", 100)
+        first = load_lora_file(path)
+        second = load_lora_file(path)
+
+    stats = advanced_lora_stacker.LORA_CACHE.stats()
+    print(f"Disk loads: {len(LOAD_CALLS)} (expected: 1)")
+    print(f"Stats: {stats}")
+    print(f"Same object returned: {first is second}")
+    assert len(LOAD_CALLS) == 1 and stats["hits"] == 1 and stats["misses"] == 1
+    print()
+
+
+def test_invalidation_on_change():
+    """Test that modifying a file invalidates its cache entry"""
+    print("Test 2: Invalidation on File Change")
+    print("-" * 60)
+
+    advanced_lora_stacker.LORA_CACHE = LoraCache(10_000)
+    LOAD_CALLS.clear()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_lora(tmp, "a.safetensors", 100)
+        load_lora_file(path)
+        write_lora(tmp, "a.safetensors", 200)
+        reloaded = load_lora_file(path)
+
+    print(f"Disk loads: {len(LOAD_CALLS)} (expected: 2)")
+    print(f"Reloaded size: {reloaded['weight'].nbytes} (expected: 200)")
+    assert len(LOAD_CALLS) == 2 and reloaded["weight"].nbytes == 200
+    print()
+
+
+def test_lru_eviction():
+    """Test that the least recently used entry is evicted when over budget"""
+    print("Test 3: LRU Eviction")
+    print("-" * 60)
+
+    advanced_lora_stacker.LORA_CACHE = LoraCache(250)
+    LOAD_CALLS.clear()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        a = write_lora(tmp, "a.safetensors", 100)
+        b = write_lora(tmp, "b.safetensors", 100)
+        c = write_lora(tmp, "c.safetensors", 100)
+        load_lora_file(a)
+        load_lora_file(b)
+        load_lora_file(a)  # a is now most recently used
+        load_lora_file(c)  # evicts b
+        LOAD_CALLS.clear()
+        load_lora_file(a)
+        load_lora_file(b)
+
+    stats = advanced_lora_stacker.LORA_CACHE.stats()
+    print(f"Reloaded after eviction: {[os.path.basename(p) for p in LOAD_CALLS]} (expected: ['b.safetensors'])")
+    print(f"Stats: {stats}")
+    assert [os.path.basename(p) for p in LOAD_CALLS] == ["b.safetensors"]
+    assert stats["bytes"] <= stats["max_bytes"]
+    print()
+
+
+def test_concurrent_loads_coalesced():
+    """Test that many parallel loads of one file read it once and share the tensors"""
+    print("Test 4: Concurrent Load Coalescing")
+    print("-" * 60)
+
+    results = {}
+    for label, max_bytes in (("cached", 10_000), ("too large to cache", 10)):
+        advanced_lora_stacker.LORA_CACHE = LoraCache(max_bytes)
+        LOAD_CALLS.clear()
+        LOAD_DELAY[0] = 0.2
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                path = write_lora(tmp, "shared.safetensors", 100)
+                barrier = threading.Barrier(16)
+
+                def load():
+                    barrier.wait()
+                    return load_lora_file(path)
+
+                with ThreadPoolExecutor(max_workers=16) as pool:
+                    loras = list(pool.map(lambda _: load(), range(16)))
+        finally:
+            LOAD_DELAY[0] = 0.0
+        shared = all(lora is loras[0] for lora in loras)
+        results[label] = (len(LOAD_CALLS), shared)
+        print(f"{label}: {len(LOAD_CALLS)} disk read(s) for 16 loads (expected: 1), shared: {shared}")
+
+    assert all(reads == 1 and shared for reads, shared in results.values())
+    print()
+
+
+def run_all_tests():
+    """Run all tests"""
+    print("=" * 60)
+    print("LoRA Cache - Tests")
+    print("=" * 60)
+    print()
+
+    test_hits_and_misses()
+    test_invalidation_on_change()
+    test_lru_eviction()
+    test_concurrent_loads_coalesced()
+
+    print("=" * 60)
+    print("All tests completed!")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    run_all_tests()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Test script for the safetensors copies of pickle LoRAs
+Tests one-time conversion, loading from the copy and reconversion of changed sources
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import torch
+from safetensors.torch import load_file
+
+# Mock the ComfyUI imports since we're testing standalone
+LOAD_CALLS = []
+
+
+class MockFolderPaths:
+    @staticmethod
+    def get_full_path(folder, filename):
+        return filename
+
+class MockComfy:
+    class sd:
+        @staticmethod
+        def load_lora_for_models(model, clip, lora, model_strength, clip_strength):
+            return model, clip
+
+    class utils:
+        @staticmethod
+        def load_torch_file(path, safe_load=True):
+            LOAD_CALLS.append(os.path.splitext(path)[1])
+            if path.endswith(".safetensors"):
+                return load_file(path)
+            return torch.load(path, weights_only=True)
+
+sys.modules['folder_paths'] = MockFolderPaths
+sys.modules['comfy'] = MockComfy
+sys.modules['comfy.sd'] = MockComfy.sd
+sys.modules['comfy.utils'] = MockComfy.utils
+
+import advanced_lora_stacker
+from advanced_lora_stacker import ConvertedLoraCache, LoraCache, load_lora_file
+
+
+def write_pickle_lora(path, seed=0):
+    """Save a kohya-style LoRA as a pickle, with up/down stored as views of one tensor"""
+    generator = torch.Generator().manual_seed(seed)
+    tensors = {}
+    for i in (3, 6, 9):
+        prefix = f"lora_unet_output_blocks_{i}_1_proj_in"
+        packed = torch.randn(2, 8, 32, generator=generator)
+        tensors[f"{prefix}.lora_up.weight"] = packed[0].t()
+        tensors[f"{prefix}.lora_down.weight"] = packed[1]
+        tensors[f"{prefix}.alpha"] = torch.tensor(8.0)
+    torch.save(tensors, path)
+    return tensors
+
+
+def fresh_caches(directory):
+    advanced_lora_stacker.LORA_CACHE = LoraCache(2**30)
+    advanced_lora_stacker.CONVERTED_LORAS = ConvertedLoraCache(directory)
+
+
+def test_converted_once():
+    """Test that a pickle LoRA is converted on first use and read from the copy afterwards"""
+    print("Test 1: One-Time Conversion")
+    print("-" * 60)
+
+    LOAD_CALLS.clear()
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "legacy.pt")
+        original = write_pickle_lora(source)
+        converted_dir = os.path.join(tmp, "converted")
+        fresh_caches(converted_dir)
+
+        first = load_lora_file(source)
+        advanced_lora_stacker.CONVERTED_LORAS.flush()
+        copies = os.listdir(converted_dir)
+
+        # Simulate a restart
+        fresh_caches(converted_dir)
+        second = load_lora_file(source)
+        partial = load_lora_file(source, blocks=(7, 7))
+
+    print(f"Reads: {LOAD_CALLS} (expected: ['.pt', '.safetensors'])")
+    print(f"Converted copies: {copies}")
+    print(f"Preset read keys: {len(partial)} of {len(second)}")
+    assert LOAD_CALLS == [".pt", ".safetensors"] and len(copies) == 1
+    assert set(second) == set(original)
+    assert all(torch.equal(second[key], original[key]) and torch.equal(first[key], original[key]) for key in original)
+    assert 0 < len(partial) < len(second)
+    print()
+
+
+def test_changed_source_reconverted():
+    """Test that a modified source is converted again and its stale copy removed"""
+    print("Test 2: Changed Source")
+    print("-" * 60)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "legacy.ckpt")
+        converted_dir = os.path.join(tmp, "converted")
+        write_pickle_lora(source, seed=1)
+        fresh_caches(converted_dir)
+        load_lora_file(source)
+        advanced_lora_stacker.CONVERTED_LORAS.flush()
+        before = os.listdir(converted_dir)
+
+        time.sleep(0.01)
+        updated = write_pickle_lora(source, seed=2)
+        fresh_caches(converted_dir)
+        LOAD_CALLS.clear()
+        load_lora_file(source)
+        advanced_lora_stacker.CONVERTED_LORAS.flush()
+        after = os.listdir(converted_dir)
+
+        fresh_caches(converted_dir)
+        reloaded = load_lora_file(source)
+
+    print(f"Copies before: {before}, after: {after}")
+    print(f"Reads after the change: {LOAD_CALLS} (expected: ['.ckpt', '.safetensors'])")
+    assert len(before) == 1 and len(after) == 1 and before != after
+    assert LOAD_CALLS == [".ckpt", ".safetensors"]
+    assert all(torch.equal(reloaded[key], updated[key]) for key in updated)
+    print()
+
+
+def test_disabled():
+    """Test that no copies are written when the cache has no directory"""
+    print("Test 3: Disabled Cache")
+    print("-" * 60)
+
+    LOAD_CALLS.clear()
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "legacy.pt")
+        write_pickle_lora(source)
+        for _ in range(2):
+            fresh_caches(None)
+            load_lora_file(source)
+        files = sorted(os.listdir(tmp))
+
+    print(f"Reads: {LOAD_CALLS}, files: {files}")
+    assert LOAD_CALLS == [".pt", ".pt"] and files == ["legacy.pt"]
+    print()
+
+
+def run_all_tests():
+    """Run all tests"""
+    print("=" * 60)
+    print("Pickle LoRA Conversion - Tests")
+    print("=" * 60)
+    print()
+
+    test_converted_once()
+    test_changed_source_reconverted()
+    test_disabled()
+
+    print("=" * 60)
+    print("All tests completed!")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    run_all_tests()
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Test script for the persistent LoRA metadata index
+Tests header-only indexing, incremental updates, deduplication by content hash,
+background hashing and cache sizing from headers
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import torch
+from safetensors.torch import load_file, save_file
+
+# Mock the ComfyUI imports since we're testing standalone
+LOAD_CALLS = []
+
+
+class MockFolderPaths:
+    lora_dir = None
+
+    @staticmethod
+    def get_full_path(folder, filename):
+        return os.path.join(MockFolderPaths.lora_dir, filename)
+
+    @staticmethod
+    def get_filename_list(folder):
+        return sorted(os.listdir(MockFolderPaths.lora_dir))
+
+class MockComfy:
+    class sd:
+        @staticmethod
+        def load_lora_for_models(model, clip, lora, model_strength, clip_strength):
+            return model, clip
+
+    class utils:
+        @staticmethod
+        def load_torch_file(path, safe_load=True):
+            LOAD_CALLS.append(path)
+            return load_file(path)
+
+sys.modules['folder_paths'] = MockFolderPaths
+sys.modules['comfy'] = MockComfy
+sys.modules['comfy.sd'] = MockComfy.sd
+sys.modules['comfy.utils'] = MockComfy.utils
+
+import advanced_lora_stacker
+from advanced_lora_stacker import LoraCache, LoraIndex, lora_file_identity, load_lora_file
+
+
+def write_lora(directory, name, rank=8, seed=0, sdxl=False):
+    """Write a kohya-style LoRA covering a few output blocks and the text encoder"""
+    generator = torch.Generator().manual_seed(seed)
+    tensors = {}
+    prefixes = [f"lora_unet_output_blocks_{i}_1_proj_in" for i in (3, 6, 9)]
+    prefixes.append("lora_te1_text_model_encoder_layers_0_mlp_fc1" if sdxl else "lora_te_text_model_encoder_layers_0_mlp_fc1")
+    if sdxl:
+        prefixes.append("lora_te2_text_model_encoder_layers_0_mlp_fc1")
+    for prefix in prefixes:
+        tensors[f"{prefix}.lora_up.weight"] = torch.randn(32, rank, generator=generator)
+        tensors[f"{prefix}.lora_down.weight"] = torch.randn(rank, 32, generator=generator).half()
+        tensors[f"{prefix}.alpha"] = torch.tensor(float(rank))
+    save_file(tensors, os.path.join(directory, name))
+
+
+class CountingHash:
+    """Wraps the index's file hashing to count full-file reads"""
+    def __init__(self):
+        self.paths = []
+        self._hash_file = advanced_lora_stacker._hash_file
+
+    def __call__(self, path, *args):
+        self.paths.append(os.path.basename(path))
+        return self._hash_file(path, *args)
+
+
+def test_header_only_metadata():
+    """Test that scanning describes LoRAs from their headers without loading tensors"""
+    print("Test 1: Header-Only Metadata")
+    print("-" * 60)
+
+    LOAD_CALLS.clear()
+    with tempfile.TemporaryDirectory() as tmp:
+        MockFolderPaths.lora_dir = tmp
+        write_lora(tmp, "sd15.safetensors", rank=8)
+        write_lora(tmp, "xl.safetensors", rank=16, sdxl=True)
+        entries = LoraIndex().scan()
+
+    sd15, xl = entries["sd15.safetensors"], entries["xl.safetensors"]
+    print(f"sd15: rank={sd15['rank']} arch={sd15['architecture']} dtypes={sd15['dtypes']} blocks={sd15['blocks']}")
+    print(f"xl:   rank={xl['rank']} arch={xl['architecture']} bytes={xl['tensor_bytes']}")
+    print(f"Tensor loads: {len(LOAD_CALLS)} (expected: 0)")
+    assert sd15["rank"] == 8 and xl["rank"] == 16
+    assert sd15["architecture"] == "sd1" and xl["architecture"] == "sdxl"
+    assert sd15["dtypes"] == ["F16", "F32"] and sd15["is_lora"]
+    assert sd15["blocks"] == [7, 9, 10]
+    assert "sha256" in sd15 and "keys" not in sd15 and not LOAD_CALLS
+    print()
+
+
+def test_incremental_updates():
+    """Test that only new or modified files are re-read, and that the index persists"""
+    print("Test 2: Incremental Updates")
+    print("-" * 60)
+
+    counting = CountingHash()
+    advanced_lora_stacker._hash_file = counting
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            lora_dir = os.path.join(tmp, "loras")
+            os.mkdir(lora_dir)
+            MockFolderPaths.lora_dir = lora_dir
+            index_path = os.path.join(tmp, "index", "lora_index.json")
+            write_lora(lora_dir, "a.safetensors", seed=1)
+            write_lora(lora_dir, "b.safetensors", seed=2)
+
+            LoraIndex(index_path).scan()
+            first = list(counting.paths)
+
+            counting.paths.clear()
+            time.sleep(0.01)
+            write_lora(lora_dir, "b.safetensors", rank=4, seed=3)
+            entries = LoraIndex(index_path).scan()
+            second = list(counting.paths)
+    finally:
+        advanced_lora_stacker._hash_file = counting._hash_file
+
+    print(f"First scan hashed: {sorted(first)}")
+    print(f"Rescan from disk hashed: {second} (expected: ['b.safetensors'])")
+    print(f"Updated rank: {entries['b.safetensors']['rank']} (expected: 4)")
+    assert sorted(first) == ["a.safetensors", "b.safetensors"]
+    assert second == ["b.safetensors"] and entries["b.safetensors"]["rank"] == 4
+    print()
+
+
+def test_duplicates_share_cache():
+    """Test that identical files under different names are found and loaded once"""
+    print("Test 3: Deduplication by Content Hash")
+    print("-" * 60)
+
+    advanced_lora_stacker.LORA_INDEX = LoraIndex()
+    advanced_lora_stacker.LORA_CACHE = LoraCache(2**30)
+    LOAD_CALLS.clear()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        MockFolderPaths.lora_dir = tmp
+        write_lora(tmp, "style.safetensors", seed=5)
+        shutil.copy(os.path.join(tmp, "style.safetensors"), os.path.join(tmp, "style_copy.safetensors"))
+        write_lora(tmp, "other.safetensors", seed=6)
+
+        advanced_lora_stacker.LORA_INDEX.scan()
+        duplicates = advanced_lora_stacker.LORA_INDEX.duplicates()
+        first = load_lora_file(os.path.join(tmp, "style.safetensors"))
+        second = load_lora_file(os.path.join(tmp, "style_copy.safetensors"))
+        same_identity = lora_file_identity("style.safetensors") == lora_file_identity("style_copy.safetensors")
+
+    groups = [sorted(os.path.basename(p) for p in paths) for paths in duplicates.values()]
+    print(f"Duplicate groups: {groups}")
+    print(f"Disk loads: {len(LOAD_CALLS)} (expected: 1)")
+    print(f"Same cached object: {first is second}, same identity: {same_identity}")
+    assert groups == [["style.safetensors", "style_copy.safetensors"]]
+    assert len(LOAD_CALLS) == 1 and first is second and same_identity
+    print()
+
+
+def test_hashing_off_load_path():
+    """Test that loads never hash, and that the background hash moves cached variants to the content key"""
+    print("Test 4: Background Hashing")
+    print("-" * 60)
+
+    counting = CountingHash()
+    advanced_lora_stacker._hash_file = counting
+    advanced_lora_stacker.LORA_CACHE = LoraCache(2**30)
+    index = LoraIndex(
+        on_hashed=lambda file_key, digest: advanced_lora_stacker.LORA_CACHE.rekey(file_key, ("sha256", digest))
+    )
+    advanced_lora_stacker.LORA_INDEX = index
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            MockFolderPaths.lora_dir = tmp
+            write_lora(tmp, "style.safetensors", seed=7)
+            path = os.path.join(tmp, "style.safetensors")
+
+            before = lora_file_identity("style.safetensors")
+            hashed_on_lookup = list(counting.paths)
+            lora = load_lora_file(path)
+            index.flush()
+            after = lora_file_identity("style.safetensors")
+            digest = index.entry(path)["sha256"]
+            rekeyed = advanced_lora_stacker.LORA_CACHE.peek(("sha256", digest, None, "original"))
+    finally:
+        advanced_lora_stacker._hash_file = counting._hash_file
+
+    print(f"Hashed by identity lookup: {hashed_on_lookup} (expected: [])")
+    print(f"Identity before/after hashing: {before[0] != 'sha256'}/{after[0] == 'sha256'}")
+    print(f"Background hashes: {counting.paths}, cache entry moved: {rekeyed is lora}")
+    assert not hashed_on_lookup and before[0] != "sha256"
+    assert counting.paths == ["style.safetensors"] and after == ("sha256", digest)
+    assert rekeyed is lora and advanced_lora_stacker.LORA_CACHE.stats()["entries"] == 1
+    print()
+
+
+def test_cache_sized_from_header():
+    """Test that the cache makes room before a read, and skips files it could never hold"""
+    print("Test 5: Cache Sizing from Headers")
+    print("-" * 60)
+
+    advanced_lora_stacker.LORA_INDEX = LoraIndex()
+    with tempfile.TemporaryDirectory() as tmp:
+        write_lora(tmp, "style.safetensors", seed=8)
+        path = os.path.join(tmp, "style.safetensors")
+        tensor_bytes = advanced_lora_stacker.LORA_INDEX.entry(path)["tensor_bytes"]
+        filler = {"weight": torch.zeros(tensor_bytes, dtype=torch.uint8)}
+
+        # Record whether the filler is still cached when the file is read
+        load_torch_file = MockComfy.utils.load_torch_file
+        filler_at_read = []
+
+        def recording_load(path, safe_load=True):
+            filler_at_read.append(advanced_lora_stacker.LORA_CACHE.stats()["entries"] > 0)
+            return load_torch_file(path, safe_load)
+
+        results = {}
+        MockComfy.utils.load_torch_file = staticmethod(recording_load)
+        try:
+            for label, max_bytes in (("fits", tensor_bytes * 3 // 2), ("too large", tensor_bytes // 2)):
+                cache = LoraCache(max_bytes)
+                cache.put(("filler",), {"weight": filler["weight"][: max_bytes // 2]})
+                advanced_lora_stacker.LORA_CACHE = cache
+                load_lora_file(path)
+                results[label] = (filler_at_read[-1], cache.peek(("filler",)) is not None, cache.stats()["entries"])
+        finally:
+            MockComfy.utils.load_torch_file = staticmethod(load_torch_file)
+
+    print(f"Fits: filler at read {results['fits'][0]}, kept {results['fits'][1]} (expected: False, False)")
+    print(f"Too large: filler at read {results['too large'][0]}, kept {results['too large'][1]} (expected: True, True)")
+    assert results["fits"] == (False, False, 1)
+    assert results["too large"] == (True, True, 1)
+    print()
+
+
+def run_all_tests():
+    """Run all tests"""
+    print("=" * 60)
+    print("LoRA Metadata Index - Tests")
+    print("=" * 60)
+    print()
+
+    test_header_only_metadata()
+    test_incremental_updates()
+    test_duplicates_share_cache()
+    test_hashing_off_load_path()
+    test_cache_sized_from_header()
+
+    print("=" * 60)
+    print("All tests completed!")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    run_all_tests()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Test script for the cached LoRA list served to the frontend
+Tests ETag stability, filesystem-change invalidation and If-None-Match matching
+"""
+
+import os
+import sys
+import tempfile
+
+# Mock the ComfyUI imports since we're testing standalone
+LIST_CALLS = []
+
+
+class MockFolderPaths:
+    lora_dir = None
+
+    @staticmethod
+    def get_full_path(folder, filename):
+        return os.path.join(MockFolderPaths.lora_dir, filename)
+
+    @staticmethod
+    def get_folder_paths(folder):
+        return [MockFolderPaths.lora_dir]
+
+    @staticmethod
+    def get_filename_list(folder):
+        LIST_CALLS.append(folder)
+        names = []
+        for dirpath, _, filenames in os.walk(MockFolderPaths.lora_dir):
+            for filename in filenames:
+                names.append(os.path.relpath(os.path.join(dirpath, filename), MockFolderPaths.lora_dir))
+        return sorted(names)
+
+class MockComfy:
+    class sd:
+        @staticmethod
+        def load_lora_for_models(model, clip, lora, model_strength, clip_strength):
+            return model, clip
+
+    class utils:
+        @staticmethod
+        def load_torch_file(path, safe_load=True):
+            return {}
+
+sys.modules['folder_paths'] = MockFolderPaths
+sys.modules['comfy'] = MockComfy
+sys.modules['comfy.sd'] = MockComfy.sd
+sys.modules['comfy.utils'] = MockComfy.utils
+
+from advanced_lora_stacker import LoraListCache, etag_matches
+
+
+def touch(path):
+    with open(path, "wb") as f:
+        f.write(b"\0")
+
+
+def test_unchanged_list_is_cached():
+    """Test that repeated requests reuse the listing and its ETag"""
+    print("Test 1: Unchanged Folder")
+    print("-" * 60)
+
+    LIST_CALLS.clear()
+    with tempfile.TemporaryDirectory() as tmp:
+        MockFolderPaths.lora_dir = tmp
+        touch(os.path.join(tmp, "a.safetensors"))
+        cache = LoraListCache()
+        names, body, etag = cache.get()
+        _, _, etag_again = cache.get()
+
+    print(f"Names: {names}")
+    print(f"Listings built: {len(LIST_CALLS)} (expected: 1)")
+    print(f"Stable ETag: {etag == etag_again}")
+    assert names == ["a.safetensors"] and len(LIST_CALLS) == 1 and etag == etag_again
+    assert body == b'{"loras": ["a.safetensors"]}'
+    print()
+
+
+def test_invalidation_on_change():
+    """Test that adding files, including in subdirectories, rebuilds the list"""
+    print("Test 2: Filesystem Changes")
+    print("-" * 60)
+
+    LIST_CALLS.clear()
+    with tempfile.TemporaryDirectory() as tmp:
+        MockFolderPaths.lora_dir = tmp
+        os.mkdir(os.path.join(tmp, "styles"))
+        touch(os.path.join(tmp, "a.safetensors"))
+        cache = LoraListCache()
+        _, _, first_etag = cache.get()
+
+        touch(os.path.join(tmp, "styles", "b.safetensors"))
+        names, _, second_etag = cache.get()
+
+        os.mkdir(os.path.join(tmp, "characters"))
+        touch(os.path.join(tmp, "characters", "c.safetensors"))
+        names_after_new_dir, _, _ = cache.get()
+
+    print(f"After subdirectory change: {names}")
+    print(f"After new directory: {names_after_new_dir}")
+    print(f"ETag changed: {first_etag != second_etag}")
+    assert names == ["a.safetensors", os.path.join("styles", "b.safetensors")]
+    assert os.path.join("characters", "c.safetensors") in names_after_new_dir
+    assert first_etag != second_etag and len(LIST_CALLS) == 3
+    print()
+
+
+def test_etag_matching():
+    """Test If-None-Match parsing"""
+    print("Test 3: If-None-Match")
+    print("-" * 60)
+
+    etag = '"abc"'
+    cases = [
+        (None, False),
+        ('"abc"', True),
+        ('W/"abc"', True),
+        ('"xyz", "abc"', True),
+        ('"xyz"', False),
+        ("*", True),
+    ]
+    for header, expected in cases:
+        result = etag_matches(header, etag)
+        print(f"  {header!r:>16} -> {result} (expected: {expected})")
+        assert result == expected
+    print()
+
+
+def run_all_tests():
+    """Run all tests"""
+    print("=" * 60)
+    print("LoRA List Route - Tests")
+    print("=" * 60)
+    print()
+
+    test_unchanged_list_is_cached()
+    test_invalidation_on_change()
+    test_etag_matching()
+
+    print("=" * 60)
+    print("All tests completed!")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    run_all_tests()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Test script for reduced-precision LoRA storage
+Tests memory savings, cache behaviour and the accuracy delta of fp16/bf16 storage
+"""
+
+import os
+import sys
+import tempfile
+
+import torch
+from safetensors.torch import load_file, save_file
+
+# Mock the ComfyUI imports since we're testing standalone
+LOAD_CALLS = []
+
+
+class MockFolderPaths:
+    @staticmethod
+    def get_full_path(folder, filename):
+        return filename
+
+class MockComfy:
+    class sd:
+        @staticmethod
+        def load_lora_for_models(model, clip, lora, model_strength, clip_strength):
+            return model, clip
+
+    class utils:
+        @staticmethod
+        def load_torch_file(path, safe_load=True):
+            LOAD_CALLS.append(path)
+            return load_file(path)
+
+sys.modules['folder_paths'] = MockFolderPaths
+sys.modules['comfy'] = MockComfy
+sys.modules['comfy.sd'] = MockComfy.sd
+sys.modules['comfy.utils'] = MockComfy.utils
+
+import advanced_lora_stacker
+from advanced_lora_stacker import LoraCache, _state_dict_nbytes, load_lora_file
+
+KEY_COUNT = 8
+RANK = 16
+DIM = 320
+
+
+def write_fp32_lora(directory, name="a.safetensors"):
+    """Write a kohya-style fp32 LoRA with weights on the scale trained LoRAs use"""
+    generator = torch.Generator().manual_seed(0)
+    tensors = {}
+    for i in range(KEY_COUNT):
+        prefix = f"lora_unet_output_blocks_{i}_1_proj_in"
+        tensors[f"{prefix}.lora_up.weight"] = torch.randn(DIM, RANK, generator=generator) * 0.01
+        tensors[f"{prefix}.lora_down.weight"] = torch.randn(RANK, DIM, generator=generator) * 0.05
+        tensors[f"{prefix}.alpha"] = torch.tensor(8.0)
+    path = os.path.join(directory, name)
+    save_file(tensors, path)
+    return path
+
+
+def weight_deltas(lora):
+    """Per-key LoRA weight deltas, computed in fp32 as ComfyUI does"""
+    deltas = {}
+    for key in lora:
+        if key.endswith(".lora_up.weight"):
+            prefix = key[:-len(".lora_up.weight")]
+            up = lora[key].float()
+            down = lora[f"{prefix}.lora_down.weight"].float()
+            alpha = lora[f"{prefix}.alpha"].item()
+            deltas[prefix] = (alpha / down.shape[0]) * torch.mm(up, down)
+    return deltas
+
+
+def test_memory_halved():
+    """Test that fp16 storage halves the resident bytes and leaves alpha untouched"""
+    print("Test 1: Memory Savings")
+    print("-" * 60)
+
+    advanced_lora_stacker.LORA_CACHE = LoraCache(2**30)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_fp32_lora(tmp)
+        original = load_lora_file(path)
+        original_bytes = advanced_lora_stacker.LORA_CACHE.stats()["bytes"]
+        advanced_lora_stacker.LORA_CACHE.clear()
+        half = load_lora_file(path, precision="fp16")
+        half_bytes = advanced_lora_stacker.LORA_CACHE.stats()["bytes"]
+
+    alpha_key = "lora_unet_output_blocks_0_1_proj_in.alpha"
+    print(f"Original: {original_bytes} bytes, fp16: {half_bytes} bytes")
+    print(f"Alpha dtype: {half[alpha_key].dtype} (expected: torch.float32)")
+    assert half_bytes == _state_dict_nbytes(half)
+    assert half_bytes < 0.51 * original_bytes
+    assert half[alpha_key].dtype == torch.float32
+    print()
+
+
+def test_only_reduced_copy_cached():
+    """Test that the cache keeps only the reduced copy and derives it from a cached original"""
+    print("Test 2: Cache Policy")
+    print("-" * 60)
+
+    advanced_lora_stacker.LORA_CACHE = LoraCache(2**30)
+    LOAD_CALLS.clear()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_fp32_lora(tmp)
+        load_lora_file(path, precision="bf16")
+        entries_after_bf16 = advanced_lora_stacker.LORA_CACHE.stats()["entries"]
+        load_lora_file(path, precision="bf16")
+        load_lora_file(path)
+        derived = load_lora_file(path, precision="fp16")
+
+    dtypes = {str(v.dtype) for v in derived.values() if v.dim() > 0}
+    print(f"Entries after bf16 load: {entries_after_bf16} (expected: 1)")
+    print(f"Disk loads: {len(LOAD_CALLS)} (expected: 2)")
+    print(f"Derived fp16 dtypes: {dtypes}")
+    assert entries_after_bf16 == 1 and len(LOAD_CALLS) == 2 and dtypes == {"torch.float16"}
+    print()
+
+
+def test_accuracy_delta():
+    """Measure the error reduced-precision storage introduces in the patched weight deltas"""
+    print("Test 3: Accuracy Delta")
+    print("-" * 60)
+
+    advanced_lora_stacker.LORA_CACHE = LoraCache(2**30)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_fp32_lora(tmp)
+        reference = weight_deltas(load_lora_file(path))
+        results = {}
+        for precision in ("fp16", "bf16"):
+            deltas = weight_deltas(load_lora_file(path, precision=precision))
+            max_abs = max((deltas[k] - reference[k]).abs().max().item() for k in reference)
+            rel = max(
+                ((deltas[k] - reference[k]).norm() / reference[k].norm()).item() for k in reference
+            )
+            results[precision] = (max_abs, rel)
+            print(f"{precision}: max abs error {max_abs:.2e}, max relative error {rel:.2e}")
+
+    assert results["fp16"][1] < 1e-3
+    assert results["bf16"][1] < 1e-2
+    print()
+
+
+def run_all_tests():
+    """Run all tests"""
+    print("=" * 60)
+    print("LoRA Storage Precision - Tests")
+    print("=" * 60)
+    print()
+
+    test_memory_halved()
+    test_only_reduced_copy_cached()
+    test_accuracy_delta()
+
+    print("=" * 60)
+    print("All tests completed!")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    run_all_tests()
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+Test script for low-rank fusion of LoRAs that target the same weights
+Tests that one fused higher-rank patch reproduces the sum of the individual deltas,
+that fused patches survive a round trip through the disk cache, and that fused stacks
+report unloaded keys like unfused ones
+"""
+
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import types
+
+import torch
+from safetensors.torch import save_file
+
+# Mock the ComfyUI imports since we're testing standalone
+class MockFolderPaths:
+    @staticmethod
+    def get_full_path(folder, filename):
+        return f"/mock/path/{folder}/{filename}"
+
+class MockComfy:
+    class sd:
+        @staticmethod
+        def load_lora_for_models(model, clip, lora, model_strength, clip_strength):
+            return model, clip
+
+    class utils:
+        @staticmethod
+        def load_torch_file(path, safe_load=True):
+            # One UNet and one CLIP LoRA weight per file, e.g. u_aa and c_aa for aa.safetensors
+            generator = torch.Generator().manual_seed(len(path))
+            name = os.path.splitext(os.path.basename(path))[0]
+            return {
+                f"{prefix}_{name}": (torch.randn(16, 4, generator=generator), torch.randn(4, 16, generator=generator))
+                for prefix in ("u", "c")
+            }
+
+    class lora:
+        names = ("aa", "bb")
+
+        @staticmethod
+        def model_lora_keys_unet(model, key_map):
+            key_map.update({f"u_{name}": f"u.w{name}" for name in MockComfy.lora.names})
+            return key_map
+
+        @staticmethod
+        def model_lora_keys_clip(model, key_map):
+            key_map.update({f"c_{name}": f"c.w{name}" for name in MockComfy.lora.names})
+            return key_map
+
+        @staticmethod
+        def load_lora(lora, key_map):
+            return {key_map[k]: ("lora", (up, down, None, None, None)) for k, (up, down) in lora.items() if k in key_map}
+
+sys.modules['folder_paths'] = MockFolderPaths
+sys.modules['comfy'] = MockComfy
+sys.modules['comfy.sd'] = MockComfy.sd
+sys.modules['comfy.utils'] = MockComfy.utils
+sys.modules['comfy.lora'] = MockComfy.lora
+
+from advanced_lora_stacker import AdvancedLoraStacker, FusedPatchCache, fuse_lora_patches
+
+
+class MockPatcher:
+    """Accepts every patch, like a ModelPatcher/CLIP that has all the targeted weights"""
+    def __init__(self, patches=None):
+        self.model = self
+        self.cond_stage_model = self
+        self.patches = dict(patches or {})
+
+    def clone(self):
+        return MockPatcher(self.patches)
+
+    def add_patches(self, patches, strength_patch=1.0, strength_model=1.0):
+        self.patches.update(patches)
+        return list(patches.keys())
+
+
+class MockLoRAAdapter:
+    """Stand-in for comfy.weight_adapter.LoRAAdapter"""
+    name = "lora"
+
+    def __init__(self, loaded_keys, weights):
+        self.loaded_keys = loaded_keys
+        self.weights = weights
+
+
+# Registered where ComfyUI defines it, the only adapter class the disk cache rebuilds
+MockLoRAAdapter.__module__ = "comfy.weight_adapter.lora"
+MockLoRAAdapter.__qualname__ = "LoRAAdapter"
+sys.modules['comfy.weight_adapter'] = types.ModuleType("comfy.weight_adapter")
+sys.modules['comfy.weight_adapter.lora'] = types.ModuleType("comfy.weight_adapter.lora")
+sys.modules['comfy.weight_adapter.lora'].LoRAAdapter = MockLoRAAdapter
+
+
+def lora_delta(up, down, alpha, strength):
+    """Delta of one LoRA patch, computed the way ComfyUI does"""
+    scale = alpha / down.shape[0] if alpha is not None else 1.0
+    return strength * scale * torch.mm(up.flatten(1), down.flatten(1))
+
+
+def random_lora(out_dim, in_dim, rank, alpha, generator):
+    up = torch.randn(out_dim, rank, generator=generator)
+    down = torch.randn(rank, in_dim, generator=generator)
+    return up, down, alpha
+
+
+def test_fused_delta_matches():
+    """Test that the fused patch equals the strength-weighted sum of the separate patches"""
+    print("Test 1: Fused Delta Matches Separate Patches")
+    print("-" * 60)
+
+    generator = torch.Generator().manual_seed(0)
+    loras = [random_lora(64, 48, rank, alpha, generator) for rank, alpha in [(4, 4.0), (8, 1.0), (16, None)]]
+    strengths = [0.35, 0.5, 0.15]
+    weighted = [({"w": ("lora", (up, down, alpha, None, None))}, s) for (up, down, alpha), s in zip(loras, strengths)]
+
+    fused, leftovers = fuse_lora_patches(weighted, {"w"})
+    kind, (up, down, alpha, mid, dora) = fused["w"]
+    expected = sum(lora_delta(u, d, a, s) for (u, d, a), s in zip(loras, strengths))
+    actual = lora_delta(up, down, alpha, 1.0)
+    max_error = (actual - expected).abs().max().item()
+
+    print(f"Fused rank: {down.shape[0]} (expected: 28)")
+    print(f"Leftovers: {len(leftovers)} (expected: 0)")
+    print(f"Max abs error: {max_error:.2e}")
+    assert down.shape[0] == 28 and not leftovers and max_error < 1e-4
+    print()
+
+
+def test_adapter_patches():
+    """Test fusion of weight adapter objects used by newer ComfyUI"""
+    print("Test 2: Weight Adapter Patches")
+    print("-" * 60)
+
+    generator = torch.Generator().manual_seed(1)
+    (u1, d1, a1), (u2, d2, a2) = random_lora(32, 32, 4, 2.0, generator), random_lora(32, 32, 8, 8.0, generator)
+    weighted = [
+        ({"w": MockLoRAAdapter(set(), (u1, d1, a1, None, None, None))}, 0.7),
+        ({"w": MockLoRAAdapter(set(), (u2, d2, a2, None, None, None))}, 0.3),
+    ]
+
+    fused, leftovers = fuse_lora_patches(weighted, {"w"})
+    up, down, alpha = fused["w"].weights[:3]
+    expected = lora_delta(u1, d1, a1, 0.7) + lora_delta(u2, d2, a2, 0.3)
+    max_error = (lora_delta(up, down, alpha, 1.0) - expected).abs().max().item()
+
+    print(f"Fused patch type: {type(fused['w']).__name__}")
+    print(f"Max abs error: {max_error:.2e}")
+    assert isinstance(fused["w"], MockLoRAAdapter) and max_error < 1e-4
+    print()
+
+
+def test_unfusable_patches_kept():
+    """Test that LoCon mid weights, foreign keys and mismatched shapes are left alone"""
+    print("Test 3: Unfusable Patches")
+    print("-" * 60)
+
+    generator = torch.Generator().manual_seed(2)
+    up, down, alpha = random_lora(16, 16, 4, 4.0, generator)
+    conv_up = torch.randn(16, 4, 1, 1, generator=generator)
+    conv_down_3x3 = torch.randn(4, 16, 3, 3, generator=generator)
+    conv_down_1x1 = torch.randn(4, 16, 1, 1, generator=generator)
+    mid = torch.randn(4, 4, 3, 3, generator=generator)
+
+    weighted = [
+        ({"a": ("lora", (up, down, alpha, mid, None)), "b": ("lora", (up, down, alpha, None, None)),
+          "conv": ("lora", (conv_up, conv_down_3x3, None, None, None))}, 0.5),
+        ({"b": ("lora", (up, down, alpha, None, None)), "clip": ("lora", (up, down, alpha, None, None)),
+          "conv": ("lora", (conv_up, conv_down_1x1, None, None, None))}, 0.5),
+    ]
+
+    fused, leftovers = fuse_lora_patches(weighted, {"a", "b", "conv"})
+    leftover_keys = sorted(key for patches, _ in leftovers for key in patches)
+
+    print(f"Fused keys: {sorted(fused)} (expected: ['b'])")
+    print(f"Leftover keys: {leftover_keys} (expected: ['a', 'conv', 'conv'])")
+    assert sorted(fused) == ["b"] and leftover_keys == ["a", "conv", "conv"]
+    print()
+
+
+def test_disk_cache_round_trip():
+    """Test that fused patches written by one cache instance are read back by a fresh one"""
+    print("Test 4: Disk Cache Round Trip")
+    print("-" * 60)
+
+    generator = torch.Generator().manual_seed(3)
+    (u1, d1, a1), (u2, d2, a2) = random_lora(32, 24, 4, 4.0, generator), random_lora(32, 24, 8, None, generator)
+    tuple_fused, _ = fuse_lora_patches(
+        [({"w": ("lora", (u1, d1, a1, None, None))}, 0.6), ({"w": ("lora", (u2, d2, a2, None, None))}, 0.4)], {"w"}
+    )
+    adapter_fused, _ = fuse_lora_patches(
+        [({("qkv", (0, 0, 32)): MockLoRAAdapter(set(), (u1, d1, a1, None, None, None))}, 0.5)],
+        {("qkv", (0, 0, 32))},
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        writer = FusedPatchCache(tmp, 2**30)
+        key = FusedPatchCache.make_key(("stack",), (("Model", "abc"), None))
+        writer.put(key, {"model": tuple_fused, "clip": adapter_fused})
+        writer.flush()
+
+        # A new instance stands in for the cache after a restart
+        reader = FusedPatchCache(tmp, 2**30)
+        stored = reader.get(key)
+        missing = reader.get(FusedPatchCache.make_key(("other",), None))
+
+    kind, (up, down, alpha, _, _) = stored["model"]["w"]
+    adapter = stored["clip"][("qkv", (0, 0, 32))]
+    expected = lora_delta(u1, d1, a1, 0.6) + lora_delta(u2, d2, a2, 0.4)
+    max_error = (lora_delta(up, down, alpha, 1.0) - expected).abs().max().item()
+
+    print(f"Model patch kind: {kind}, clip patch type: {type(adapter).__name__}")
+    print(f"Max abs error after reload: {max_error:.2e}")
+    print(f"Unknown stack: {missing} (expected: None)")
+    assert kind == "lora" and isinstance(adapter, MockLoRAAdapter) and max_error < 1e-5
+    assert missing is None and reader.hits == 1 and reader.misses == 1
+    print()
+
+
+def test_disk_cache_lru_cleanup():
+    """Test that the least recently used files are removed once the directory exceeds its cap"""
+    print("Test 5: Disk Cache LRU Cleanup")
+    print("-" * 60)
+
+    generator = torch.Generator().manual_seed(4)
+    up, down, alpha = random_lora(64, 64, 16, None, generator)
+    patches = {"model": {"w": ("lora", (up, down, alpha, None, None))}, "clip": {}}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        probe = FusedPatchCache(tmp, 2**30)
+        probe.put("probe", patches)
+        probe.flush()
+        file_size = os.path.getsize(os.path.join(tmp, "probe.safetensors"))
+        os.remove(os.path.join(tmp, "probe.safetensors"))
+
+        cache = FusedPatchCache(tmp, int(file_size * 2.5))
+        for key in ("a", "b"):
+            cache.put(key, patches)
+            cache.flush()
+            time.sleep(0.01)
+        cache.get("a")  # a is now most recently used
+        time.sleep(0.01)
+        cache.put("c", patches)  # evicts b
+        cache.flush()
+        remaining = sorted(name for name in os.listdir(tmp))
+
+    print(f"Remaining files: {remaining} (expected: a and c)")
+    assert remaining == ["a.safetensors", "c.safetensors"]
+    print()
+
+
+def test_disk_cache_refuses_unknown_kinds():
+    """Test that a cache file naming another patch class is a miss, and the class is never imported"""
+    print("Test 6: Disk Cache Patch Kinds")
+    print("-" * 60)
+
+    up, down = torch.randn(8, 2), torch.randn(2, 8)
+    metadata = {
+        "format": FusedPatchCache.FORMAT, "model_keys": repr(["w"]), "model_kind": "this:Zen",
+        "model_weights": "5", "clip_keys": repr([]), "clip_kind": "", "clip_weights": "0",
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = FusedPatchCache(tmp, 2**30)
+        save_file({"model.0.up": up, "model.0.down": down}, os.path.join(tmp, "forged.safetensors"), metadata=metadata)
+        stored = cache.get("forged")
+        removed = not os.path.exists(os.path.join(tmp, "forged.safetensors"))
+
+        class OtherPatch(MockLoRAAdapter):
+            pass
+        OtherPatch.__module__ = "other_module"
+        accepted = cache.put("other", {"model": {"w": OtherPatch(set(), (up, down, None, None, None))}, "clip": {}})
+
+    print(f"Forged file: {stored} (expected: None), removed: {removed}, imported: {'this' in sys.modules}")
+    print(f"Storing another adapter class: {accepted} (expected: False)")
+    assert stored is None and removed and cache.misses == 1 and "this" not in sys.modules
+    assert accepted is False
+    print()
+
+
+def test_zero_strength_not_reported():
+    """Test that a group member resolved to strength 0 is not reported as unloaded when fusing"""
+    print("Test 7: Zero-Strength Member")
+    print("-" * 60)
+
+    class Capture(logging.Handler):
+        def __init__(self):
+            super().__init__()
+            self.messages = []
+
+        def emit(self, record):
+            self.messages.append(record.getMessage())
+
+    # The locked member takes the whole group maximum, leaving 0 for the other one
+    stack_data = json.dumps({
+        "groups": [{"id": 1, "index": 1, "max_model": 1.0, "max_clip": 1.0}],
+        "loras": [
+            {"id": 1, "group_id": 1, "name": "aa.safetensors", "preset": "Full",
+             "lock_model": True, "locked_model_value": 1.0, "lock_clip": True, "locked_clip_value": 1.0},
+            {"id": 2, "group_id": 1, "name": "bb.safetensors", "preset": "Full"},
+        ],
+    })
+    capture = Capture()
+    logging.getLogger("advanced_lora_stacker").addHandler(capture)
+    try:
+        reported = {}
+        for fuse in (False, True):
+            capture.messages.clear()
+            _, _, info = AdvancedLoraStacker().apply_loras(
+                MockPatcher(), MockPatcher(), 5, stack_data, fuse_low_rank=fuse
+            )
+            reported[fuse] = [m for m in capture.messages if m.startswith("NOT LOADED")]
+    finally:
+        logging.getLogger("advanced_lora_stacker").removeHandler(capture)
+
+    print(f"bb strengths: {[line for line in info.splitlines() if 'bb.safetensors' in line]}")
+    print(f"Unfused warnings: {reported[False]}, fused warnings: {reported[True]} (expected: none)")
+    assert "M:0.0000 C:0.0000" in info
+    assert reported[False] == reported[True] == []
+    print()
+
+
+def run_all_tests():
+    """Run all tests"""
+    print("=" * 60)
+    print("Low-Rank Fusion - Tests")
+    print("=" * 60)
+    print()
+
+    test_fused_delta_matches()
+    test_adapter_patches()
+    test_unfusable_patches_kept()
+    test_disk_cache_round_trip()
+    test_disk_cache_lru_cleanup()
+    test_disk_cache_refuses_unknown_kinds()
+    test_zero_strength_not_reported()
+
+    print("=" * 60)
+    print("All tests completed!")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    run_all_tests()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Test script for the process-wide memory budget
+Tests the byte cap, the free-RAM threshold and tracking of handed-out patches
+"""
+
+import gc
+import os
+import sys
+import tempfile
+
+# Mock the ComfyUI imports since we're testing standalone
+class FakeTensor:
+    """Minimal stand-in for a torch tensor: only what the cache needs for byte accounting"""
+    def __init__(self, nbytes):
+        self.nbytes = nbytes
+
+    def numel(self):
+        return self.nbytes
+
+    def element_size(self):
+        return 1
+
+
+class MockFolderPaths:
+    @staticmethod
+    def get_full_path(folder, filename):
+        return filename
+
+class MockComfy:
+    class sd:
+        @staticmethod
+        def load_lora_for_models(model, clip, lora, model_strength, clip_strength):
+            return model, clip
+
+    class utils:
+        @staticmethod
+        def load_torch_file(path, safe_load=True):
+            with open(path, "rb") as f:
+                return {"weight": FakeTensor(len(f.read()))}
+
+sys.modules['folder_paths'] = MockFolderPaths
+sys.modules['comfy'] = MockComfy
+sys.modules['comfy.sd'] = MockComfy.sd
+sys.modules['comfy.utils'] = MockComfy.utils
+
+import advanced_lora_stacker
+from advanced_lora_stacker import LoraCache, MemoryBudget, load_lora_file
+
+
+def write_lora(directory, name, size):
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.write(b"\0" * size)
+    return path
+
+
+def cache_budget(cache, max_bytes=0, min_free_bytes=0):
+    budget = MemoryBudget(max_bytes, min_free_bytes)
+    budget.register("lora_cache", lambda: cache.current_bytes, cache.evict_bytes)
+    return budget
+
+
+def test_byte_cap():
+    """Test that the global cap evicts least recently used LoRAs across all loads"""
+    print("Test 1: Global Byte Cap")
+    print("-" * 60)
+
+    original_cache, original_budget = advanced_lora_stacker.LORA_CACHE, advanced_lora_stacker.MEMORY_BUDGET
+    advanced_lora_stacker.LORA_CACHE = LoraCache(10_000)
+    advanced_lora_stacker.MEMORY_BUDGET = cache_budget(advanced_lora_stacker.LORA_CACHE, max_bytes=250)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for name in ("a", "b", "c"):
+                load_lora_file(write_lora(tmp, f"{name}.safetensors", 100))
+        stats = advanced_lora_stacker.MEMORY_BUDGET.stats()
+    finally:
+        advanced_lora_stacker.LORA_CACHE, advanced_lora_stacker.MEMORY_BUDGET = original_cache, original_budget
+
+    print(f"Usage: {stats['usage']} (cap: {stats['max_bytes']})")
+    print(f"Evictions: {stats['evictions']}, evicted bytes: {stats['evicted_bytes']} (expected: 100)")
+    assert stats["total_bytes"] <= 250 and stats["evicted_bytes"] == 100
+    print()
+
+
+def test_low_free_memory():
+    """Test that low free system RAM evicts enough to restore the threshold"""
+    print("Test 2: Free RAM Threshold")
+    print("-" * 60)
+
+    cache = LoraCache(10_000)
+    for i in range(5):
+        cache.put(("lora", i), {"weight": FakeTensor(100)})
+    budget = cache_budget(cache, min_free_bytes=1000)
+
+    original = advanced_lora_stacker.available_memory_bytes
+    advanced_lora_stacker.available_memory_bytes = lambda: 750
+    try:
+        freed = budget.enforce()
+    finally:
+        advanced_lora_stacker.available_memory_bytes = original
+
+    print(f"Freed: {freed} bytes (expected: 300 to cover a 250 byte shortfall)")
+    print(f"Cache entries left: {cache.stats()['entries']} (expected: 2)")
+    assert freed == 300 and cache.stats()["entries"] == 2
+    assert cache.peek(("lora", 4)) is not None and cache.peek(("lora", 0)) is None
+    print()
+
+
+def test_tracked_owner_bytes():
+    """Test that bytes handed out with an owner are counted until the owner is collected"""
+    print("Test 3: Tracked Patch Bytes")
+    print("-" * 60)
+
+    class PatchedModel:
+        pass
+
+    budget = MemoryBudget()
+    model = PatchedModel()
+    budget.track("fused_patches", model, 4096)
+    alive = budget.usage()["fused_patches"]
+    del model
+    gc.collect()
+    released = budget.usage()["fused_patches"]
+
+    print(f"While alive: {alive} bytes, after collection: {released} bytes")
+    assert alive == 4096 and released == 0
+    print()
+
+
+def run_all_tests():
+    """Run all tests"""
+    print("=" * 60)
+    print("Memory Budget - Tests")
+    print("=" * 60)
+    print()
+
+    test_byte_cap()
+    test_low_free_memory()
+    test_tracked_owner_bytes()
+
+    print("=" * 60)
+    print("All tests completed!")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    run_all_tests()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Test script for per-execution memory profiling
+Tests per-LoRA attribution, the JSONL log, the info line, fused stacks and the tracemalloc lifecycle
+"""
+
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+
+import torch
+
+# Mock the ComfyUI imports since we're testing standalone
+LORA_BYTES = {"big.safetensors": 4 * 2**20, "small.safetensors": 64 * 2**10}
+
+
+class MockPatcher:
+    def __init__(self, patches=None):
+        self.model = self
+        self.cond_stage_model = self
+        self.patches = dict(patches or {})
+
+    def clone(self):
+        return MockPatcher(self.patches)
+
+    def add_patches(self, patches, strength_patch=1.0, strength_model=1.0):
+        self.patches.update(patches)
+        return list(patches.keys())
+
+
+class MockFolderPaths:
+    lora_dir = None
+
+    @staticmethod
+    def get_full_path(folder, filename):
+        return os.path.join(MockFolderPaths.lora_dir, filename)
+
+class MockComfy:
+    class sd:
+        @staticmethod
+        def load_lora_for_models(model, clip, lora, model_strength, clip_strength):
+            return model, clip
+
+    class utils:
+        @staticmethod
+        def load_torch_file(path, safe_load=True):
+            name = os.path.basename(path)
+            return {f"{name}.weight": torch.zeros(LORA_BYTES[name], dtype=torch.uint8)}
+
+    class lora:
+        @staticmethod
+        def model_lora_keys_unet(model, key_map):
+            return key_map
+
+        @staticmethod
+        def model_lora_keys_clip(model, key_map):
+            return key_map
+
+        @staticmethod
+        def load_lora(lora, key_map):
+            return {key: ("lora", value) for key, value in lora.items()}
+
+sys.modules['folder_paths'] = MockFolderPaths
+sys.modules['comfy'] = MockComfy
+sys.modules['comfy.sd'] = MockComfy.sd
+sys.modules['comfy.utils'] = MockComfy.utils
+sys.modules['comfy.lora'] = MockComfy.lora
+
+import advanced_lora_stacker
+from advanced_lora_stacker import FUSED_LORAS, AdvancedLoraStacker, LoraCache, MemoryProfiler, StageTimer
+
+
+def make_stack():
+    loras = [
+        {"id": i, "group_id": None, "name": name, "preset": "Full", "model_strength": 1.0, "clip_strength": 1.0}
+        for i, name in enumerate(LORA_BYTES)
+    ]
+    return json.dumps({"groups": [], "loras": loras})
+
+
+def run_profiled(profile_memory, fuse_low_rank=False):
+    """Apply the stack with a fresh cache; returns (info, logged reports)"""
+    advanced_lora_stacker.LORA_CACHE = LoraCache(2**30)
+    with tempfile.TemporaryDirectory() as tmp:
+        MockFolderPaths.lora_dir = tmp
+        for name in LORA_BYTES:
+            with open(os.path.join(tmp, name), "wb") as f:
+                f.write(b"\0")
+        log_path = os.path.join(tmp, "profiles", "memory_profile.jsonl")
+        os.environ["ADVANCED_LORA_STACKER_PROFILE_PATH"] = log_path
+        try:
+            _, _, info = AdvancedLoraStacker().apply_loras(
+                MockPatcher(), MockPatcher(), 7, make_stack(), profile_memory=profile_memory,
+                fuse_low_rank=fuse_low_rank,
+            )
+        finally:
+            del os.environ["ADVANCED_LORA_STACKER_PROFILE_PATH"]
+        reports = []
+        if os.path.exists(log_path):
+            with open(log_path) as f:
+                reports = [json.loads(line) for line in f]
+    return info, reports
+
+
+def test_per_lora_attribution():
+    """Test that each LoRA's tensor bytes are attributed to it and logged as JSONL"""
+    print("Test 1: Per-LoRA Attribution")
+    print("-" * 60)
+
+    info, reports = run_profiled("log")
+    assert len(reports) == 1
+    report = reports[0]
+    by_lora = report["by_lora"]
+
+    for name, expected in LORA_BYTES.items():
+        print(f"{name}: tensor delta {by_lora[name]['tensor_bytes']} (expected: {expected})")
+        assert by_lora[name]["tensor_bytes"] == expected
+    load_spans = [span for span in report["spans"] if span["stage"] == "load"]
+    print(f"Load spans with memory: {len(load_spans)} (expected: 2)")
+    print(f"Peak: {report['peak']}")
+    assert len(load_spans) == 2
+    assert report["peak"]["tensor_bytes"] >= sum(LORA_BYTES.values())
+    assert report["node"] == "AdvancedLoraStacker" and report["seed"] == 7
+    assert "Memory:" not in info
+    print()
+
+
+def test_info_line_and_off():
+    """Test that "log + info" appends the summary and "off" records nothing"""
+    print("Test 2: Info Output")
+    print("-" * 60)
+
+    info, reports = run_profiled("log + info")
+    memory_line = [line for line in info.splitlines() if line.startswith("Memory: ")]
+    summary = json.loads(memory_line[0][len("Memory: "):])
+    print(f"Summary keys: {sorted(summary)}")
+    assert len(reports) == 1 and sorted(summary) == ["by_lora", "peak"]
+
+    info, reports = run_profiled("off")
+    print(f"Reports when off: {len(reports)} (expected: 0)")
+    assert not reports and "Memory:" not in info
+    print()
+
+
+def test_fused_row():
+    """Test that with fusion the patch memory is reported on a fused row, not missing from by_lora"""
+    print("Test 3: Fused Stack")
+    print("-" * 60)
+
+    _, reports = run_profiled("log", fuse_low_rank=True)
+    by_lora = reports[0]["by_lora"]
+    fused_stages = sorted({span["stage"] for span in reports[0]["spans"] if span.get("lora") == FUSED_LORAS})
+    print(f"Rows: {sorted(by_lora)}")
+    print(f"Fused row stages: {fused_stages} (expected: ['fuse', 'patch'])")
+    assert FUSED_LORAS in by_lora and fused_stages == ["fuse", "patch"]
+    assert all(by_lora[name]["tensor_bytes"] == expected for name, expected in LORA_BYTES.items())
+    print()
+
+
+def test_heap_peak_and_tracing_lifecycle():
+    """Test that the heap peak covers transient allocations and tracemalloc is stopped afterwards"""
+    print("Test 4: Heap Peak")
+    print("-" * 60)
+
+    was_tracing = tracemalloc.is_tracing()
+    profiler = MemoryProfiler()
+    timer = StageTimer(profiler)
+    with profiler:
+        with timer.span("load", "transient"):
+            buffer = bytearray(8 * 2**20)
+            del buffer
+    peak = profiler.peak()["python_heap_bytes"]
+    delta = timer.spans[0]["memory"]["delta"]["python_heap_bytes"]
+
+    print(f"Heap peak: {peak} bytes, span delta: {delta} bytes")
+    print(f"Tracing after exit: {tracemalloc.is_tracing()} (expected: {was_tracing})")
+    assert peak >= 8 * 2**20 and abs(delta) < 2**20
+    assert tracemalloc.is_tracing() == was_tracing
+    print()
+
+
+def run_all_tests():
+    """Run all tests"""
+    print("=" * 60)
+    print("Memory Profiling - Tests")
+    print("=" * 60)
+    print()
+
+    test_per_lora_attribution()
+    test_info_line_and_off()
+    test_fused_row()
+    test_heap_peak_and_tracing_lifecycle()
+
+    print("=" * 60)
+    print("All tests completed!")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    run_all_tests()
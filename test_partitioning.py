@@ -29,7 +29,7 @@ sys.modules['comfy'] = MockComfy
 sys.modules['comfy.sd'] = MockComfy.sd
 sys.modules['comfy.utils'] = MockComfy.utils
 
-from advanced_lora_stacker import AdvancedLoraStacker
+from advanced_lora_stacker import AdvancedLoraStacker, quantize_strength
 
 
 def test_basic_partitioning():
@@ -188,6 +188,86 @@ def test_json_serialization():
     print()
 
 
+def test_batch_matches_scalar():
+    """Test that the batch API reproduces the scalar function for every seed"""
+    print("Test 7: Batch Partitioning")
+    print("-" * 60)
+    
+    node = AdvancedLoraStacker()
+    seeds = list(range(500)) + [2**32, 2**64 - 1]
+    
+    cases = [
+        (1.0, 4, None),
+        (1.0, 5, {1: 0.25, 3: 0.35}),
+        (2.0, 8, {0: 0.3}),
+        (1.0, 1, None),
+        (1.0, 3, {0: 0.3, 1: 0.4, 2: 0.3}),
+    ]
+    
+    all_match = True
+    for total, segments, locked in cases:
+        batch = node.partition_strengths_batch(total, segments, locked, seeds)
+        mismatches = sum(
+            1 for i, seed in enumerate(seeds)
+            if batch[i].tolist() != node.partition_strengths(total, segments, locked, seed)
+        )
+        all_match = all_match and mismatches == 0
+        print(f"Total: {total}, Segments: {segments}, Locked: {locked} -> mismatches: {mismatches}")
+    
+    print(f"Batch matches scalar for all seeds: {all_match}")
+    assert all_match
+    print()
+
+
+def test_quantized_partitioning():
+    """Test that quantized partitions stay on the grid, keep locks and sum to the total"""
+    print("Test 8: Quantized Partitioning (step 0.05)")
+    print("-" * 60)
+    
+    node = AdvancedLoraStacker()
+    seeds = list(range(500))
+    step = 0.05
+    
+    cases = [
+        (1.0, 4, None),
+        (1.0, 5, {1: 0.25, 3: 0.35}),
+        (2.0, 8, {0: 0.3}),
+        (1.0, 3, {0: 0.33}),
+    ]
+    
+    for total, segments, locked in cases:
+        rows = [node.partition_strengths(total, segments, locked, seed, step) for seed in seeds]
+        unlocked = [i for i in range(segments) if i not in (locked or {})]
+        remaining = total - sum((locked or {}).values())
+        # Values that are not whole steps can only come from a remaining that is not a whole number of steps
+        off_grid = sum(
+            1 for row in rows for i in unlocked
+            if abs(row[i] / step - round(row[i] / step)) > 1e-6
+        )
+        sums_ok = all(abs(sum(row) - total) < 1e-9 for row in rows)
+        locks_ok = all(row[i] == v for row in rows for i, v in (locked or {}).items())
+        distinct = len({tuple(row) for row in rows})
+        batch = node.partition_strengths_batch(total, segments, locked, seeds, step).tolist()
+        
+        print(f"Total: {total}, Segments: {segments}, Locked: {locked} -> "
+              f"{distinct} distinct vectors over {len(seeds)} seeds, off-grid values: {off_grid}")
+        assert sums_ok and locks_ok and batch == rows
+        if abs(remaining / step - round(remaining / step)) < 1e-9:
+            assert off_grid == 0
+        else:
+            assert off_grid <= len(seeds)
+    
+    print("Sums, locks and batch results match: True")
+    
+    # Ungrouped random ranges snap to the nearest grid point inside the range
+    snapped = [quantize_strength(v, 0.2, 0.8, step) for v in (0.4321, 0.2013, 0.7999)]
+    narrow = quantize_strength(0.2213, 0.21, 0.24, step)
+    print(f"Range 0.2-0.8 snaps 0.4321, 0.2013, 0.7999 to {snapped} (expected: [0.45, 0.2, 0.8])")
+    print(f"Range 0.21-0.24 without grid point keeps: {narrow} (expected: 0.2213)")
+    assert snapped == [0.45, 0.2, 0.8] and narrow == 0.2213
+    print()
+
+
 def run_all_tests():
     """Run all tests"""
     print("=" * 60)
@@ -201,6 +281,8 @@ def run_all_tests():
     test_seed_reproducibility()
     test_edge_cases()
     test_json_serialization()
+    test_batch_matches_scalar()
+    test_quantized_partitioning()
     
     print("=" * 60)
     print("All tests completed!")
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Test script for block-targeted LoRA presets
+Tests mapping of LoRA keys to preset blocks and key filtering
+"""
+
+import sys
+
+# Mock the ComfyUI imports since we're testing standalone
+class MockFolderPaths:
+    @staticmethod
+    def get_full_path(folder, filename):
+        return f"/mock/path/{folder}/{filename}"
+
+class MockComfy:
+    class sd:
+        @staticmethod
+        def load_lora_for_models(model, clip, lora, model_strength, clip_strength):
+            return model, clip
+
+    class utils:
+        @staticmethod
+        def load_torch_file(path, safe_load=True):
+            return {}
+
+sys.modules['folder_paths'] = MockFolderPaths
+sys.modules['comfy'] = MockComfy
+sys.modules['comfy.sd'] = MockComfy.sd
+sys.modules['comfy.utils'] = MockComfy.utils
+
+from advanced_lora_stacker import PRESET_BLOCKS, select_block_keys
+
+
+def kohya_sd15_keys():
+    """Keys shaped like a kohya SD1.5 LoRA: text encoder plus attention blocks"""
+    keys = ["lora_te_text_model_encoder_layers_0_mlp_fc1.lora_up.weight"]
+    for i in (1, 2, 4, 5, 7, 8):
+        keys.append(f"lora_unet_input_blocks_{i}_1_proj_in.lora_up.weight")
+    keys.append("lora_unet_middle_block_1_proj_in.lora_up.weight")
+    for i in range(3, 12):
+        keys.append(f"lora_unet_output_blocks_{i}_1_proj_in.lora_up.weight")
+    return keys
+
+
+def test_full_preset_keeps_everything():
+    """Test that the Full preset does not drop any key"""
+    print("Test 1: Full Preset")
+    print("-" * 60)
+
+    keys = kohya_sd15_keys()
+    selected = select_block_keys(keys, PRESET_BLOCKS["Full"])
+
+    print(f"Kept {len(selected)}/{len(keys)} keys")
+    print(f"Match: {selected == keys}")
+    assert selected == keys
+    print()
+
+
+def test_fix_hands_preset():
+    """Test that Fix Hands keeps only late output blocks and the text encoder"""
+    print("Test 2: Fix Hands Preset (blocks 8-11)")
+    print("-" * 60)
+
+    selected = select_block_keys(kohya_sd15_keys(), PRESET_BLOCKS["Fix Hands"])
+    expected = ["lora_te_text_model_encoder_layers_0_mlp_fc1.lora_up.weight"] + [
+        f"lora_unet_output_blocks_{i}_1_proj_in.lora_up.weight" for i in range(4, 12)
+    ]
+
+    for key in selected:
+        print(f"  {key}")
+    print(f"Match: {selected == expected}")
+    assert selected == expected
+    print()
+
+
+def test_style_preset():
+    """Test that Style keeps input blocks and the middle block"""
+    print("Test 3: Style Preset (blocks 0-5)")
+    print("-" * 60)
+
+    selected = select_block_keys(kohya_sd15_keys(), PRESET_BLOCKS["Style"])
+    has_output = any("output_blocks" in k for k in selected)
+    has_middle = any("middle_block" in k for k in selected)
+    num_input = sum(1 for k in selected if "input_blocks" in k)
+
+    print(f"Input blocks kept: {num_input} (expected: 6)")
+    print(f"Middle block kept: {has_middle} (expected: True)")
+    print(f"Output blocks kept: {has_output} (expected: False)")
+    assert num_input == 6 and has_middle and not has_output
+    print()
+
+
+def test_sdxl_diffusers_keys():
+    """Test block mapping for SDXL-sized diffusers keys"""
+    print("Test 4: SDXL Diffusers Keys (Concept, blocks 6-11)")
+    print("-" * 60)
+
+    keys = [f"unet.down_blocks.{i}.attentions.0.to_q.lora_A.weight" for i in range(3)]
+    keys += ["unet.mid_block.attentions.0.to_q.lora_A.weight"]
+    keys += [f"unet.up_blocks.{i}.attentions.0.to_q.lora_A.weight" for i in range(3)]
+    selected = select_block_keys(keys, PRESET_BLOCKS["Concept"])
+
+    print(f"Selected: {selected}")
+    print(f"Only up blocks kept: {all('up_blocks' in k for k in selected) and len(selected) == 3}")
+    assert all("up_blocks" in k for k in selected) and len(selected) == 3
+    print()
+
+
+def run_all_tests():
+    """Run all tests"""
+    print("=" * 60)
+    print("LoRA Presets - Tests")
+    print("=" * 60)
+    print()
+
+    test_full_preset_keeps_everything()
+    test_fix_hands_preset()
+    test_style_preset()
+    test_sdxl_diffusers_keys()
+
+    print("=" * 60)
+    print("All tests completed!")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    run_all_tests()
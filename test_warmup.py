@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Test script for lazy ComfyUI imports and the background cache warm-up
+Tests that importing the module needs no ComfyUI, and that recorded LoRAs are preloaded
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import types
+
+# Mock the ComfyUI imports since we're testing standalone
+LOAD_CALLS = []
+
+
+class MockPatcher:
+    def __init__(self, patches=None):
+        self.model = self
+        self.cond_stage_model = self
+        self.patches = dict(patches or {})
+
+    def clone(self):
+        return MockPatcher(self.patches)
+
+    def add_patches(self, patches, strength_patch=1.0, strength_model=1.0):
+        self.patches.update(patches)
+        return list(patches.keys())
+
+
+class MockFolderPaths:
+    lora_dir = None
+
+    @staticmethod
+    def get_full_path(folder, filename):
+        return os.path.join(MockFolderPaths.lora_dir, filename)
+
+class MockComfy:
+    class sd:
+        @staticmethod
+        def load_lora_for_models(model, clip, lora, model_strength, clip_strength):
+            return model, clip
+
+    class utils:
+        @staticmethod
+        def load_torch_file(path, safe_load=True):
+            LOAD_CALLS.append(os.path.basename(path))
+            return {f"{os.path.basename(path)}.weight": os.path.basename(path)}
+
+    class lora:
+        @staticmethod
+        def model_lora_keys_unet(model, key_map):
+            return key_map
+
+        @staticmethod
+        def model_lora_keys_clip(model, key_map):
+            return key_map
+
+        @staticmethod
+        def load_lora(lora, key_map):
+            return {key: ("lora", value) for key, value in lora.items()}
+
+
+def test_import_without_comfyui():
+    """Test that the module imports, and builds its node mappings, without ComfyUI"""
+    print("Test 1: Lazy Imports")
+    print("-" * 60)
+
+    code = (
+        "import sys, advanced_lora_stacker as m; "
+        "print(sorted(m.NODE_CLASS_MAPPINGS)); "
+        "print('folder_paths' in sys.modules or 'comfy' in sys.modules)"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True, text=True,
+    )
+    print(result.stdout.strip())
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().splitlines()[-1] == "False"
+    print()
+
+
+sys.modules['folder_paths'] = MockFolderPaths
+sys.modules['comfy'] = MockComfy
+sys.modules['comfy.sd'] = MockComfy.sd
+sys.modules['comfy.utils'] = MockComfy.utils
+sys.modules['comfy.lora'] = MockComfy.lora
+
+import advanced_lora_stacker
+from advanced_lora_stacker import AdvancedLoraStacker, LoraCache, RecentLoras, start_warmup
+
+
+def make_stack(names):
+    loras = [
+        {"id": i, "group_id": None, "name": name, "preset": "Full", "model_strength": 1.0, "clip_strength": 1.0}
+        for i, name in enumerate(names)
+    ]
+    return json.dumps({"groups": [], "loras": loras})
+
+
+def test_record_and_persist():
+    """Test that executions record their LoRAs, newest last, and that the record survives a restart"""
+    print("Test 2: Recent LoRA Record")
+    print("-" * 60)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        MockFolderPaths.lora_dir = tmp
+        for name in ("a.safetensors", "b.safetensors", "c.safetensors"):
+            with open(os.path.join(tmp, name), "wb") as f:
+                f.write(b"\0")
+        record_path = os.path.join(tmp, "recent_loras.json")
+        advanced_lora_stacker.RECENT_LORAS = RecentLoras(record_path, max_entries=2)
+        advanced_lora_stacker.LORA_CACHE = LoraCache(2**30)
+
+        node = AdvancedLoraStacker()
+        node.apply_loras(MockPatcher(), MockPatcher(), 0, make_stack(["a.safetensors", "b.safetensors"]))
+        node.apply_loras(MockPatcher(), MockPatcher(), 0, make_stack(["c.safetensors"]))
+        restored = RecentLoras(record_path, max_entries=2).entries()
+
+    print(f"Restored: {restored}")
+    assert restored == [("b.safetensors", "Full", "original"), ("c.safetensors", "Full", "original")]
+    print()
+
+
+def test_warmup_preloads_cache():
+    """Test that a warm-up after restart makes the first execution read nothing from disk"""
+    print("Test 3: Background Warm-Up")
+    print("-" * 60)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        MockFolderPaths.lora_dir = tmp
+        names = ["a.safetensors", "b.safetensors"]
+        for name in names:
+            with open(os.path.join(tmp, name), "wb") as f:
+                f.write(b"\0")
+        record_path = os.path.join(tmp, "recent_loras.json")
+        advanced_lora_stacker.RECENT_LORAS = RecentLoras(record_path)
+        advanced_lora_stacker.LORA_CACHE = LoraCache(2**30)
+        AdvancedLoraStacker().apply_loras(MockPatcher(), MockPatcher(), 0, make_stack(names))
+
+        # Simulate a restart: empty cache, record read back from disk
+        advanced_lora_stacker.RECENT_LORAS = RecentLoras(record_path)
+        advanced_lora_stacker.LORA_CACHE = LoraCache(2**30)
+        LOAD_CALLS.clear()
+        thread = start_warmup(limit=8, delay=0.0)
+        thread.join(timeout=10)
+        warmed = list(LOAD_CALLS)
+
+        LOAD_CALLS.clear()
+        advanced_lora_stacker.RESULT_CACHE.clear()
+        AdvancedLoraStacker().apply_loras(MockPatcher(), MockPatcher(), 1, make_stack(names))
+
+    print(f"Warmed: {warmed}")
+    print(f"Disk loads on first execution: {len(LOAD_CALLS)} (expected: 0)")
+    print(f"Disabled warm-up thread: {start_warmup(limit=0)}")
+    assert sorted(warmed) == names and not LOAD_CALLS
+    assert start_warmup(limit=0) is None
+    print()
+
+
+def test_failed_save_cleans_up():
+    """Test that a failed save logs a warning and leaves no temporary file behind"""
+    print("Test 4: Failed Save")
+    print("-" * 60)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # A directory where the record should go makes the final rename fail
+        record_path = os.path.join(tmp, "recent_loras.json")
+        os.mkdir(record_path)
+        record = RecentLoras(record_path)
+        record.record([types.SimpleNamespace(name="a.safetensors", preset="Full")])
+        record.save()
+        leftovers = sorted(os.listdir(tmp))
+
+    print(f"Files after the failed save: {leftovers} (expected: ['recent_loras.json'])")
+    assert leftovers == ["recent_loras.json"]
+    print()
+
+
+def run_all_tests():
+    """Run all tests"""
+    print("=" * 60)
+    print("Lazy Imports and Warm-Up - Tests")
+    print("=" * 60)
+    print()
+
+    test_import_without_comfyui()
+    test_record_and_persist()
+    test_warmup_preloads_cache()
+    test_failed_save_cleans_up()
+
+    print("=" * 60)
+    print("All tests completed!")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    run_all_tests()